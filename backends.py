@@ -0,0 +1,444 @@
+# backends.py
+# Inference backends behind the chain: the HF pipeline (GPU, 4-bit), a CPU engine (GGUF weights on llama.cpp,
+# or HF weights with int8 dynamic quantization) and an in-process stub. Each maps the same prompt inputs to the
+# same [full_response, json] pair and reports its own throughput. BACKEND in config.py selects one.
+
+import abc
+import argparse
+import json
+import os
+import re
+import socket
+import threading
+import time
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.llms import LLM
+from langchain_core.runnables import RunnableLambda
+
+from config import BACKEND, MODEL_ID, CPU_MODEL, CPU_THREADS, CPU_CONTEXT, BACKEND_STATS
+
+# ----------------------------
+# Throughput
+# ----------------------------
+class ThroughputMeter(BaseCallbackHandler):
+    """
+    Counts notes and generated tokens of every LLM run under the chain it is attached to, and the wall time
+    during which at least one run was in flight (the runs of one padded batch overlap, so they are not summed).
+    """
+
+    def __init__(self, count_tokens):
+        self.count_tokens = count_tokens
+        self.lock = threading.Lock()
+        self.prompts = {}
+        self.active = 0
+        self.busy_since = 0.0
+        self.busy_sec = 0.0
+        self.notes = 0
+        self.generated_tokens = 0
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        with self.lock:
+            self.prompts[run_id] = prompts[0] if prompts else ""
+            if self.active == 0:
+                self.busy_since = time.perf_counter()
+            self.active += 1
+
+    def _end(self, run_id, response=None):
+        with self.lock:
+            prompt_text = self.prompts.pop(run_id, "")
+        generated = 0
+        for generations in response.generations if response is not None else []:
+            for generation in generations:
+                text = generation.text
+                generated += self.count_tokens(text[len(prompt_text):] if text.startswith(prompt_text) else text)
+        with self.lock:
+            self.active -= 1
+            if self.active == 0:
+                self.busy_sec += time.perf_counter() - self.busy_since
+            if response is not None:
+                self.notes += 1
+                self.generated_tokens += generated
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id, response)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def report(self) -> dict:
+        return {
+            "notes": self.notes,
+            "busy_sec": round(self.busy_sec, 3),
+            "notes_per_sec": self.notes / self.busy_sec if self.busy_sec else 0.0,
+            "generated_tokens": self.generated_tokens,
+            "generated_tokens_per_sec": self.generated_tokens / self.busy_sec if self.busy_sec else 0.0,
+        }
+
+def record_throughput(report: dict, path: str = BACKEND_STATS):
+    """
+    Append one run's backend report, so runs on different hardware can be compared (see throughput_table).
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), **report}) + "\n")
+
+def throughput_table(path: str = BACKEND_STATS) -> dict:
+    """
+    "backend@host" -> notes/sec and generated tokens/sec over every recorded run.
+    """
+    totals = {}
+    if not os.path.exists(path):
+        return totals
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            run = json.loads(line)
+            total = totals.setdefault(f"{run['backend']}@{run['host']}", {"runs": 0, "notes": 0, "busy_sec": 0.0,
+                                                                         "generated_tokens": 0})
+            total["runs"] += 1
+            for key in ("notes", "busy_sec", "generated_tokens"):
+                total[key] += run[key]
+    for total in totals.values():
+        busy = total["busy_sec"]
+        total["notes_per_sec"] = total["notes"] / busy if busy else 0.0
+        total["generated_tokens_per_sec"] = total["generated_tokens"] / busy if busy else 0.0
+    return totals
+
+# ----------------------------
+# Backend interface
+# ----------------------------
+class Backend(abc.ABC):
+    """
+    What the runner needs from an inference engine. `llm(batch_size, strict, max_new_tokens)` is a LangChain LLM
+    returning prompt + generation (`strict`: greedy settings for regenerating rows that failed validation;
+    `max_new_tokens`: a per-call budget instead of the default); `chain` wraps it as
+    prompt | llm | parallel_chain | combine_both with the throughput meter attached.
+    Subclasses must implement `llm` and `count_tokens`.
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self.meter = ThroughputMeter(self.count_tokens)
+
+    @abc.abstractmethod
+    def llm(self, batch_size: int = 1, strict: bool = False, max_new_tokens: int = None):
+        ...
+
+    def chain(self, batch_size: int = 1, strict: bool = False, max_new_tokens: int = None):
+        from model_chain import parallel_chain, combine_both
+        from schema_and_prompt import prompt
+
+        chain = prompt | self.llm(batch_size, strict, max_new_tokens) | parallel_chain | RunnableLambda(combine_both)
+        return chain.with_config(callbacks=[self.meter])
+
+    @abc.abstractmethod
+    def count_tokens(self, text: str) -> int:
+        ...
+
+    def token_counts(self, texts) -> list:
+        return [self.count_tokens(text) for text in texts]
+
+    def warm_up(self):
+        pass
+
+    def pop_saved(self, max_new_tokens: int = None) -> list:
+        """
+        Tokens saved by the JSON early stop, per sequence generated since the last call, against
+        `max_new_tokens` (the budget those sequences were generated with; default the fixed one).
+        """
+        return []
+
+    def cache_settings(self) -> dict:
+        """
+        Extraction-cache settings that tell this backend's outputs apart from the HF pipeline's.
+        """
+        return {"backend": self.name}
+
+    def report(self) -> dict:
+        return {"backend": self.name, "host": socket.gethostname(), **self.meter.report()}
+
+# ----------------------------
+# HF pipeline (GPU)
+# ----------------------------
+class HFBackend(Backend):
+    """
+    The production pipeline from model_chain.py: MODEL_ID in 4-bit with device_map="auto".
+    """
+
+    name = "hf"
+
+    def llm(self, batch_size: int = 1, strict: bool = False, max_new_tokens: int = None):
+        from model_chain import batched_llm, get_llm, strict_llm
+
+        if strict:
+            return strict_llm(batch_size)
+        if batch_size > 1 or max_new_tokens is not None:
+            return batched_llm(batch_size, max_new_tokens)
+        return get_llm()
+
+    def count_tokens(self, text: str) -> int:
+        return self.token_counts([text])[0]
+
+    def token_counts(self, texts) -> list:
+        from model_chain import get_tokenizer
+
+        return [len(ids) for ids in get_tokenizer()(list(texts))["input_ids"]] if len(texts) else []
+
+    def warm_up(self):
+        from model_chain import warm_up
+
+        warm_up()
+
+    def pop_saved(self, max_new_tokens: int = None) -> list:
+        from model_chain import get_json_stop
+
+        return [stat["tokens_saved"] for stat in get_json_stop().pop_stats(max_new_tokens)]
+
+    def cache_settings(self) -> dict:
+        # Same keys as before backends existed, so the existing extraction cache stays valid.
+        return {}
+
+    def report(self) -> dict:
+        return {**super().report(), "model": MODEL_ID}
+
+# ----------------------------
+# CPU engine
+# ----------------------------
+class JsonCloseTracker:
+    """
+    Text-level twin of model_chain.JsonObjectStoppingCriteria for engines that stream text:
+    feed() returns True once the first top-level JSON object is balanced.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.started = False
+
+    def feed(self, text: str) -> bool:
+        for ch in text:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == "{":
+                self.depth += 1
+                self.started = True
+            elif self.started and ch == '"':
+                self.in_string = True
+            elif self.started and ch == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    return True
+        return False
+
+class LlamaCppLLM(LLM):
+    """
+    llama.cpp completion streamed token by token and stopped once the JSON object closes.
+    Returns prompt + generation, like the HF pipeline.
+    """
+
+    engine: Any = None
+    max_tokens: int = 1000
+    temperature: float = 0.1
+    saved: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "llama_cpp"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        tracker = JsonCloseTracker()
+        pieces, closed = [], False
+        for chunk in self.engine.create_completion(prompt, max_tokens=self.max_tokens, temperature=self.temperature,
+                                                   stop=stop, stream=True):
+            pieces.append(chunk["choices"][0]["text"])
+            if tracker.feed(pieces[-1]):
+                closed = True
+                break
+        if self.saved is not None:
+            self.saved.append(self.max_tokens - len(pieces) if closed else 0)
+        return prompt + "".join(pieces)
+
+class CpuBackend(Backend):
+    """
+    CPU-only engine using CPU_THREADS threads. A .gguf CPU_MODEL runs on llama.cpp (pip install llama-cpp-python);
+    anything else is loaded as HF weights with the linear layers dynamically quantized to int8.
+    """
+
+    name = "cpu"
+
+    def __init__(self, model: str = CPU_MODEL, threads: int = CPU_THREADS, context: int = CPU_CONTEXT):
+        self.model = model
+        self.threads = threads or os.cpu_count() or 1
+        self.context = context
+        self.gguf = model.endswith(".gguf")
+        self.engine = None
+        self.stop = None
+        self.saved = []
+        super().__init__()
+
+    def _load(self):
+        from model_chain import GENERATION_KWARGS
+
+        if self.gguf:
+            try:
+                from llama_cpp import Llama
+            except ImportError as e:
+                raise ImportError("CPU_MODEL is a GGUF file; install llama-cpp-python to run it") from e
+            self.engine = Llama(model_path=self.model, n_ctx=self.context, n_threads=self.threads, verbose=False)
+            return
+        import torch
+        from langchain_huggingface import HuggingFacePipeline
+        from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+        from model_chain import JsonObjectStoppingCriteria
+
+        torch.set_num_threads(self.threads)
+        tokenizer = AutoTokenizer.from_pretrained(self.model)
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        model = AutoModelForCausalLM.from_pretrained(self.model, dtype=torch.float32)
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.engine = HuggingFacePipeline(
+            pipeline=pipeline("text-generation", model=model, tokenizer=tokenizer, device=-1, **GENERATION_KWARGS),
+            model_id=self.model,
+            pipeline_kwargs=GENERATION_KWARGS,
+        )
+        self.stop = JsonObjectStoppingCriteria(tokenizer, GENERATION_KWARGS["max_new_tokens"])
+
+    def get_engine(self):
+        if self.engine is None:
+            self._load()
+        return self.engine
+
+    def llm(self, batch_size: int = 1, strict: bool = False, max_new_tokens: int = None):
+        from transformers import StoppingCriteriaList
+        from model_chain import GENERATION_KWARGS
+
+        engine = self.get_engine()
+        max_new_tokens = max_new_tokens or GENERATION_KWARGS["max_new_tokens"]
+        if self.gguf:
+            # llama.cpp parallelizes within a sequence over its threads; notes are generated one after another.
+            return LlamaCppLLM(engine=engine, max_tokens=max_new_tokens,
+                               temperature=0.0 if strict else GENERATION_KWARGS["temperature"], saved=self.saved)
+        extras = {"batch_size": batch_size, "stopping_criteria": StoppingCriteriaList([self.stop]),
+                  "max_new_tokens": max_new_tokens}
+        if strict:
+            extras["do_sample"] = False
+        return engine.model_copy(update={"batch_size": batch_size}).bind(pipeline_kwargs=extras)
+
+    def count_tokens(self, text: str) -> int:
+        engine = self.get_engine()
+        if self.gguf:
+            return len(engine.tokenize(text.encode("utf-8"), add_bos=False))
+        return len(engine.pipeline.tokenizer(text)["input_ids"])
+
+    def warm_up(self):
+        self.get_engine()
+
+    def pop_saved(self, max_new_tokens: int = None) -> list:
+        if self.gguf:
+            # LlamaCppLLM already counts against the max_tokens of its own call.
+            saved, self.saved[:] = list(self.saved), []
+            return saved
+        return [stat["tokens_saved"] for stat in self.stop.pop_stats(max_new_tokens)] if self.stop is not None else []
+
+    def cache_settings(self) -> dict:
+        return {"backend": self.name, "model": self.model, "quantization": "gguf" if self.gguf else "int8",
+                "constrained": False}
+
+    def report(self) -> dict:
+        return {**super().report(), "model": self.model, "threads": self.threads}
+
+# ----------------------------
+# Stub (in-process)
+# ----------------------------
+WORD = re.compile(r"\w+|[^\w\s]")
+
+def approx_tokens(text: str) -> int:
+    """
+    Word/punctuation count; a stand-in for a tokenizer in stub mode.
+    """
+    return len(WORD.findall(text))
+
+def note_from_prompt(text: str) -> str:
+    return text.rsplit("Medical Note:", 1)[-1].rsplit("Assistant:", 1)[0].strip()
+
+class StubLLM(LLM):
+    """
+    Deterministic LLM that answers each note with its expected JSON (or a regex guess) and
+    sleeps as if a batched generate decoded the longest answer at `tokens_per_sec`.
+    Returns prompt + answer, like the HF pipeline.
+    """
+
+    answers: dict = {}
+    tokens_per_sec: float = 30.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _answer(self, text: str) -> str:
+        from stub_llm import stub_extract
+
+        note = note_from_prompt(text)
+        return " " + json.dumps(self.answers.get(note) or stub_extract(note), ensure_ascii=False)
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        return self._generate([prompt]).generations[0][0].text
+
+    def _generate(self, prompts, stop=None, run_manager=None, **kwargs):
+        from langchain_core.outputs import Generation, LLMResult
+
+        answers = [self._answer(p) for p in prompts]
+        if self.tokens_per_sec > 0:
+            time.sleep(max(approx_tokens(a) for a in answers) / self.tokens_per_sec)
+        return LLMResult(generations=[[Generation(text=p + a)] for p, a in zip(prompts, answers)])
+
+class StubBackend(Backend):
+    """
+    StubLLM behind the real prompt and parsers, for exercising runners without a model
+    (`answers` maps stripped notes to expected JSON; 0 tokens/sec = no delay).
+    """
+
+    name = "stub"
+
+    def __init__(self, answers: dict = None, tokens_per_sec: float = 0.0):
+        self.answers = {note.strip(): answer for note, answer in (answers or {}).items()}
+        self.tokens_per_sec = tokens_per_sec
+        super().__init__()
+
+    def llm(self, batch_size: int = 1, strict: bool = False, max_new_tokens: int = None):
+        return StubLLM(answers=self.answers, tokens_per_sec=self.tokens_per_sec)
+
+    def count_tokens(self, text: str) -> int:
+        return approx_tokens(text)
+
+# ----------------------------
+# Selection
+# ----------------------------
+BACKENDS = {"hf": HFBackend, "cpu": CpuBackend, "stub": StubBackend}
+_backends = {}
+
+def get_backend(name: str = BACKEND) -> Backend:
+    """
+    The backend called `name` ("hf", "cpu" or "stub"), built once per process; nothing is loaded until first use.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}; choose one of {sorted(BACKENDS)}")
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Per-backend, per-host throughput over recorded runs.")
+    arg_parser.add_argument("--stats", default=BACKEND_STATS)
+    args = arg_parser.parse_args()
+    print(json.dumps(throughput_table(args.stats), indent=2))
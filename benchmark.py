@@ -0,0 +1,279 @@
+# benchmark.py
+# Throughput / latency benchmark of the extraction chain on synthetic notes, with a deterministic
+# stub backend (replays JSON at a fixed tokens/sec), a small real model on CPU, or any backend from backends.py.
+
+import argparse
+import json
+import random
+import subprocess
+import time
+from typing import Optional
+
+import pandas as pd
+from langchain_core.runnables import RunnableLambda
+
+from config import BATCH_SIZE, BACKEND
+from schema_and_prompt import prompt, format_instructions, EXAMPLES_TEXT, _SYMPTOMS, _VISIT_MOTIVATIONS
+from model_chain import parallel_chain, combine_both
+from scorer import score_texts
+from backends import StubBackend, get_backend
+
+# ----------------------------
+# Synthetic notes
+# ----------------------------
+ASSESSMENT = (
+    "The patient presents with a constellation of symptoms that warrant further investigation. "
+    "Vital signs were reviewed and the findings were discussed with the patient. "
+)
+PLAN = [
+    "- Conduct a thorough physical examination.",
+    "- Order a complete blood count and basic metabolic panel.",
+    "- Schedule follow-up appointment in 1 week to review test results.",
+]
+
+def _label(symptom: str) -> str:
+    return symptom.replace("_", " ").capitalize()
+
+def _vitals(rng: random.Random) -> dict:
+    vitals = {}
+    if rng.random() < 0.5:
+        vitals["blood_pressure"] = {"systolic": {"value": rng.randint(90, 170), "unit": "mmHg"},
+                                    "diastolic": {"value": rng.randint(55, 100), "unit": "mmHg"}}
+    if rng.random() < 0.5:
+        vitals["heart_rate"] = {"value": rng.randint(55, 120), "unit": "bpm"}
+    if rng.random() < 0.4:
+        vitals["temperature"] = {"value": round(rng.uniform(36.0, 39.5), 1), "unit": "°C"}
+    if rng.random() < 0.4:
+        vitals["oxygen_saturation"] = {"value": round(rng.uniform(90, 99.9), 1), "unit": "%"}
+    if rng.random() < 0.3:
+        vitals["respiratory_rate"] = {"value": rng.randint(12, 26), "unit": "breaths/min"}
+    if rng.random() < 0.4:
+        vitals["glucose_level"] = {"value": round(rng.uniform(70, 180), 1), "unit": "mg/dL"}
+    if rng.random() < 0.3:
+        vitals["cholesterol_level"] = {"value": round(rng.uniform(120, 260), 1), "unit": "mg/dL"}
+    return vitals
+
+VITAL_LINES = {
+    "heart_rate": ("Heart Rate", "bpm"),
+    "temperature": ("Temperature", "°C"),
+    "oxygen_saturation": ("Oxygen Saturation", "%"),
+    "respiratory_rate": ("Respiratory Rate", " breaths/min"),
+    "glucose_level": ("Glucose Level", " mg/dL"),
+    "cholesterol_level": ("Cholesterol Level", " mg/dL"),
+}
+
+def _vital_lines(vitals: dict, bullet: str):
+    for key, value in vitals.items():
+        if key == "blood_pressure":
+            yield f"{bullet}Blood Pressure: {value['systolic']['value']}/{value['diastolic']['value']} mmHg"
+        else:
+            name, unit = VITAL_LINES[key]
+            yield f"{bullet}{name}: {value['value']}{unit}"
+
+def synthetic_note(rng: random.Random):
+    """
+    One (note, expected JSON) pair in one of the three section layouts used in EXAMPLES_TEXT:
+    bold headed sections, a chief complaint with nested vitals, or plain "Name:" headers.
+    """
+    age, gender = rng.randint(18, 90), rng.choice(["Male", "Female"])
+    motivation = rng.choice(_VISIT_MOTIVATIONS)
+    symptoms = rng.sample(_SYMPTOMS, rng.randint(1, min(8, len(_SYMPTOMS))))
+    vitals = _vitals(rng)
+    filler = ASSESSMENT * rng.randint(1, 6)
+    layout = rng.randrange(3)
+    if layout == 0:
+        lines = ["**Clinical Notes:**", "", "**Patient Information:**", f"- Age: {age}", f"- Gender: {gender}", "",
+                 "**Visit Motivation:**", f"- Primary complaint of {motivation.lower()}.", "", "**Symptoms:**"]
+        lines += [f"- {_label(s)}" for s in symptoms]
+        lines += ["", "**Vital Signs:**", *_vital_lines(vitals, "- "), "", "**Assessment:**", filler, "", "**Plan:**", *PLAN]
+    elif layout == 1:
+        pronoun = "He" if gender == "Male" else "She"
+        lines = ["**Clinical Notes**", "", "Patient: [Unknown]", "", f"**Chief Complaint:** {motivation}", "",
+                 f"**History of Present Illness:** {pronoun} reports "
+                 + ", ".join(_label(s).lower() for s in symptoms) + ".", "",
+                 "**Physical Examination:**", "", "* Vital Signs:", *_vital_lines(vitals, "\t+ "), "",
+                 f"* Age and sex: A {age}-year-old {gender.lower()}.", "", "**Plan:**", "", filler]
+    else:
+        lines = ["Clinical Note:", "", f"Patient: {age}-year-old {gender.lower()}", f"Chief Complaint: {motivation}", "",
+                 "History of Present Illness:", "The patient reports " + ", ".join(_label(s).lower() for s in symptoms) + ".",
+                 "", "Vital Signs:", *_vital_lines(vitals, "- "), "", "Assessment and Plan:", filler]
+    expected = {"patient_info": {"age": age, "gender": gender}, "visit_motivation": motivation,
+                "symptoms": symptoms, "vital_signs": vitals}
+    return "\n".join(lines), expected
+
+def synthetic_notes(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [synthetic_note(rng) for _ in range(n)]
+
+# ----------------------------
+# Backends
+# ----------------------------
+def stub_backend(answers: dict, tokens_per_sec: float):
+    backend = StubBackend(answers, tokens_per_sec)
+    return backend.llm(), backend.count_tokens
+
+def cpu_backend(model_id: str, batch_size: int, max_new_tokens: int):
+    """
+    A small real model on CPU (e.g. Qwen/Qwen2.5-0.5B-Instruct) behind the same pipeline wrapper
+    and JSON early stop as production, without quantization.
+    """
+    from langchain_huggingface import HuggingFacePipeline
+    from transformers import StoppingCriteriaList
+    from model_chain import JsonObjectStoppingCriteria
+
+    pipeline = HuggingFacePipeline.from_model_id(
+        model_id=model_id,
+        task="text-generation",
+        device=-1,
+        pipeline_kwargs={"max_new_tokens": max_new_tokens, "do_sample": False},
+        batch_size=batch_size,
+    )
+    tokenizer = pipeline.pipeline.tokenizer
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    stop = StoppingCriteriaList([JsonObjectStoppingCriteria(tokenizer, max_new_tokens)])
+    llm = pipeline.bind(pipeline_kwargs={"batch_size": batch_size, "stopping_criteria": stop})
+    return llm, lambda text: len(tokenizer(text)["input_ids"])
+
+# ----------------------------
+# Measurement
+# ----------------------------
+def percentiles(values) -> dict:
+    ordered = sorted(values)
+    if not ordered:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99)}
+
+def run_chain(llm, count_tokens, notes, batch_size: int) -> dict:
+    """
+    Run every note through prompt | llm | parallel_chain | combine_both in batches of `batch_size`;
+    each note's latency is the wall time of the batch it was generated in.
+    """
+    chain = prompt | llm | parallel_chain | RunnableLambda(combine_both)
+    latencies, results = [], []
+    prompt_tokens = generated_tokens = 0
+    start = time.perf_counter()
+    for i in range(0, len(notes), batch_size):
+        batch = notes[i:i + batch_size]
+        inputs = [{"Note": note, "format_instructions": format_instructions, "EXAMPLES_TEXT": EXAMPLES_TEXT}
+                  for note in batch]
+        batch_start = time.perf_counter()
+        outputs = chain.batch(inputs)
+        latencies += [time.perf_counter() - batch_start] * len(batch)
+        for inp, (full_response, json_text) in zip(inputs, outputs):
+            prompt_text = prompt.invoke(inp).to_string()
+            prompt_tokens += count_tokens(prompt_text)
+            generated_tokens += count_tokens(full_response[len(prompt_text):])
+            results.append(json_text)
+    elapsed = time.perf_counter() - start
+    return {
+        "notes": len(notes),
+        "seconds": elapsed,
+        "notes_per_sec": len(notes) / elapsed if elapsed else 0.0,
+        "latency_sec": percentiles(latencies),
+        "prompt_tokens_per_note": prompt_tokens / max(len(notes), 1),
+        "generated_tokens_per_note": generated_tokens / max(len(notes), 1),
+        "generated_tokens_per_sec": generated_tokens / elapsed if elapsed else 0.0,
+    }, results
+
+def postprocess_timing(json_texts, repeats: int = 3) -> dict:
+    """
+    Time submission_builder's per-row transforms (parse, null removal, label mapping, serialization).
+    """
+    from submission_builder import process_chunk
+
+    frame = pd.DataFrame({"ID": range(len(json_texts)), "json": json_texts})
+    process_chunk(frame.head(1))  # Build the normalizer indexes outside the timed region.
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        process_chunk(frame)
+        best = min(best, time.perf_counter() - start)
+    return {"rows": len(frame), "seconds": best, "rows_per_sec": len(frame) / best if best else 0.0}
+
+def speculative_timing(llm, notes, max_new_tokens: int) -> dict:
+    """
+    Prompt-lookup speculative decoding vs plain greedy generate() on the same CPU model:
+    whether outputs are identical, draft acceptance rate and speedup.
+    """
+    from transformers import StoppingCriteriaList
+    from model_chain import JsonObjectStoppingCriteria, PromptLookupDecoder, compare_with_greedy
+
+    hf_pipeline = llm.bound.pipeline
+    tokenizer = hf_pipeline.tokenizer
+    stop = StoppingCriteriaList([JsonObjectStoppingCriteria(tokenizer, max_new_tokens)])
+    decoder = PromptLookupDecoder(hf_pipeline.model, tokenizer, max_new_tokens, stopping_criteria=stop)
+    prompts = [prompt.invoke({"Note": note, "format_instructions": format_instructions, "EXAMPLES_TEXT": EXAMPLES_TEXT})
+               .to_string() for note in notes]
+    return compare_with_greedy(decoder, prompts)
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(current: dict, baseline: dict, prefix: str = ""):
+    """
+    Print current/baseline ratios for every numeric metric present in both runs.
+    """
+    for key, value in current.items():
+        other = baseline.get(key)
+        if isinstance(value, dict) and isinstance(other, dict):
+            compare(value, other, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and isinstance(other, (int, float)) and other:
+            print(f"{prefix}{key}: {value:.4g} vs {other:.4g} ({value / other:.2f}x)")
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark the extraction chain on synthetic notes.")
+    arg_parser.add_argument("--mode", choices=["stub", "cpu", "backend"], default="stub",
+                            help="backend = run through --backend from backends.py (configured model and hardware).")
+    arg_parser.add_argument("--backend", choices=["hf", "cpu", "stub"], default=None,
+                            help="Backend for --mode backend (default: BACKEND in config.py).")
+    arg_parser.add_argument("--notes", type=int, default=200)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    arg_parser.add_argument("--tokens-per-sec", type=float, default=30.0, help="Stub decode speed (0 = no delay).")
+    arg_parser.add_argument("--model", default="Qwen/Qwen2.5-0.5B-Instruct", help="Model for --mode cpu.")
+    arg_parser.add_argument("--max-new-tokens", type=int, default=256, help="Generation cap for --mode cpu.")
+    arg_parser.add_argument("--speculative", type=int, default=0,
+                            help="With --mode cpu, also compare speculative and greedy decoding on this many notes.")
+    arg_parser.add_argument("--output", default="benchmark_results.json")
+    arg_parser.add_argument("--compare", default=None, help="Earlier results JSON to compare against.")
+    args = arg_parser.parse_args()
+
+    pairs = synthetic_notes(args.notes, args.seed)
+    notes = [note for note, _ in pairs]
+    if args.mode == "stub":
+        llm, count_tokens = stub_backend({note: expected for note, expected in pairs}, args.tokens_per_sec)
+    elif args.mode == "backend":
+        backend = get_backend(args.backend or BACKEND)
+        backend.warm_up()
+        llm, count_tokens = backend.llm(args.batch_size), backend.count_tokens
+    else:
+        llm, count_tokens = cpu_backend(args.model, args.batch_size, args.max_new_tokens)
+
+    generation, json_texts = run_chain(llm, count_tokens, notes, args.batch_size)
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "generation": generation,
+        "postprocess": postprocess_timing(json_texts),
+        # Competition-style similarity to the synthetic ground truth, reported next to throughput.
+        "quality": score_texts(json_texts, [expected for _, expected in pairs]),
+    }
+    if args.mode == "cpu" and args.speculative:
+        report["speculative"] = speculative_timing(llm, notes[:args.speculative], args.max_new_tokens)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# columnar_output.py
+# Columnar results: JsonOutput fields flattened into typed Parquet columns (patient_info.age,
+# vital_signs.blood_pressure.systolic.value, symptoms as a list, ...) with the raw text in a separate raw.* group.
+
+import argparse
+import json
+import math
+import os
+import typing
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pydantic import BaseModel
+
+from config import CHUNK_SIZE, OUTPUT_LOG, OUTPUT_PARQUET
+from schema_and_prompt import JsonOutput
+from validation import remove_nulls
+
+RAW_COLUMNS = ["raw.json", "raw.full_response"]
+
+# ----------------------------
+# Schema flattening
+# ----------------------------
+def _arrow_type(annotation):
+    """
+    Arrow type of a leaf annotation (Optional / Literal unwrapped); None for nested models.
+    """
+    origin, args = typing.get_origin(annotation), typing.get_args(annotation)
+    if origin is typing.Union:
+        return _arrow_type(next(arg for arg in args if arg is not type(None)))
+    if origin in (list, typing.List):
+        return pa.list_(_arrow_type(args[0]))
+    if origin is typing.Literal:
+        return pa.string()
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return None
+    return {int: pa.int64(), float: pa.float64(), str: pa.string()}[annotation]
+
+def _nested_model(annotation):
+    if typing.get_origin(annotation) is typing.Union:
+        annotation = next(arg for arg in typing.get_args(annotation) if arg is not type(None))
+    return annotation
+
+def flat_fields(model=JsonOutput, prefix=()):
+    """
+    [(column name, key path, arrow type), ...] for every leaf of `model`, in schema order.
+    """
+    fields = []
+    for name, field in model.model_fields.items():
+        path = prefix + (name,)
+        arrow_type = _arrow_type(field.annotation)
+        if arrow_type is None:
+            fields += flat_fields(_nested_model(field.annotation), path)
+        else:
+            fields.append((".".join(path), path, arrow_type))
+    return fields
+
+FIELDS = flat_fields()
+FIELD_COLUMNS = [name for name, _, _ in FIELDS]
+SCHEMA = pa.schema(
+    [("ID", pa.string())]
+    + [(name, arrow_type) for name, _, arrow_type in FIELDS]
+    # True when the typed columns rebuild the JSON exactly, so readers can skip json.loads for the row.
+    + [("exact", pa.bool_())]
+    + [(name, pa.string()) for name in RAW_COLUMNS]
+)
+
+def _coerce(value, arrow_type):
+    # Values that do not fit the column type are stored as null (the row is then not exact).
+    if pa.types.is_list(arrow_type):
+        if not isinstance(value, list):
+            return None
+        return [v for v in (_coerce(item, arrow_type.value_type) for item in value) if v is not None]
+    if pa.types.is_integer(arrow_type):
+        return value if isinstance(value, int) and not isinstance(value, bool) else None
+    if pa.types.is_floating(arrow_type):
+        return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+    return value if isinstance(value, str) else None
+
+def flatten(data) -> dict:
+    """
+    Column -> typed value for a parsed extraction (all null when it is not a dict).
+    """
+    row = {}
+    for name, path, arrow_type in FIELDS:
+        value = data
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+        row[name] = None if value is None else _coerce(value, arrow_type)
+    return row
+
+def _kind(arrow_type) -> str:
+    if pa.types.is_list(arrow_type):
+        return "list"
+    if pa.types.is_integer(arrow_type):
+        return "int"
+    return "float" if pa.types.is_floating(arrow_type) else "str"
+
+# (column, parent keys, leaf key, kind) per field, so unflatten does no type inspection per row.
+_PLAN = [(name, path[:-1], path[-1], _kind(arrow_type)) for name, path, arrow_type in FIELDS]
+
+def unflatten(row: dict) -> dict:
+    """
+    Nested extraction dict from flattened columns, in schema order. Null leaves and objects left
+    empty are omitted; whole-number floats are written as ints, as the model writes them.
+    Accepts rows read through pandas (NaN for null numbers, numpy scalars and arrays).
+    """
+    data = {}
+    for name, parents, leaf, kind in _PLAN:
+        value = row.get(name)
+        if value is None:
+            continue
+        if kind == "list":
+            value = [str(v) for v in value]
+        elif kind == "str":
+            # An all-null string column comes back from pandas as float NaN.
+            if not isinstance(value, str):
+                continue
+        else:
+            value = float(value)
+            if math.isnan(value):
+                continue
+            if kind == "int" or value.is_integer():
+                value = int(value)
+        node = data
+        for key in parents:
+            node = node.get(key) or node.setdefault(key, {})
+        node[leaf] = value
+    return data
+
+def to_row(record_id, json_text, full_response=None) -> dict:
+    """
+    One Parquet row: typed columns from `json_text`, the raw texts, and whether the columns are exact.
+    """
+    try:
+        data = json.loads(json_text)
+    except (json.JSONDecodeError, TypeError):
+        data = None
+    row = {"ID": str(record_id), **flatten(data)}
+    # Key order is not compared: rows rebuilt from the columns come out in schema order.
+    row["exact"] = isinstance(data, dict) and (
+        json.dumps(unflatten(row), sort_keys=True) == json.dumps(remove_nulls(data), sort_keys=True)
+    )
+    row["raw.json"] = json_text if isinstance(json_text, str) else None
+    row["raw.full_response"] = full_response if isinstance(full_response, str) else None
+    return row
+
+# ----------------------------
+# Writing
+# ----------------------------
+class ColumnarWriter:
+    """
+    Writes rows to a Parquet file in row groups of `row_group_size`; the file appears atomically on close.
+    """
+
+    def __init__(self, path: str, row_group_size: int = CHUNK_SIZE):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.row_group_size = row_group_size
+        self.rows = []
+        self.writer = None
+
+    def __enter__(self):
+        self.writer = pq.ParquetWriter(self.tmp_path, SCHEMA, compression="zstd")
+        return self
+
+    def write(self, record_id, json_text, full_response=None):
+        self.rows.append(to_row(record_id, json_text, full_response))
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_table(pa.Table.from_pylist(self.rows, schema=SCHEMA))
+            self.rows = []
+
+    def __exit__(self, exc_type, *exc):
+        self.flush()
+        self.writer.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+
+def export_parquet(log_path: str, parquet_path: str, chunksize: int = CHUNK_SIZE):
+    """
+    Stream the runner's JSONL result log into `parquet_path`, one row group per `chunksize` records.
+    """
+    with open(log_path, encoding="utf-8") as f, ColumnarWriter(parquet_path, chunksize) as writer:
+        for line in f:
+            record = json.loads(line)
+            writer.write(record["ID"], record.get("json"), record.get("full_response"))
+
+# ----------------------------
+# Reading
+# ----------------------------
+def read_columns(path: str, columns=None) -> pa.Table:
+    """
+    Memory-mapped read of only `columns` (e.g. ["ID", "symptoms"]); all columns when None.
+    """
+    return pq.read_table(path, columns=columns, memory_map=True)
+
+def iter_frames(path: str, columns=None, chunksize: int = CHUNK_SIZE):
+    """
+    pandas frames of at most `chunksize` rows with only `columns`, read batch by batch from a memory map.
+    """
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+        yield batch.to_pandas()
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Convert the JSONL result log to columnar Parquet.")
+    arg_parser.add_argument("--log", default=OUTPUT_LOG)
+    arg_parser.add_argument("--output", default=OUTPUT_PARQUET)
+    arg_parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = arg_parser.parse_args()
+    export_parquet(args.log, args.output, args.chunk_size)
+    print(f"Saved {args.output}: {pq.ParquetFile(args.output).metadata.num_rows} rows")
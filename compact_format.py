@@ -0,0 +1,320 @@
+# compact_format.py
+# Compact output mode: the model writes one "code=value" line per field (no keys, braces or default units)
+# and a schema-driven expander rebuilds the competition JSON, with each sub-model's default unit.
+
+import argparse
+import functools
+import json
+import random
+import re
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from config import TRAIN_CSV
+from schema_and_prompt import JsonOutput, EXAMPLES_TEXT, NOTE_ANCHOR, _SYMPTOMS, _VISIT_MOTIVATIONS
+
+END = "END"
+
+# Line codes for vital signs, in VitalSigns field order. blood_pressure is written as systolic/diastolic.
+VITAL_CODES = {
+    "blood_pressure": "bp",
+    "cholesterol_level": "chol",
+    "glucose_level": "glucose",
+    "heart_rate": "hr",
+    "oxygen_saturation": "spo2",
+    "respiratory_rate": "rr",
+    "temperature": "temp",
+}
+
+def _sub_model(annotation):
+    # Optional[Model] -> Model
+    return next((arg for arg in getattr(annotation, "__args__", ()) if arg is not type(None)), annotation)
+
+def default_units() -> dict:
+    """
+    Vital sign -> default unit of its sub-model (blood pressure: the systolic unit).
+    """
+    vital_model = _sub_model(JsonOutput.model_fields["vital_signs"].annotation)
+    units = {}
+    for name, field in vital_model.model_fields.items():
+        sub = _sub_model(field.annotation)
+        if "unit" not in sub.model_fields:
+            sub = _sub_model(sub.model_fields["systolic"].annotation)
+        units[name] = sub.model_fields["unit"].default
+    return units
+
+UNITS = default_units()
+assert set(UNITS) == set(VITAL_CODES), "every VitalSigns field needs a compact code"
+VITAL_BY_CODE = {code: name for name, code in VITAL_CODES.items()}
+MEASURE = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*(.*?)\s*$")
+# systolic/diastolic (either may be missing) and an optional unit, however spaced: "120/80", "120 / 80 mmHg".
+PRESSURE = re.compile(r"^\s*(-?\d+(?:\.\d+)?)?\s*/\s*(-?\d+(?:\.\d+)?)?\s*(.*?)\s*$")
+
+# ----------------------------
+# Encoding and expansion
+# ----------------------------
+def _number(text: str):
+    # Keeps the int / float distinction of the original JSON (96 vs 96.0).
+    return json.loads(text)
+
+def _measure(value: dict, default_unit: str) -> str:
+    unit = value.get("unit")
+    text = json.dumps(value.get("value"))
+    return text if unit in (None, default_unit) else f"{text} {unit}"
+
+def encode(data: dict) -> str:
+    """
+    Compact text for a competition JSON dict (what the model is asked to write).
+    """
+    patient = data.get("patient_info") or {}
+    lines = []
+    if "age" in patient:
+        lines.append(f"age={json.dumps(patient['age'])}")
+    if "gender" in patient:
+        lines.append(f"gender={patient['gender']}")
+    if "visit_motivation" in data:
+        lines.append(f"visit={data['visit_motivation']}")
+    if "symptoms" in data:
+        lines.append("symptoms=" + ", ".join(data["symptoms"]))
+    vitals = data.get("vital_signs") or {}
+    for name, code in VITAL_CODES.items():
+        value = vitals.get(name)
+        if not isinstance(value, dict):
+            continue
+        if name == "blood_pressure":
+            systolic, diastolic = value.get("systolic") or {}, value.get("diastolic") or {}
+            parts = [json.dumps(part["value"]) if "value" in part else "" for part in (systolic, diastolic)]
+            unit = systolic.get("unit") or diastolic.get("unit")
+            suffix = f" {unit}" if unit not in (None, UNITS[name]) else ""
+            lines.append(f"{code}={parts[0]}/{parts[1]}{suffix}")
+        else:
+            lines.append(f"{code}={_measure(value, UNITS[name])}")
+    return "\n".join(lines + [END])
+
+def expand(text: str) -> dict:
+    """
+    Competition JSON dict from compact text. Lines after END, unknown codes and values that do not parse
+    are dropped; vital signs get their sub-model's default unit unless the line names another.
+    """
+    data = {"patient_info": {}, "visit_motivation": None, "symptoms": [], "vital_signs": {}}
+    for line in text.splitlines():
+        line = line.strip()
+        if line == END:
+            break
+        code, sep, value = line.partition("=")
+        if not sep:
+            continue
+        code, value = code.strip().lower(), value.strip()
+        if code == "age":
+            match = MEASURE.match(value)
+            if match:
+                data["patient_info"]["age"] = int(float(match.group(1)))
+        elif code == "gender":
+            data["patient_info"]["gender"] = value
+        elif code == "visit":
+            data["visit_motivation"] = value
+        elif code == "symptoms":
+            data["symptoms"] = [s.strip() for s in value.split(",") if s.strip()]
+        elif code == "bp":
+            # A single reading without "/" is the systolic value.
+            match = PRESSURE.match(value) or MEASURE.match(value)
+            *numbers, unit = match.groups() if match else (None,)
+            unit = unit or UNITS["blood_pressure"]
+            bp = {part: {"value": _number(number), "unit": unit}
+                  for part, number in zip(("systolic", "diastolic"), numbers) if number is not None}
+            if bp:
+                data["vital_signs"]["blood_pressure"] = bp
+        elif code in VITAL_BY_CODE:
+            match = MEASURE.match(value)
+            if match:
+                name = VITAL_BY_CODE[code]
+                data["vital_signs"][name] = {"value": _number(match.group(1)), "unit": match.group(2) or UNITS[name]}
+    if data["visit_motivation"] is None:
+        del data["visit_motivation"]
+    return data
+
+def expand_json(text: str) -> str:
+    return json.dumps(expand(text), ensure_ascii=False)
+
+# ----------------------------
+# Prompt
+# ----------------------------
+FIELD_GUIDE = "\n".join(
+    [
+        "age=<integer age in years>",
+        "gender=<Male or Female>",
+        "visit=<main reason for the visit, one of the allowed visit motivations>",
+        "symptoms=<comma-separated symptoms, each one of the allowed symptoms>",
+        "bp=<systolic>/<diastolic>",
+    ]
+    + [f"{code}=<{name.replace('_', ' ')} value>" for name, code in VITAL_CODES.items() if code != "bp"]
+)
+
+def compact_instructions() -> str:
+    """
+    Field guide and allowed labels; replaces the JSON schema format instructions.
+    """
+    return (
+        "Write one line per field found in the note, then a line with END:\n"
+        + FIELD_GUIDE
+        + "\nOmit vital signs that are not in the note. Write numbers only; units are "
+        + ", ".join(f"{code} {UNITS[name]}" for name, code in VITAL_CODES.items())
+        + " (add the unit after the number only if the note uses a different one).\n"
+        + "Allowed visit motivations: " + "; ".join(_VISIT_MOTIVATIONS) + "\n"
+        + "Allowed symptoms: " + ", ".join(_SYMPTOMS)
+    )
+
+COMPACT_INSTRUCTIONS = compact_instructions()
+EXAMPLE_ANSWER = re.compile(r"^Assistant: (\{.*\})[ \t]*$", re.MULTILINE)
+
+def encode_examples(examples_text: str) -> str:
+    """
+    Few-shot examples (EXAMPLES_TEXT layout) with every JSON answer rewritten in the compact encoding.
+    """
+    return EXAMPLE_ANSWER.sub(lambda m: "Assistant:\n" + encode(json.loads(m.group(1))), examples_text)
+
+COMPACT_EXAMPLES_TEXT = encode_examples(EXAMPLES_TEXT)
+
+compact_prompt = ChatPromptTemplate([
+    (
+        "system",
+        """
+You are a highly precise and structured medical information extractor.
+Your task is to extract **only** the requested patient information from the given medical note.
+
+STRICT RULES:
+- The output MUST appear immediately after the word "Assistant:" with no extra text before or after.
+- Use only the line format below; do not write JSON.
+- Use only labels from the allowed lists.
+
+{format_instructions}
+"""
+    ),
+    (
+        "human",
+        """
+Below are high-quality examples demonstrating the EXACT output format expected.
+
+{EXAMPLES_TEXT}
+
+""" + NOTE_ANCHOR + """ Return ONLY the field lines and END.
+
+Medical Note:
+{Note}
+
+Assistant:
+"""
+    ),
+])
+
+def compact_inputs(inputs: dict) -> dict:
+    """
+    JSON-prompt variables -> compact-prompt variables (the examples are re-encoded, the note is unchanged).
+    """
+    examples = inputs.get("EXAMPLES_TEXT", EXAMPLES_TEXT)
+    return {
+        "Note": inputs["Note"],
+        "format_instructions": COMPACT_INSTRUCTIONS,
+        "EXAMPLES_TEXT": COMPACT_EXAMPLES_TEXT if examples == EXAMPLES_TEXT else encode_examples(examples),
+    }
+
+# ----------------------------
+# Chain
+# ----------------------------
+def compact_chain(batch_size: int = 1):
+    """
+    Drop-in for batched_chain: same inputs, same [full_response, json] output, with the JSON
+    expanded from the compact answer. Generation stops at END.
+    """
+    from langchain_core.runnables import RunnableLambda
+    from transformers import StoppingCriteriaList, StopStringCriteria
+    from model_chain import get_pipeline, get_tokenizer, parallel_chain, combine_both
+
+    stop = StoppingCriteriaList([StopStringCriteria(get_tokenizer(), [END])])
+    llm = get_pipeline().model_copy(update={"batch_size": batch_size})
+    llm = llm.bind(pipeline_kwargs={"batch_size": batch_size, "stopping_criteria": stop})
+    expand_result = RunnableLambda(lambda result: [result[0], expand_json(result[1])])
+    return (RunnableLambda(compact_inputs) | compact_prompt | llm | parallel_chain | RunnableLambda(combine_both)
+            | expand_result)
+
+@functools.lru_cache(maxsize=64)
+def split_compact_prompt(examples_text: str):
+    """
+    (text before the note, text after it) of the compact prompt, for the compact response log.
+    """
+    sentinel = "\x00NOTE\x00"
+    inputs = compact_inputs({"Note": sentinel, "EXAMPLES_TEXT": examples_text})
+    prefix, suffix = compact_prompt.invoke(inputs).to_string().split(sentinel)
+    return prefix, suffix
+
+# ----------------------------
+# Evaluation against the JSON format
+# ----------------------------
+def evaluate(train_csv: str = TRAIN_CSV, held_out: int = 50, seed: int = 0, count_tokens=None,
+             invoke_json=None, invoke_compact=None, batch_size: int = 8) -> dict:
+    """
+    On `held_out` train notes: answer tokens of the gold labels in both formats, how many gold labels
+    survive encode -> expand exactly, prompt tokens, and (when the invoke_* batch functions are given)
+    per-field accuracy of the model's answers in each format.
+    """
+    from collections import defaultdict
+    from example_store import approx_tokens, field_accuracy, read_examples
+    from schema_and_prompt import prompt, format_instructions
+
+    count_tokens = count_tokens or approx_tokens
+    _, notes, json_texts = read_examples(train_csv)
+    order = list(range(len(notes)))
+    random.Random(seed).shuffle(order)
+    test = order[:held_out]
+
+    golds = [json.loads(json_texts[i]) for i in test]
+    json_tokens = [count_tokens(json_texts[i]) for i in test]
+    compact_tokens = [count_tokens(encode(gold)) for gold in golds]
+    exact = sum(expand(encode(gold)) == gold for gold in golds)
+    inputs = [{"Note": notes[i], "format_instructions": format_instructions, "EXAMPLES_TEXT": EXAMPLES_TEXT} for i in test]
+    report = {
+        "json": {
+            "answer_tokens_per_note": sum(json_tokens) / len(test),
+            "prompt_tokens_per_note": sum(count_tokens(prompt.invoke(inp).to_string()) for inp in inputs) / len(test),
+        },
+        "compact": {
+            "answer_tokens_per_note": sum(compact_tokens) / len(test),
+            "prompt_tokens_per_note": sum(count_tokens(compact_prompt.invoke(compact_inputs(inp)).to_string())
+                                          for inp in inputs) / len(test),
+        },
+        "round_trip_exact": exact / len(test),
+    }
+    report["answer_token_reduction"] = 1 - sum(compact_tokens) / sum(json_tokens)
+    for name, invoke_batch in (("json", invoke_json), ("compact", invoke_compact)):
+        if invoke_batch is None:
+            continue
+        fields = defaultdict(list)
+        for start in range(0, len(inputs), batch_size):
+            outputs = invoke_batch(inputs[start:start + batch_size])
+            for i, (_, json_text) in zip(test[start:start + batch_size], outputs):
+                for field, score in field_accuracy(json_text, json_texts[i]).items():
+                    fields[field].append(score)
+        accuracy = {field: sum(v) / len(v) for field, v in fields.items()}
+        accuracy["mean"] = sum(accuracy.values()) / len(accuracy)
+        report[name]["accuracy"] = accuracy
+    if invoke_json is not None and invoke_compact is not None:
+        report["accuracy_change"] = report["compact"]["accuracy"]["mean"] - report["json"]["accuracy"]["mean"]
+    return report
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Compare the compact output encoding with JSON output.")
+    arg_parser.add_argument("--held-out", type=int, default=50)
+    arg_parser.add_argument("--tokens-only", action="store_true", help="Only measure tokens and round trips (no model).")
+    arg_parser.add_argument("--batch-size", type=int, default=8)
+    args = arg_parser.parse_args()
+
+    invoke_json = invoke_compact = count_tokens = None
+    if not args.tokens_only:
+        from model_chain import batched_chain, get_tokenizer
+
+        tokenizer = get_tokenizer()
+        count_tokens = lambda text: len(tokenizer(text, add_special_tokens=False)["input_ids"])
+        invoke_json = batched_chain(args.batch_size).batch
+        invoke_compact = compact_chain(args.batch_size).batch
+    print(json.dumps(evaluate(held_out=args.held_out, count_tokens=count_tokens, invoke_json=invoke_json,
+                              invoke_compact=invoke_compact, batch_size=args.batch_size), indent=2))
@@ -13,3 +13,92 @@ load_dotenv()
 # Absolute CSV paths as in the original code.
 TRAIN_CSV = "/home/lavesh/medical-note-extraction/train.csv"
 TEST_CSV = "/home/lavesh/medical-note-extraction/test.csv"
+
+# Precomputed vocabularies and format instructions derived from TRAIN_CSV (rebuilt when it changes).
+VOCAB_CACHE = ".cache/schema_vocab.json"
+
+# Model served by the pipeline.
+MODEL_ID = "Qwen/Qwen2.5-14B-Instruct"
+
+# Number of notes generated together in one padded batch (1 = row-by-row).
+BATCH_SIZE = 8
+
+# Mask logits with the JsonOutput schema automaton (compiled once per tokenizer, cached on disk).
+CONSTRAINED_DECODING = False
+CONSTRAINT_CACHE_DIR = ".cache/json_constraint"
+
+# Streaming runner: append-only result log, CSV export, and how often the log is fsynced.
+OUTPUT_LOG = "final_output_fewshot.jsonl"
+OUTPUT_CSV = "final_output_fewshot.csv"
+# Columnar copy of the results (typed extraction columns + raw.* text columns); None to skip it.
+OUTPUT_PARQUET = "final_output_fewshot.parquet"
+CHUNK_SIZE = 256
+FSYNC_EVERY = 32
+# Log only the generated continuation plus a hash of its prompt template, stored once in PROMPT_REGISTRY.
+COMPACT_LOG = True
+PROMPT_REGISTRY = "prompt_registry.jsonl"
+
+# Shared work queue for several inference workers (see work_queue.py).
+QUEUE_DB = "work_queue.sqlite"
+LEASE_SECONDS = 900
+MAX_ATTEMPTS = 3
+
+# Content-addressed cache of model outputs (note + prompt + model config -> response), LRU-bounded.
+CACHE_DB = ".cache/extractions.sqlite"
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Post-processing: final submission file and worker processes (None = one per CPU).
+SUBMISSION_CSV = "submission_llm.csv"
+POSTPROCESS_WORKERS = None
+
+# Local extraction service (extraction_service.py): address and how long a micro-batch waits to fill.
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8000
+SERVICE_MAX_WAIT_MS = 20
+
+# Per-note chain tracing (tracing.py): JSONL trace, Prometheus text snapshot rewritten every N notes.
+# Stage timing from LangChain callbacks is cheap and stays on; the HF pipeline hooks that split the model call
+# into tokenize / prefill / decode / detokenize patch the pipeline, so they are off unless asked for (--trace).
+TRACING = True
+TRACE_PIPELINE = False
+TRACE_LOG = "traces/extraction_trace.jsonl"
+METRICS_SNAPSHOT = "traces/metrics.prom"
+SNAPSHOT_EVERY = 16
+
+# Retrieved few-shot examples (example_store.py): at most EXAMPLE_K per note, within EXAMPLE_TOKEN_BUDGET prompt tokens.
+DYNAMIC_EXAMPLES = False
+EXAMPLE_STORE_CACHE = ".cache/example_store.pkl"
+EXAMPLE_K = 3
+EXAMPLE_TOKEN_BUDGET = 1500
+
+# Inline JSON repair: rows that cannot be repaired/validated are regenerated (greedy, optionally schema-constrained).
+MAX_REGENERATIONS = 2
+REGENERATE_CONSTRAINED = True
+
+# Prompt-lookup speculative decoding (greedy, row by row): n-gram length looked up and tokens drafted per step.
+SPECULATIVE_MAX_NGRAM = 3
+SPECULATIVE_DRAFT_TOKENS = 10
+
+# Near-duplicate notes (near_duplicates.py): MinHash permutations and LSH bands over the relevant sections.
+NEAR_DUPLICATES = True
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+
+# Inference backend (backends.py): "hf" (MODEL_ID on GPU, 4-bit), "cpu" or "stub" (in-process, no model).
+BACKEND = "hf"
+# CPU backend: a .gguf file runs on llama.cpp, an HF model id is loaded with int8 dynamic quantization;
+# threads (None = one per CPU) and llama.cpp context length.
+CPU_MODEL = "models/qwen2.5-14b-instruct-q4_k_m.gguf"
+CPU_THREADS = None
+CPU_CONTEXT = 8192
+# One line of per-backend throughput per run, to compare hardware (python backends.py summarizes it).
+BACKEND_STATS = "traces/backend_throughput.jsonl"
+
+# Per-note max_new_tokens (token_budget.py): answer tokens for the JSON skeleton, per symptom and per vital-sign
+# value, times a safety margin, at least BUDGET_MIN_TOKENS. Answers cut off at their budget are retried with double.
+ADAPTIVE_BUDGET = True
+BUDGET_BASE_TOKENS = 64
+BUDGET_SYMPTOM_TOKENS = 6
+BUDGET_VITAL_TOKENS = 20
+BUDGET_MARGIN = 1.5
+BUDGET_MIN_TOKENS = 128
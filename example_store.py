@@ -0,0 +1,210 @@
+# example_store.py
+# Retrieval-based few-shot selection: a TF-IDF index over train.csv notes (pure Python, no GPU or network)
+# returns the most similar labelled notes for each input, as many as fit a prompt-token budget.
+
+import argparse
+import ast
+import json
+import math
+import os
+import pickle
+import random
+import re
+from collections import Counter, defaultdict
+
+from config import TRAIN_CSV, EXAMPLE_STORE_CACHE, EXAMPLE_K, EXAMPLE_TOKEN_BUDGET
+
+TOKEN = re.compile(r"[a-z][a-z0-9]+")
+
+def terms(text: str) -> Counter:
+    return Counter(TOKEN.findall(text.lower()))
+
+def approx_tokens(text: str) -> int:
+    """
+    Rough prompt-token count (~4 characters per token) when no tokenizer is at hand.
+    """
+    return len(text) // 4 + 1
+
+def render_example(number: int, note: str, json_text: str) -> str:
+    """
+    One example in the EXAMPLES_TEXT layout.
+    """
+    return f"### Example {number}\nMedical Note:\n{note.strip()}\n\nAssistant: {json_text}\n"
+
+class ExampleStore:
+    """
+    Labelled notes with a sublinear-TF / smoothed-IDF index. Terms present in more than
+    `max_df` of the notes are not indexed: they barely change the ranking but dominate lookup cost.
+    """
+
+    def __init__(self, notes, json_texts, ids=None, max_df: float = 0.5, query_terms: int = 64):
+        self.notes = list(notes)
+        self.json_texts = list(json_texts)
+        self.ids = list(ids) if ids is not None else list(range(len(self.notes)))
+        self.query_terms = query_terms
+        n = len(self.notes)
+        doc_terms = [terms(note) for note in self.notes]
+        df = Counter(t for counts in doc_terms for t in counts)
+        self.idf = {t: math.log((1 + n) / (1 + d)) + 1 for t, d in df.items() if d <= max_df * n}
+        self.postings = defaultdict(list)
+        for i, counts in enumerate(doc_terms):
+            for t, w in self._vector(counts).items():
+                self.postings[t].append((i, w))
+        self.token_counts = {}
+
+    def _vector(self, counts: Counter) -> dict:
+        vec = {t: (1 + math.log(c)) * self.idf[t] for t, c in counts.items() if t in self.idf}
+        norm = math.sqrt(sum(w * w for w in vec.values())) or 1.0
+        return {t: w / norm for t, w in vec.items()}
+
+    def search(self, note: str, n: int):
+        """
+        [(index, cosine similarity), ...] of the `n` most similar stored notes.
+        """
+        vec = self._vector(terms(note))
+        top_terms = sorted(vec.items(), key=lambda tw: tw[1], reverse=True)[:self.query_terms]
+        scores = defaultdict(float)
+        for t, w in top_terms:
+            for i, dw in self.postings.get(t, ()):
+                scores[i] += w * dw
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n]
+
+    def select(self, note: str, k: int = EXAMPLE_K, token_budget: int = EXAMPLE_TOKEN_BUDGET, count_tokens=approx_tokens):
+        """
+        Indices of up to `k` similar examples whose rendered text fits `token_budget`, most similar first.
+        Candidates that would overflow the budget are skipped in favour of shorter, less similar ones.
+        """
+        chosen, used = [], 0
+        for i, _ in self.search(note, 4 * k):
+            if i not in self.token_counts:
+                self.token_counts[i] = count_tokens(render_example(1, self.notes[i], self.json_texts[i]))
+            if used + self.token_counts[i] > token_budget:
+                continue
+            chosen.append(i)
+            used += self.token_counts[i]
+            if len(chosen) == k:
+                break
+        return chosen
+
+    def examples_text(self, note: str, k: int = EXAMPLE_K, token_budget: int = EXAMPLE_TOKEN_BUDGET,
+                      count_tokens=approx_tokens) -> str:
+        """
+        Drop-in replacement for EXAMPLES_TEXT, built from the examples retrieved for `note`.
+        """
+        chosen = self.select(note, k, token_budget, count_tokens)
+        blocks = [render_example(n, self.notes[i], self.json_texts[i]) for n, i in enumerate(chosen, 1)]
+        return "\n" + "\n".join(blocks)
+
+# ----------------------------
+# Building and caching
+# ----------------------------
+def read_examples(train_csv: str = TRAIN_CSV):
+    """
+    (ids, notes, JSON texts) from train.csv, with the labels re-serialized as JSON like EXAMPLES_TEXT.
+    """
+    import pandas as pd
+
+    train = pd.read_csv(train_csv)
+    json_texts = [json.dumps(ast.literal_eval(js)) for js in train["json"]]
+    return train["ID"].tolist(), train["Note"].tolist(), json_texts
+
+def load_store(train_csv: str = TRAIN_CSV, cache_path: str = EXAMPLE_STORE_CACHE) -> ExampleStore:
+    """
+    The example store for `train_csv`, unpickled from `cache_path` while train.csv is unchanged.
+    """
+    stat = os.stat(train_csv)
+    signature = (os.path.abspath(train_csv), stat.st_size, stat.st_mtime_ns)
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            cached_signature, store = pickle.load(f)
+        if cached_signature == signature:
+            return store
+    ids, notes, json_texts = read_examples(train_csv)
+    store = ExampleStore(notes, json_texts, ids)
+    directory = os.path.dirname(cache_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump((signature, store), f)
+    os.replace(tmp_path, cache_path)
+    return store
+
+# ----------------------------
+# Held-out evaluation
+# ----------------------------
+def field_accuracy(predicted: str, expected: str) -> dict:
+    """
+    Exact match per top-level field (symptoms compared as sets); unparseable output scores 0.
+    """
+    truth = json.loads(expected)
+    try:
+        data = json.loads(predicted)
+    except (json.JSONDecodeError, TypeError):
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    scores = {}
+    for field, value in truth.items():
+        got = data.get(field)
+        if field == "symptoms":
+            scores[field] = float(isinstance(got, list) and set(map(str, got)) == set(value))
+        else:
+            scores[field] = float(got == value)
+    return scores
+
+def evaluate(train_csv: str = TRAIN_CSV, held_out: int = 50, seed: int = 0, k: int = EXAMPLE_K,
+             token_budget: int = EXAMPLE_TOKEN_BUDGET, count_tokens=approx_tokens, invoke_batch=None,
+             batch_size: int = 8) -> dict:
+    """
+    Compare the fixed EXAMPLES_TEXT with retrieved examples on `held_out` train notes (excluded from
+    the store): prompt tokens per note and, when `invoke_batch(inputs) -> [[full, json], ...]` is given,
+    per-field accuracy of the model's answers.
+    """
+    from schema_and_prompt import prompt, format_instructions, EXAMPLES_TEXT
+
+    ids, notes, json_texts = read_examples(train_csv)
+    order = list(range(len(notes)))
+    random.Random(seed).shuffle(order)
+    test, train = order[:held_out], order[held_out:]
+    store = ExampleStore([notes[i] for i in train], [json_texts[i] for i in train], [ids[i] for i in train])
+
+    report = {}
+    for name, examples_for in (("static", lambda note: EXAMPLES_TEXT),
+                               ("retrieved", lambda note: store.examples_text(note, k, token_budget, count_tokens))):
+        inputs = [{"Note": notes[i], "format_instructions": format_instructions, "EXAMPLES_TEXT": examples_for(notes[i])}
+                  for i in test]
+        tokens = [count_tokens(prompt.invoke(inp).to_string()) for inp in inputs]
+        report[name] = {"prompt_tokens_per_note": sum(tokens) / len(tokens)}
+        if invoke_batch is not None:
+            fields = defaultdict(list)
+            for start in range(0, len(inputs), batch_size):
+                outputs = invoke_batch(inputs[start:start + batch_size])
+                for i, (_, json_text) in zip(test[start:start + batch_size], outputs):
+                    for field, score in field_accuracy(json_text, json_texts[i]).items():
+                        fields[field].append(score)
+            report[name]["accuracy"] = {field: sum(v) / len(v) for field, v in fields.items()}
+            report[name]["accuracy"]["mean"] = sum(sum(v) / len(v) for v in fields.values()) / len(fields)
+    report["prompt_token_reduction"] = 1 - report["retrieved"]["prompt_tokens_per_note"] / report["static"]["prompt_tokens_per_note"]
+    if invoke_batch is not None:
+        report["accuracy_change"] = report["retrieved"]["accuracy"]["mean"] - report["static"]["accuracy"]["mean"]
+    return report
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Evaluate retrieved few-shot examples against EXAMPLES_TEXT.")
+    arg_parser.add_argument("--held-out", type=int, default=50)
+    arg_parser.add_argument("--k", type=int, default=EXAMPLE_K)
+    arg_parser.add_argument("--token-budget", type=int, default=EXAMPLE_TOKEN_BUDGET)
+    arg_parser.add_argument("--tokens-only", action="store_true", help="Only measure prompt tokens (no model).")
+    arg_parser.add_argument("--batch-size", type=int, default=8)
+    args = arg_parser.parse_args()
+
+    invoke_batch, count_tokens = None, approx_tokens
+    if not args.tokens_only:
+        from model_chain import batched_chain, get_tokenizer
+
+        tokenizer = get_tokenizer()
+        count_tokens = lambda text: len(tokenizer(text)["input_ids"])
+        invoke_batch = batched_chain(args.batch_size).batch
+    print(json.dumps(evaluate(held_out=args.held_out, k=args.k, token_budget=args.token_budget,
+                              count_tokens=count_tokens, invoke_batch=invoke_batch, batch_size=args.batch_size), indent=2))
@@ -0,0 +1,97 @@
+# extraction_cache.py
+# Persistent, content-addressed cache of model outputs keyed by note + prompt + model configuration.
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from config import CACHE_DB, CACHE_MAX_BYTES
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS extractions (
+    key TEXT PRIMARY KEY,
+    full_response TEXT,
+    json TEXT,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS extractions_lru ON extractions (last_access);
+"""
+
+def cache_key(note: str, static_prompt: str, model_id: str, generation_kwargs: dict) -> str:
+    """
+    Hash of everything that determines the model output. Any change to the prompt
+    (examples, schema, rules), the model or the generation settings gives a new key.
+    """
+    payload = json.dumps([note, static_prompt, model_id, generation_kwargs], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ExtractionCache:
+    """
+    SQLite-backed map of cache key -> [full_response, json] with size-bounded LRU eviction.
+    Safe to share between processes; hit/miss counters are per process.
+    """
+
+    def __init__(self, path: str = CACHE_DB, max_bytes: int = CACHE_MAX_BYTES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        row = self.conn.execute("SELECT full_response, json FROM extractions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute("UPDATE extractions SET last_access = ? WHERE key = ?", (time.time(), key))
+        return [row[0], row[1]]
+
+    def put(self, key: str, result):
+        full_response, json_text = result[0], result[1]
+        size = len((full_response or "").encode("utf-8")) + len((json_text or "").encode("utf-8"))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO extractions (key, full_response, json, size, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, full_response, json_text, size, time.time()),
+        )
+        self.total_bytes += size
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Drop least recently used entries until the cache is back under 90% of its budget.
+        """
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+        if self.total_bytes <= target:
+            return
+        freed, victims = 0, []
+        for key, size in self.conn.execute("SELECT key, size FROM extractions ORDER BY last_access"):
+            victims.append((key,))
+            freed += size
+            if self.total_bytes - freed <= target:
+                break
+        self.conn.executemany("DELETE FROM extractions WHERE key = ?", victims)
+        self.total_bytes -= freed
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self.conn.execute("SELECT COUNT(*) FROM extractions").fetchone()[0],
+            "bytes": self.total_bytes,
+        }
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,254 @@
+# extraction_service.py
+# Long-running local extraction service: notes arrive one per HTTP request, concurrent requests are
+# grouped into micro-batches (max batch size / max wait) and each batch runs as one generate call.
+
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from config import BATCH_SIZE, SERVICE_HOST, SERVICE_PORT, SERVICE_MAX_WAIT_MS, BACKEND
+
+# ----------------------------
+# Micro-batching
+# ----------------------------
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class MicroBatcher:
+    """
+    Collects submitted notes into batches: a batch is dispatched once `max_batch_size` notes are
+    waiting or `max_wait_ms` has passed since its first note. `invoke_batch(notes) -> [[full, json], ...]`
+    runs on a single worker thread, so generate calls never overlap.
+    """
+
+    def __init__(self, invoke_batch, max_batch_size: int = BATCH_SIZE, max_wait_ms: float = SERVICE_MAX_WAIT_MS):
+        self.invoke_batch = invoke_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=10000)
+        self.queue_waits = deque(maxlen=10000)
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, note: str):
+        """
+        Queue one note and wait for its [full_response, json] result.
+        """
+        future = asyncio.get_running_loop().create_future()
+        start = time.perf_counter()
+        await self.queue.put((note, future, start))
+        try:
+            return await future
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            now = time.perf_counter()
+            self.queue_waits.extend(now - start for _, _, start in batch)
+            self.in_flight = len(batch)
+            self.batch_sizes[len(batch)] += 1
+            try:
+                results = await loop.run_in_executor(self.executor, self.invoke_batch, [note for note, _, _ in batch])
+            except Exception as exc:
+                self.errors += len(batch)
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            finally:
+                self.requests += len(batch)
+                self.in_flight = 0
+
+    def metrics(self) -> dict:
+        latencies, waits = list(self.latencies), list(self.queue_waits)
+        batches = sum(self.batch_sizes.values())
+        return {
+            "queue_depth": self.queue.qsize(),
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "batches": batches,
+            "mean_batch_size": self.requests / batches if batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "latency_ms": {f"p{int(q * 100)}": 1000 * percentile(latencies, q) for q in (0.5, 0.95, 0.99)},
+            "queue_wait_ms": {f"p{int(q * 100)}": 1000 * percentile(waits, q) for q in (0.5, 0.95, 0.99)},
+        }
+
+# ----------------------------
+# Minimal HTTP/1.1 front end
+# ----------------------------
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+async def read_request(reader: asyncio.StreamReader):
+    """
+    (method, path, body bytes, lower-cased headers) of one request, or None when the client closed the connection.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method, path, body, headers
+
+def write_response(writer: asyncio.StreamWriter, status: int, payload: dict, keep_alive: bool):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    head = (
+        f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    writer.write(head.encode("latin-1") + body)
+
+class ExtractionService:
+    """
+    Routes: POST /extract {"note": ...} -> {"json", "full_response", "latency_ms"};
+    GET /metrics -> batcher metrics; GET /health.
+    """
+
+    def __init__(self, batcher: MicroBatcher, postprocess=None):
+        self.batcher = batcher
+        self.postprocess = postprocess
+
+    async def handle(self, path: str, method: str, body: bytes):
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        if method == "GET" and path == "/metrics":
+            return 200, self.batcher.metrics()
+        if method == "POST" and path == "/extract":
+            try:
+                note = json.loads(body)["note"]
+            except (ValueError, KeyError, TypeError):
+                return 400, {"error": 'expected a JSON body {"note": "..."}'}
+            if not isinstance(note, str):
+                return 400, {"error": "note must be a string"}
+            start = time.perf_counter()
+            try:
+                full_response, json_text = await self.batcher.submit(note)
+            except Exception as exc:
+                return 500, {"error": f"{type(exc).__name__}: {exc}"}
+            if self.postprocess is not None:
+                json_text = self.postprocess(json_text)
+            return 200, {
+                "json": json_text,
+                "full_response": full_response,
+                "latency_ms": 1000 * (time.perf_counter() - start),
+            }
+        return 404, {"error": f"no route for {method} {path}"}
+
+    async def on_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    write_response(writer, 400, {"error": "malformed request"}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, body, headers = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                status, payload = await self.handle(path, method, body)
+                write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+async def serve(invoke_batch, host: str = SERVICE_HOST, port: int = SERVICE_PORT, unix_path: str = None,
+                max_batch_size: int = BATCH_SIZE, max_wait_ms: float = SERVICE_MAX_WAIT_MS, postprocess=None):
+    batcher = MicroBatcher(invoke_batch, max_batch_size, max_wait_ms)
+    batcher.start()
+    service = ExtractionService(batcher, postprocess)
+    if unix_path:
+        server = await asyncio.start_unix_server(service.on_connection, path=unix_path)
+        print(f"Serving on unix:{unix_path}")
+    else:
+        server = await asyncio.start_server(service.on_connection, host, port)
+        print(f"Serving on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Local extraction service with dynamic micro-batching.")
+    arg_parser.add_argument("--host", default=SERVICE_HOST)
+    arg_parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    arg_parser.add_argument("--unix", default=None, help="Listen on this Unix socket path instead of TCP.")
+    arg_parser.add_argument("--max-batch-size", type=int, default=BATCH_SIZE)
+    arg_parser.add_argument("--max-wait-ms", type=float, default=SERVICE_MAX_WAIT_MS)
+    arg_parser.add_argument("--stub", action="store_true", help="Use the stub model instead of the LLM.")
+    arg_parser.add_argument("--backend", choices=["hf", "cpu", "stub"], default=BACKEND,
+                            help="Inference backend behind the chain (see backends.py).")
+    arg_parser.add_argument("--stub-delay", type=float, default=0.0, help="Seconds per note for the stub model.")
+    arg_parser.add_argument("--no-normalize", action="store_true",
+                            help="Return raw symptom / visit-motivation labels.")
+    args = arg_parser.parse_args()
+
+    if args.stub:
+        from stub_llm import stub_invoke_batch
+
+        def invoke_batch(notes):
+            return stub_invoke_batch(notes, args.stub_delay)
+    else:
+        from backends import get_backend
+        from work_queue import model_invoke_batch
+
+        get_backend(args.backend).warm_up()
+        model_batch = {}
+
+        def invoke_batch(notes):
+            # Built on the batcher's worker thread: the extraction cache's SQLite connection is thread-bound.
+            if "invoke" not in model_batch:
+                model_batch["invoke"] = model_invoke_batch(args.max_batch_size, backend=args.backend,
+                                                           normalize=not args.no_normalize)
+            return model_batch["invoke"](notes)
+
+    # The model path normalizes labels in its own result pipeline; the stub's answers are normalized here.
+    postprocess = None
+    if args.stub and not args.no_normalize:
+        from normalizer import normalize_json as postprocess
+
+    asyncio.run(serve(invoke_batch, args.host, args.port, args.unix, args.max_batch_size, args.max_wait_ms, postprocess))
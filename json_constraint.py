@@ -0,0 +1,381 @@
+# json_constraint.py
+# Schema-constrained generation: compile JsonOutput into a token-level automaton and mask logits with it.
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import time
+import types
+import typing
+from typing import Literal, Union
+
+import torch
+from pydantic import BaseModel
+from transformers import LogitsProcessor
+
+from config import CONSTRAINT_CACHE_DIR
+
+# ----------------------------
+# Grammar from the Pydantic schema
+# ----------------------------
+# The grammar is a small regex-like AST of tuples:
+#   ("lit", text) | ("chars", charset) | ("seq", [nodes]) | ("alt", [nodes]) | ("opt", node)
+#   ("rep", node, lo, hi) for short bounded repeats | ("star", node) for unbounded loops
+
+DIGITS = frozenset("0123456789")
+NONZERO = frozenset("123456789")
+
+INT = ("alt", [("lit", "0"), ("seq", [("chars", NONZERO), ("rep", ("chars", DIGITS), 0, 5)])])
+FLOAT = ("seq", [INT, ("opt", ("seq", [("lit", "."), ("rep", ("chars", DIGITS), 1, 3)]))])
+# Free-text strings: any printable character except quote/backslash, bounded length.
+STRING_CHARS = frozenset(chr(c) for c in range(32, 127)) - frozenset('"\\')
+STRING = ("seq", [("lit", '"'), ("rep", ("chars", STRING_CHARS), 0, 64), ("lit", '"')])
+
+def json_string(value: str):
+    """
+    A fixed string value, accepted both with and without ASCII escaping (e.g. "°C" and "\\u00b0C").
+    """
+    forms = {json.dumps(value), json.dumps(value, ensure_ascii=False)}
+    return ("alt", [("lit", form) for form in sorted(forms)])
+
+def _is_optional(annotation) -> bool:
+    return typing.get_origin(annotation) in (Union, types.UnionType) and type(None) in typing.get_args(annotation)
+
+def _strip_optional(annotation):
+    if _is_optional(annotation):
+        args = [a for a in typing.get_args(annotation) if a is not type(None)]
+        return args[0]
+    return annotation
+
+def value_grammar(annotation, field=None):
+    """
+    Grammar for one field value. Strings with a default (the units) are fixed to that default.
+    """
+    annotation = _strip_optional(annotation)
+    origin = typing.get_origin(annotation)
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return object_grammar(annotation)
+    if origin is Literal:
+        return ("alt", [json_string(v) for v in typing.get_args(annotation)])
+    if origin in (list, typing.List):
+        item = value_grammar(typing.get_args(annotation)[0])
+        items = ("seq", [item, ("star", ("seq", [("lit", ", "), item]))])
+        return ("seq", [("lit", "["), ("opt", items), ("lit", "]")])
+    if annotation is int:
+        return INT
+    if annotation is float:
+        return FLOAT
+    if annotation is str:
+        if field is not None and isinstance(field.default, str) and field.default:
+            return json_string(field.default)
+        return STRING
+    raise TypeError(f"Unsupported annotation in schema: {annotation!r}")
+
+def object_grammar(model):
+    """
+    Object with keys in declared order. Optional[...] fields may be omitted; all others are always emitted.
+    """
+    members = []
+    for name, field in model.model_fields.items():
+        item = ("seq", [("lit", json.dumps(name) + ": "), value_grammar(field.annotation, field)])
+        members.append((item, _is_optional(field.annotation)))
+
+    # rest(i, first): members i.. given whether a member has been emitted yet (controls the ", " separator).
+    def rest(i, first):
+        if i == len(members):
+            return ("seq", [])
+        item, optional = members[i]
+        if not first:
+            sep_item = ("seq", [("lit", ", "), item])
+            return ("seq", [("opt", sep_item) if optional else sep_item, rest(i + 1, False)])
+        if not optional:
+            return ("seq", [item, rest(i + 1, False)])
+        return ("alt", [("seq", [item, rest(i + 1, False)]), rest(i + 1, True)])
+
+    return ("seq", [("lit", "{"), rest(0, True), ("lit", "}")])
+
+def schema_grammar(model):
+    # Allow a single leading space/newline before the object, as the prompt ends with "Assistant:\n".
+    return ("seq", [("opt", ("chars", frozenset(" \n"))), object_grammar(model)])
+
+# ----------------------------
+# Character automaton (Thompson NFA, lazily determinized)
+# ----------------------------
+class CharAutomaton:
+    """
+    Character-level DFA for a grammar AST. DFA states are epsilon-closed sets of NFA nodes,
+    numbered as they are discovered; `step` returns None for a dead transition.
+    """
+
+    def __init__(self, grammar):
+        self.eps = []
+        self.edges = []
+        start, self.final = self._compile(grammar)
+        self.states = []
+        self.index = {}
+        self.moves = {}
+        self.start = self._state(self._closure({start}))
+
+    def _node(self) -> int:
+        self.eps.append([])
+        self.edges.append([])
+        return len(self.eps) - 1
+
+    def _compile(self, node):
+        kind = node[0]
+        if kind == "lit":
+            start = end = self._node()
+            for ch in node[1]:
+                nxt = self._node()
+                self.edges[end].append((frozenset(ch), nxt))
+                end = nxt
+            return start, end
+        if kind == "chars":
+            start, end = self._node(), self._node()
+            self.edges[start].append((node[1], end))
+            return start, end
+        if kind == "seq":
+            start = end = self._node()
+            for child in node[1]:
+                s, e = self._compile(child)
+                self.eps[end].append(s)
+                end = e
+            return start, end
+        if kind == "alt":
+            start, end = self._node(), self._node()
+            for child in node[1]:
+                s, e = self._compile(child)
+                self.eps[start].append(s)
+                self.eps[e].append(end)
+            return start, end
+        if kind == "opt":
+            s, e = self._compile(node[1])
+            self.eps[s].append(e)
+            return s, e
+        if kind == "star":
+            start, end = self._node(), self._node()
+            s, e = self._compile(node[1])
+            self.eps[start] += [s, end]
+            self.eps[e] += [s, end]
+            return start, end
+        if kind == "rep":
+            _, child, lo, hi = node
+            parts = [child] * lo + [("opt", child)] * (hi - lo)
+            return self._compile(("seq", parts))
+        raise ValueError(f"Unknown grammar node: {kind}")
+
+    def _closure(self, nodes) -> frozenset:
+        stack, seen = list(nodes), set(nodes)
+        while stack:
+            for nxt in self.eps[stack.pop()]:
+                if nxt not in seen:
+                    seen.add(nxt)
+                    stack.append(nxt)
+        return frozenset(seen)
+
+    def _state(self, nodes: frozenset) -> int:
+        if nodes not in self.index:
+            self.index[nodes] = len(self.states)
+            self.states.append(nodes)
+        return self.index[nodes]
+
+    def step(self, state: int, ch: str):
+        key = (state, ch)
+        if key not in self.moves:
+            targets = {nxt for node in self.states[state] for chars, nxt in self.edges[node] if ch in chars}
+            self.moves[key] = self._state(self._closure(targets)) if targets else None
+        return self.moves[key]
+
+    def accepting(self, state: int) -> bool:
+        return self.final in self.states[state]
+
+# ----------------------------
+# Token-level automaton
+# ----------------------------
+class TokenAutomaton:
+    """
+    For every reachable DFA state: the token ids allowed next and the state each one leads to.
+    Built by walking every vocabulary token through the character DFA, so multi-character
+    tokens that span several grammar pieces are handled naturally.
+    """
+
+    def __init__(self, start, allowed, next_states, accepting):
+        self.start = start
+        self.allowed = allowed
+        self.next_states = next_states
+        self.accepting = accepting
+        self.lookup = [dict(zip(a.tolist(), n.tolist())) for a, n in zip(allowed, next_states)]
+
+    @classmethod
+    def compile(cls, grammar, token_texts):
+        dfa = CharAutomaton(grammar)
+        by_first_char = {}
+        for token_id, text in token_texts.items():
+            by_first_char.setdefault(text[0], []).append(token_id)
+
+        allowed, next_states = {}, {}
+        queue = [dfa.start]
+        while queue:
+            state = queue.pop()
+            if state in allowed:
+                continue
+            ids, targets = [], []
+            for first, candidates in by_first_char.items():
+                if dfa.step(state, first) is None:
+                    continue
+                for token_id in candidates:
+                    current = state
+                    for ch in token_texts[token_id]:
+                        current = dfa.step(current, ch)
+                        if current is None:
+                            break
+                    if current is not None:
+                        ids.append(token_id)
+                        targets.append(current)
+                        if current not in allowed:
+                            queue.append(current)
+            order = sorted(range(len(ids)), key=ids.__getitem__)
+            allowed[state] = torch.tensor([ids[i] for i in order], dtype=torch.long)
+            next_states[state] = torch.tensor([targets[i] for i in order], dtype=torch.long)
+
+        n_states = len(dfa.states)
+        empty = torch.tensor([], dtype=torch.long)
+        return cls(
+            dfa.start,
+            [allowed.get(s, empty) for s in range(n_states)],
+            [next_states.get(s, empty) for s in range(n_states)],
+            {s for s in range(n_states) if dfa.accepting(s)},
+        )
+
+    def next_state(self, state: int, token_id: int):
+        return self.lookup[state].get(token_id)
+
+def token_texts(tokenizer) -> dict:
+    """
+    Decoded text of every ordinary vocabulary token; special tokens and partial UTF-8 pieces are left out.
+    """
+    special = set(tokenizer.all_special_ids)
+    texts = {}
+    for token_id in range(len(tokenizer)):
+        if token_id in special:
+            continue
+        text = tokenizer.decode([token_id])
+        if text and "�" not in text:
+            texts[token_id] = text
+    return texts
+
+def _canonical(node):
+    # repr() of a frozenset follows string hashing, which changes between processes; sort the characters.
+    if isinstance(node, frozenset):
+        return "".join(sorted(node))
+    if isinstance(node, (tuple, list)):
+        return [_canonical(child) for child in node]
+    return node
+
+def _cache_key(tokenizer, grammar) -> str:
+    digest = hashlib.sha256()
+    digest.update(str(getattr(tokenizer, "name_or_path", "")).encode("utf-8"))
+    digest.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode("utf-8"))
+    digest.update(json.dumps(_canonical(grammar)).encode("utf-8"))
+    return digest.hexdigest()[:24]
+
+def load_automaton(tokenizer, model=None, cache_dir: str = CONSTRAINT_CACHE_DIR) -> TokenAutomaton:
+    """
+    Compile the schema automaton for this tokenizer, or load it from the on-disk cache.
+    """
+    if model is None:
+        from schema_and_prompt import JsonOutput
+        model = JsonOutput
+    grammar = schema_grammar(model)
+    path = os.path.join(cache_dir, f"automaton_{_cache_key(tokenizer, grammar)}.pkl")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    automaton = TokenAutomaton.compile(grammar, token_texts(tokenizer))
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(automaton, f)
+    os.replace(tmp_path, path)
+    return automaton
+
+# ----------------------------
+# Logits processor
+# ----------------------------
+class JsonSchemaLogitsProcessor(LogitsProcessor):
+    """
+    Mask every token the schema automaton does not allow at the current position.
+    Positions with a single allowed token (fixed keys, units, punctuation) are therefore
+    forced rather than sampled. Once the object is complete only EOS is allowed.
+    Like the JSON stopping criterion, it resets itself at the start of each generate() call.
+    """
+
+    def __init__(self, automaton: TokenAutomaton, eos_token_ids):
+        self.automaton = automaton
+        self.eos = torch.tensor(sorted(set(eos_token_ids)), dtype=torch.long)
+        self.last_len = None
+        self.last_tokens = None
+        self.states = []
+
+    def _is_continuation(self, input_ids) -> bool:
+        if self.last_len is None or input_ids.shape[-1] != self.last_len + 1:
+            return False
+        if self.last_tokens.shape[0] != input_ids.shape[0]:
+            return False
+        return bool(torch.equal(input_ids[:, -2], self.last_tokens))
+
+    def __call__(self, input_ids, scores):
+        if self._is_continuation(input_ids):
+            for i, token_id in enumerate(input_ids[:, -1].tolist()):
+                state = self.states[i]
+                # None marks a finished (or off-grammar) row: leave it unconstrained.
+                self.states[i] = None if state is None else self.automaton.next_state(state, token_id)
+        else:
+            self.states = [self.automaton.start] * input_ids.shape[0]
+        self.last_len = input_ids.shape[-1]
+        self.last_tokens = input_ids[:, -1].clone()
+
+        mask = torch.full_like(scores, float("-inf"))
+        for i, state in enumerate(self.states):
+            if state is None:
+                mask[i] = 0
+                continue
+            allowed = self.automaton.allowed[state]
+            if state in self.automaton.accepting:
+                allowed = torch.cat([allowed, self.eos])
+            mask[i, allowed.to(scores.device)] = 0
+        return scores + mask
+
+def json_logits_processor(tokenizer, model=None) -> JsonSchemaLogitsProcessor:
+    eos = tokenizer.eos_token_id if isinstance(tokenizer.eos_token_id, list) else [tokenizer.eos_token_id]
+    return JsonSchemaLogitsProcessor(load_automaton(tokenizer, model), eos)
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Compile the JsonOutput automaton and report its cost.")
+    arg_parser.add_argument("--tokenizer", default=None, help="Tokenizer to compile for (default: MODEL_ID).")
+    arg_parser.add_argument("--cache-dir", default=CONSTRAINT_CACHE_DIR)
+    args = arg_parser.parse_args()
+
+    from transformers import AutoTokenizer
+    from config import MODEL_ID
+    from schema_and_prompt import JsonOutput
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer or MODEL_ID)
+    path = os.path.join(args.cache_dir, f"automaton_{_cache_key(tokenizer, schema_grammar(JsonOutput))}.pkl")
+    cached = os.path.exists(path)
+    start = time.perf_counter()
+    automaton = load_automaton(tokenizer, JsonOutput, args.cache_dir)
+    print(json.dumps({
+        "tokenizer": tokenizer.name_or_path,
+        "vocab_size": len(tokenizer),
+        # Loading an existing cache file instead of compiling.
+        "from_cache": cached,
+        "seconds": time.perf_counter() - start,
+        "states": len(automaton.allowed),
+        "transitions": sum(len(allowed) for allowed in automaton.allowed),
+        "cache_bytes": os.path.getsize(path),
+        "cache_path": path,
+    }, indent=2))
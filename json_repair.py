@@ -0,0 +1,181 @@
+# json_repair.py
+# Deterministic repair of model outputs (last complete object, trailing commas, unbalanced braces,
+# Python literals) and validation against JsonOutput, so only genuinely broken rows are regenerated.
+
+import ast
+import copy
+import json
+import re
+from collections import Counter
+
+from schema_and_prompt import extract_assistant_response
+
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+def complete_objects(text: str):
+    """
+    Every balanced top-level {...} substring of `text`, in order (braces inside strings ignored).
+    """
+    objects, depth, start, in_string, escape = [], 0, None, False, False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"' and depth:
+            in_string = True
+        elif ch == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                objects.append(text[start:i + 1])
+    return objects
+
+def close_truncated(text: str):
+    """
+    Close an object cut off mid-generation: finish an open string value, drop a dangling or partly written
+    object key and a trailing separator, then append the missing closing brackets. Strings inside arrays
+    are values and kept. A number cut off at the very end ("age": 3...) cannot be trusted: returns None.
+    """
+    start = text.find("{")
+    if start < 0:
+        return text
+    text = text[start:]
+    stack, in_string, escape = [], False, False
+    # Object key position (after "{" or ","), where the last string started, whether it was a key,
+    # and the start of a complete key that no value followed yet.
+    key_position, string_start, string_is_key, pending_key = False, 0, False, None
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+                pending_key = string_start if string_is_key else None
+            continue
+        if ch.isspace():
+            continue
+        if ch == ":":
+            key_position = False
+            continue
+        pending_key = None
+        if ch == '"':
+            in_string, string_start = True, i
+            string_is_key = bool(stack) and stack[-1] == "{" and key_position
+        elif ch in "{[":
+            stack.append(ch)
+            key_position = ch == "{"
+        elif ch in "}]" and stack:
+            stack.pop()
+            key_position = False
+        elif ch == ",":
+            key_position = bool(stack) and stack[-1] == "{"
+    if in_string:
+        if string_is_key:
+            text = text[:string_start]
+        else:
+            text += '"'
+    elif pending_key is not None:
+        text = text[:pending_key]
+    elif re.search(r"(?:\d[\d.eE+-]*|-)$", text.rstrip()):
+        return None
+    text = text.rstrip().rstrip(",:").rstrip()
+    return text + "".join("}" if opener == "{" else "]" for opener in reversed(stack))
+
+def _loads(text: str):
+    try:
+        data = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+def _literal(text: str):
+    try:
+        data = ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+    return data if isinstance(data, dict) else None
+
+def repair(text: str):
+    """
+    (parsed dict, repair method) for a model output, or (None, "failed").
+    Cheapest fixes first; the last complete object wins over earlier ones.
+    """
+    if not isinstance(text, str):
+        return None, "failed"
+    stripped = FENCE.sub("", text.strip())
+    if (data := _loads(stripped)) is not None:
+        return data, "ok" if stripped == text.strip() else "fence"
+    objects = complete_objects(stripped)
+    for obj in reversed(objects):
+        if (data := _loads(obj)) is not None:
+            return data, "last_object"
+    for obj in reversed(objects or [stripped]):
+        if (data := _loads(TRAILING_COMMA.sub(r"\1", obj))) is not None:
+            return data, "trailing_comma"
+    closed = close_truncated(stripped)
+    if closed is not None and (data := _loads(TRAILING_COMMA.sub(r"\1", closed))) is not None:
+        return data, "closed_braces"
+    for obj in reversed(objects or [stripped]):
+        if (data := _literal(obj)) is not None:
+            return json.loads(json.dumps(data, default=str)), "python_literal"
+    return None, "failed"
+
+def validate(data: dict):
+    """
+    Validation errors of `data` against JsonOutput after label normalization and coercion ([] when valid),
+    as validation.py reports them: [{"field", "type", "message"[, "input"]}, ...].
+    """
+    from normalizer import normalize_labels
+    from validation import validate_records
+
+    _, errors = validate_records([normalize_labels(copy.deepcopy(data))])[0]
+    return errors
+
+def repair_result(result):
+    """
+    [full_response, json] -> ([full_response, repaired json], method) if the output can be kept, else
+    (None, reason) and the row is regenerated: it does not parse ("unparseable"), it was cut off and only
+    parses once closed ("truncated"), or it has schema errors other than missing values ("invalid").
+    Fields the note lacks are left out, as the prompt asks, so an answer whose only errors are missing
+    values is kept ("missing_fields" when nothing else was repaired). Falls back to the generation inside
+    full_response when the extracted JSON part is unusable.
+    """
+    full_response, json_text = result[0], result[1]
+    data, method = repair(json_text)
+    if data is None and full_response:
+        data, method = repair(extract_assistant_response(full_response))
+    if data is None:
+        return None, "unparseable"
+    if method == "closed_braces":
+        return None, "truncated"
+    errors = validate(data)
+    if any(err["type"] != "missing" for err in errors):
+        return None, "invalid"
+    if errors and method == "ok":
+        method = "missing_fields"
+    if method in ("ok", "missing_fields"):
+        return [full_response, json_text], method
+    return [full_response, json.dumps(data, ensure_ascii=False)], method
+
+class RepairStats:
+    """
+    Counts of repair methods, regeneration attempts and rows that were still broken after the retry cap.
+    """
+
+    def __init__(self):
+        self.methods = Counter()
+        self.regenerated = 0
+        self.gave_up = 0
+
+    def report(self) -> dict:
+        return {"methods": dict(self.methods), "regenerated": self.regenerated, "gave_up": self.gave_up}
@@ -1,12 +1,18 @@
 # model_chain.py
 # Model loading, quantization config, and runnable chain assembly.
+# Nothing is loaded at import time: the pipeline and chains are built on first use (or by warm_up()).
 
+import hashlib
 import torch
-from transformers import BitsAndBytesConfig
-from langchain_huggingface import HuggingFacePipeline
+from transformers import BitsAndBytesConfig, DynamicCache, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
 from langchain_core.runnables import RunnableLambda, RunnableParallel, RunnablePassthrough
 
-from schema_and_prompt import prompt, parser, EXAMPLES_TEXT
+from config import (
+    MODEL_ID, BATCH_SIZE, CONSTRAINED_DECODING, REGENERATE_CONSTRAINED, SPECULATIVE_MAX_NGRAM, SPECULATIVE_DRAFT_TOKENS,
+)
+from schema_and_prompt import (
+    prompt, parser, EXAMPLES_TEXT, JsonOutput, extract_assistant_response, symptoms, visit_motivation,
+)
 
 # 4-bit quantization config for efficient inference.
 bnb_config = BitsAndBytesConfig(
@@ -15,17 +21,157 @@ bnb_config = BitsAndBytesConfig(
     bnb_4bit_compute_dtype=torch.float16,
 )
 
-# HF pipeline with the specified model and generation parameters.
-pipeline = HuggingFacePipeline.from_model_id(
-    model_id="Qwen/Qwen2.5-14B-Instruct",
-    task="text-generation",
-    model_kwargs={"quantization_config": bnb_config, "device_map": "auto"},
-    pipeline_kwargs={"max_new_tokens": 1000, "temperature": 0.1},
-)
+# Generation parameters shared by the pipeline and the prefix-cached path.
+GENERATION_KWARGS = {"max_new_tokens": 1000, "temperature": 0.1}
+
+# Objects built on first use, keyed by name.
+_built = {}
+
+def _lazy(name: str, factory):
+    if name not in _built:
+        _built[name] = factory()
+    return _built[name]
+
+def _build_pipeline():
+    from langchain_huggingface import HuggingFacePipeline
+
+    # HF pipeline with the specified model and generation parameters.
+    pipeline = HuggingFacePipeline.from_model_id(
+        model_id=MODEL_ID,
+        task="text-generation",
+        model_kwargs={"quantization_config": bnb_config, "device_map": "auto"},
+        pipeline_kwargs=GENERATION_KWARGS,
+        batch_size=BATCH_SIZE,
+    )
+
+    # Decoder-only models must be left-padded so every sequence in a batch ends at the same position.
+    tokenizer = pipeline.pipeline.tokenizer
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    return pipeline
+
+def get_pipeline():
+    return _lazy("pipeline", _build_pipeline)
+
+def get_tokenizer():
+    return get_pipeline().pipeline.tokenizer
+
+# ----------------------------
+# Early stop once the JSON object is closed
+# ----------------------------
+class JsonObjectStoppingCriteria(StoppingCriteria):
+    """
+    Stop each sequence as soon as the first top-level JSON object it generates is balanced.
+    Brace depth and string/escape state are tracked incrementally over the newly generated
+    tokens only, so braces inside string values never end generation early.
+    The criterion resets itself whenever a new generate() call starts, so one instance can
+    stay bound to the pipeline for the whole run.
+    """
+
+    def __init__(self, tokenizer, max_new_tokens: int):
+        self.tokenizer = tokenizer
+        self.max_new_tokens = max_new_tokens
+        self.pieces = {}
+        self.stats = []
+        self.last_len = None
+        self.last_tokens = None
+
+    def _piece(self, token_id: int) -> str:
+        if token_id not in self.pieces:
+            self.pieces[token_id] = self.tokenizer.decode([token_id])
+        return self.pieces[token_id]
+
+    def _is_continuation(self, input_ids) -> bool:
+        if self.last_len is None or input_ids.shape[-1] != self.last_len + 1:
+            return False
+        if self.last_tokens.shape[0] != input_ids.shape[0]:
+            return False
+        return bool(torch.equal(input_ids[:, -2], self.last_tokens))
+
+    def _reset(self, input_ids):
+        self._flush()
+        self.prompt_len = input_ids.shape[-1] - 1
+        # Per sequence: [brace depth, inside string, after backslash, object started]
+        self.states = [[0, False, False, False] for _ in range(input_ids.shape[0])]
+        self.closed_at = [None] * input_ids.shape[0]
+
+    def _flush(self):
+        if self.last_len is None:
+            return
+        generated = self.last_len - self.prompt_len
+        for closed_at in self.closed_at:
+            used = closed_at if closed_at is not None else generated
+            self.stats.append({"generated_tokens": used, "closed": closed_at is not None})
+        self.last_len = None
+
+    def pop_stats(self, max_new_tokens: int = None):
+        """
+        Per-sequence token counts for every generation since the last call, in batch order.
+        tokens_saved is measured against `max_new_tokens`, the budget those generations ran with
+        (default: the one the criterion was built with).
+        """
+        self._flush()
+        stats, self.stats = self.stats, []
+        budget = max_new_tokens or self.max_new_tokens
+        return [
+            {**stat, "tokens_saved": max(budget - stat["generated_tokens"], 0) if stat["closed"] else 0}
+            for stat in stats
+        ]
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if not self._is_continuation(input_ids):
+            self._reset(input_ids)
+        self.last_len = input_ids.shape[-1]
+        self.last_tokens = input_ids[:, -1].clone()
+        generated = self.last_len - self.prompt_len
+
+        for i, token_id in enumerate(input_ids[:, -1].tolist()):
+            if self.closed_at[i] is not None:
+                continue
+            state = self.states[i]
+            for ch in self._piece(token_id):
+                if state[1]:
+                    if state[2]:
+                        state[2] = False
+                    elif ch == "\\":
+                        state[2] = True
+                    elif ch == '"':
+                        state[1] = False
+                elif ch == '"' and state[3]:
+                    state[1] = True
+                elif ch == "{":
+                    state[0] += 1
+                    state[3] = True
+                elif ch == "}" and state[3]:
+                    state[0] -= 1
+                    if state[0] == 0:
+                        self.closed_at[i] = generated
+                        break
+
+        return torch.tensor([c is not None for c in self.closed_at], dtype=torch.bool, device=input_ids.device)
+
+def get_json_stop() -> JsonObjectStoppingCriteria:
+    return _lazy("json_stop", lambda: JsonObjectStoppingCriteria(get_tokenizer(), GENERATION_KWARGS["max_new_tokens"]))
+
+def _build_generate_extras() -> dict:
+    # Extra generate() arguments attached to every call: JSON early stop, and optionally schema-constrained decoding.
+    extras = {"stopping_criteria": StoppingCriteriaList([get_json_stop()])}
+    if CONSTRAINED_DECODING:
+        from json_constraint import json_logits_processor
+        extras["logits_processor"] = LogitsProcessorList([json_logits_processor(get_tokenizer())])
+    return extras
+
+def generate_extras() -> dict:
+    return _lazy("generate_extras", _build_generate_extras)
+
+# Pipeline with the extras attached to every generate call.
+def get_llm():
+    return _lazy("llm", lambda: get_pipeline().bind(pipeline_kwargs=generate_extras()))
 
 # Extract only the final JSON after the last "Assistant:" token occurrence.
 def AssistantReponseExtractor(text: str) -> str:
-    return text.split("Assistant:")[6].strip()
+    return extract_assistant_response(text)
 
 # Two parallel branches: raw text and post-processed JSON-only branch.
 parallel_chain = RunnableParallel(
@@ -40,4 +186,358 @@ def combine_both(results):
     return [results["without_parser"], results["with_parser"]]
 
 # Final chain: prompt -> model -> parallel split -> combine.
-chain = prompt | pipeline | parallel_chain | RunnableLambda(combine_both)
+def get_chain():
+    return _lazy("chain", lambda: prompt | get_llm() | parallel_chain | RunnableLambda(combine_both))
+
+# Pipeline whose `batch` calls of up to `batch_size` prompts each run as a single padded generate call
+# (optionally with a smaller max_new_tokens than GENERATION_KWARGS).
+def batched_llm(batch_size: int = BATCH_SIZE, max_new_tokens: int = None):
+    llm = get_pipeline().model_copy(update={"batch_size": batch_size})
+    extras = {"batch_size": batch_size, **generate_extras()}
+    if max_new_tokens is not None:
+        extras["max_new_tokens"] = max_new_tokens
+    return llm.bind(pipeline_kwargs=extras)
+
+# Same chain, but every `chain.batch` call of up to `batch_size` notes runs as a single padded generate call.
+def batched_chain(batch_size: int = BATCH_SIZE):
+    return prompt | batched_llm(batch_size) | parallel_chain | RunnableLambda(combine_both)
+
+# Tighter settings for re-generating rows whose output could not be repaired: greedy decoding and,
+# if REGENERATE_CONSTRAINED is set, the JsonOutput schema automaton (valid JSON by construction).
+def strict_llm(batch_size: int = BATCH_SIZE):
+    extras = {**generate_extras(), "do_sample": False}
+    if REGENERATE_CONSTRAINED and "logits_processor" not in extras:
+        from json_constraint import json_logits_processor
+        extras["logits_processor"] = LogitsProcessorList([json_logits_processor(get_tokenizer())])
+    llm = get_pipeline().model_copy(update={"batch_size": batch_size})
+    return llm.bind(pipeline_kwargs={"batch_size": batch_size, **extras})
+
+def strict_chain(batch_size: int = BATCH_SIZE):
+    return prompt | strict_llm(batch_size) | parallel_chain | RunnableLambda(combine_both)
+
+# ----------------------------
+# Static prompt prefix KV-cache
+# ----------------------------
+
+# Placeholder rendered in place of {Note} to find where the static prefix ends.
+NOTE_SENTINEL = "\x00NOTE\x00"
+
+def split_prompt(format_instructions: str, examples_text: str):
+    """
+    Render the prompt around a sentinel note and return (static_prefix, suffix).
+    Everything before the note (system rules, format instructions, examples) is static.
+    """
+    text = prompt.invoke(
+        {
+            "Note": NOTE_SENTINEL,
+            "format_instructions": format_instructions,
+            "EXAMPLES_TEXT": examples_text,
+        }
+    ).to_string()
+    prefix, suffix = text.split(NOTE_SENTINEL)
+    return prefix, suffix
+
+class PrefixCache:
+    """
+    Prefill the static prompt prefix once and reuse its attention cache for every note,
+    so only the note tokens (and the short suffix) are prefilled per call.
+    The cache is rebuilt whenever the rendered prefix changes (new examples or schema).
+    Notes are generated one at a time: a shared prefix cannot be left-padded into a batch.
+    """
+
+    def __init__(self, model, tokenizer, generation_kwargs=GENERATION_KWARGS):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.generation_kwargs = dict(generation_kwargs)
+        self.key = None
+        self.prefix_text = None
+        self.suffix_text = None
+        self.prefix_ids = None
+        self.cache = None
+        self.rebuilds = 0
+
+    def _prefix_for(self, format_instructions: str, examples_text: str):
+        # Hash the static inputs so the prefix is only re-rendered when they change.
+        key = hashlib.sha256((format_instructions + "\x00" + examples_text).encode("utf-8")).hexdigest()
+        if key != self.key:
+            prefix_text, suffix_text = split_prompt(format_instructions, examples_text)
+            if prefix_text != self.prefix_text:
+                self._build(prefix_text)
+            self.key = key
+            self.suffix_text = suffix_text
+        return self.prefix_text, self.suffix_text
+
+    def _build(self, prefix_text: str):
+        prefix_ids = self.tokenizer(prefix_text, return_tensors="pt").input_ids.to(self.model.device)
+        cache = DynamicCache()
+        with torch.no_grad():
+            self.model(input_ids=prefix_ids, past_key_values=cache, use_cache=True)
+        self.prefix_text = prefix_text
+        self.prefix_ids = prefix_ids
+        self.cache = cache
+        self.rebuilds += 1
+
+    def invoke(self, inputs: dict) -> str:
+        """
+        Same contract as `prompt | pipeline`: prompt variables in, full text (prompt + generation) out.
+        """
+        prefix_text, suffix_text = self._prefix_for(inputs["format_instructions"], inputs["EXAMPLES_TEXT"])
+        tail_text = inputs["Note"] + suffix_text
+        tail_ids = self.tokenizer(tail_text, add_special_tokens=False, return_tensors="pt").input_ids
+        input_ids = torch.cat([self.prefix_ids, tail_ids.to(self.model.device)], dim=-1)
+
+        prefix_len = self.prefix_ids.shape[-1]
+        try:
+            with torch.no_grad():
+                output = self.model.generate(
+                    input_ids=input_ids,
+                    attention_mask=torch.ones_like(input_ids),
+                    past_key_values=self.cache,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    **self.generation_kwargs,
+                )
+        finally:
+            # generate() extends the cache in place; trim it back to the static prefix.
+            self.cache.crop(prefix_len)
+
+        generated = self.tokenizer.decode(output[0, input_ids.shape[-1]:], skip_special_tokens=True)
+        return prefix_text + tail_text + generated
+
+def get_prefix_cache() -> PrefixCache:
+    return _lazy(
+        "prefix_cache",
+        lambda: PrefixCache(get_pipeline().pipeline.model, get_tokenizer(), {**GENERATION_KWARGS, **generate_extras()}),
+    )
+
+# Chain with the same [full_response, json_only] output, generating through the prefix cache.
+def get_cached_chain():
+    return _lazy(
+        "cached_chain",
+        lambda: RunnableLambda(get_prefix_cache().invoke) | parallel_chain | RunnableLambda(combine_both),
+    )
+
+# ----------------------------
+# Prompt-lookup speculative decoding
+# ----------------------------
+def schema_snippets():
+    """
+    Fixed JSON fragments the answer is built from: keys, value openers, units and vocabulary labels.
+    """
+    vital_model = JsonOutput.model_fields["vital_signs"].annotation
+    snippets = ['{"patient_info": {"age": ', ', "gender": "', '"}, "visit_motivation": "', '", "symptoms": [',
+                '], "vital_signs": {', '}}}', '"}']
+    for key, field in vital_model.model_fields.items():
+        inner = field.annotation.__args__[0]
+        if "systolic" in inner.model_fields:
+            for part in ("systolic", "diastolic"):
+                unit = inner.model_fields[part].annotation.model_fields["unit"].default
+                snippets.append(f'"{key}": {{"{part}": {{"value": ' if part == "systolic" else f'"{part}": {{"value": ')
+                snippets.append(f', "unit": "{unit}"}}')
+        else:
+            snippets.append(f'"{key}": {{"value": ')
+            snippets.append(f', "unit": "{inner.model_fields["unit"].default}"}}')
+    snippets += [f'"{label}"' for label in sorted(symptoms)] + [f'"{label}"' for label in sorted(visit_motivation)]
+    return snippets
+
+class PromptLookupDecoder:
+    """
+    Greedy decoding with drafts taken from n-gram lookup instead of a draft model: the last
+    1..max_ngram generated tokens are looked up in the prompt (which holds the note), in the schema
+    snippets and in the text generated so far, and the tokens that followed the most recent match
+    are proposed. One forward pass scores the whole draft; tokens are accepted while they equal the
+    model's own argmax, and the first mismatch is replaced by that argmax. The output is token-for-token
+    identical to plain greedy decoding (no repetition penalty or sampling).
+    """
+
+    def __init__(self, model, tokenizer, max_new_tokens: int = 1000, max_ngram: int = SPECULATIVE_MAX_NGRAM,
+                 num_draft: int = SPECULATIVE_DRAFT_TOKENS, stopping_criteria=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_new_tokens = max_new_tokens
+        self.max_ngram = max_ngram
+        self.num_draft = num_draft
+        self.stopping_criteria = stopping_criteria
+        self.snippet_ids = []
+        for snippet in schema_snippets():
+            self.snippet_ids += tokenizer(snippet, add_special_tokens=False).input_ids + [-1]
+        self.stats = {"calls": 0, "generated": 0, "drafted": 0, "accepted": 0, "forwards": 0}
+
+    def _index(self, source, index, start: int):
+        """
+        Map each n-gram ending at [start, len(source) - 1) to the position right after it (latest wins).
+        The n-gram ending at the very end is left out: it has no continuation yet and would shadow earlier
+        matches. -1 separates snippets, so no n-gram spans two of them.
+        """
+        for end in range(max(start, 1), len(source)):
+            for n in range(1, self.max_ngram + 1):
+                if end - n >= 0 and -1 not in source[end - n:end]:
+                    index[tuple(source[end - n:end])] = end
+        return max(start, len(source) - 1)
+
+    def _draft(self, source, index):
+        for n in range(self.max_ngram, 0, -1):
+            end = index.get(tuple(source[-n:]))
+            if end is not None:
+                draft = source[end:end + self.num_draft]
+                return draft[:draft.index(-1)] if -1 in draft else draft
+        return []
+
+    def _accept(self, source, tokens, eos_ids, budget: int) -> bool:
+        """
+        Append `tokens` to `source` one at a time, checking EOS, the stopping criteria and the token
+        budget after each exactly as generate() would; True once generation must stop.
+        """
+        tokens = tokens[:budget]
+        ids = None
+        if self.stopping_criteria is not None:
+            ids = torch.tensor([source[len(self.snippet_ids):] + tokens], device=self.model.device)
+            offset = ids.shape[-1] - len(tokens)
+        for i, token in enumerate(tokens):
+            source.append(token)
+            if token in eos_ids or (ids is not None and bool(self.stopping_criteria(ids[:, :offset + i + 1], None).all())):
+                return True
+        return len(tokens) == budget
+    @torch.no_grad()
+    def generate(self, input_ids):
+        """
+        Token ids generated after `input_ids` (1 x prompt_len), stopping at EOS, the stopping
+        criteria or max_new_tokens, exactly as greedy decoding would.
+        """
+        eos = self.model.generation_config.eos_token_id
+        eos_ids = set(eos if isinstance(eos, list) else [eos] if eos is not None else [])
+        prompt_len = input_ids.shape[-1]
+        # Lookup source: schema snippets, then the prompt and everything generated so far.
+        source = self.snippet_ids + input_ids[0].tolist()
+        index = {}
+        indexed = self._index(source, index, 0)
+
+        cache = DynamicCache()
+        logits = self.model(input_ids=input_ids, past_key_values=cache, use_cache=True).logits
+        self.stats["forwards"] += 1
+        done = self._accept(source, [int(logits[0, -1].argmax())], eos_ids, self.max_new_tokens)
+        generated = 1
+        while not done:
+            indexed = self._index(source, index, indexed)
+            draft = self._draft(source, index)[:self.max_new_tokens - generated - 1]
+            step_ids = torch.tensor([[source[-1]] + draft], device=self.model.device)
+            predicted = self.model(input_ids=step_ids, past_key_values=cache, use_cache=True).logits[0].argmax(-1).tolist()
+            self.stats["forwards"] += 1
+            self.stats["drafted"] += len(draft)
+
+            accepted = 0
+            while accepted < len(draft) and draft[accepted] == predicted[accepted]:
+                accepted += 1
+            self.stats["accepted"] += accepted
+            # Drop the cache entries of rejected draft tokens.
+            if accepted < len(draft):
+                cache.crop(accepted - len(draft))
+            before = len(source)
+            done = self._accept(source, draft[:accepted] + [predicted[accepted]], eos_ids, self.max_new_tokens - generated)
+            generated += len(source) - before
+        self.stats["calls"] += 1
+        self.stats["generated"] += generated
+        return source[len(self.snippet_ids) + prompt_len:]
+
+    def report(self) -> dict:
+        stats = dict(self.stats)
+        stats["acceptance_rate"] = stats["accepted"] / stats["drafted"] if stats["drafted"] else 0.0
+        stats["tokens_per_forward"] = stats["generated"] / stats["forwards"] if stats["forwards"] else 0.0
+        return stats
+
+    def invoke(self, inputs: dict) -> str:
+        """
+        Same contract as `prompt | pipeline`: prompt variables in, full text (prompt + generation) out.
+        """
+        prompt_text = prompt.invoke(inputs).to_string()
+        input_ids = self.tokenizer(prompt_text, return_tensors="pt").input_ids.to(self.model.device)
+        generated = self.generate(input_ids)
+        return prompt_text + self.tokenizer.decode(generated, skip_special_tokens=True)
+
+def compare_with_greedy(decoder: PromptLookupDecoder, prompts) -> dict:
+    """
+    Run each prompt through plain greedy generate() and through the decoder; report whether every
+    output is identical, the draft acceptance rate and the wall-clock speedup.
+    """
+    import time
+
+    model, tokenizer = decoder.model, decoder.tokenizer
+    greedy_sec = speculative_sec = 0.0
+    identical = True
+    for text in prompts:
+        input_ids = tokenizer(text, return_tensors="pt").input_ids.to(model.device)
+        criteria = decoder.stopping_criteria
+        start = time.perf_counter()
+        with torch.no_grad():
+            reference = model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                do_sample=False,
+                temperature=None,
+                top_p=None,
+                top_k=None,
+                repetition_penalty=1.0,
+                max_new_tokens=decoder.max_new_tokens,
+                stopping_criteria=criteria,
+                pad_token_id=tokenizer.pad_token_id,
+            )[0, input_ids.shape[-1]:].tolist()
+        greedy_sec += time.perf_counter() - start
+        start = time.perf_counter()
+        output = decoder.generate(input_ids)
+        speculative_sec += time.perf_counter() - start
+        identical &= output == reference
+    return {
+        "identical": identical,
+        "greedy_sec": greedy_sec,
+        "speculative_sec": speculative_sec,
+        "speedup": greedy_sec / speculative_sec if speculative_sec else 0.0,
+        **decoder.report(),
+    }
+
+def get_speculative_decoder() -> PromptLookupDecoder:
+    return _lazy(
+        "speculative_decoder",
+        lambda: PromptLookupDecoder(
+            get_pipeline().pipeline.model,
+            get_tokenizer(),
+            GENERATION_KWARGS["max_new_tokens"],
+            stopping_criteria=StoppingCriteriaList([get_json_stop()]),
+        ),
+    )
+
+# Row-by-row chain with the same [full_response, json_only] output, generating speculatively.
+def get_speculative_chain():
+    return _lazy(
+        "speculative_chain",
+        lambda: RunnableLambda(get_speculative_decoder().invoke) | parallel_chain | RunnableLambda(combine_both),
+    )
+
+# ----------------------------
+# Warm-up and lazy module attributes
+# ----------------------------
+def warm_up():
+    """
+    Load the model and run one tiny generation so weight loading and kernel setup
+    happen before the first real note instead of during it.
+    """
+    pipeline = get_pipeline()
+    get_chain()
+    pipeline.pipeline("Warm-up", max_new_tokens=1)
+    return pipeline
+
+# Old module attributes (model_chain.chain, model_chain.tokenizer, ...) still work, built on first access.
+_LAZY_ATTRIBUTES = {
+    "pipeline": get_pipeline,
+    "tokenizer": get_tokenizer,
+    "json_stop": get_json_stop,
+    "GENERATE_EXTRAS": generate_extras,
+    "llm": get_llm,
+    "chain": get_chain,
+    "prefix_cache": get_prefix_cache,
+    "cached_chain": get_cached_chain,
+    "speculative_chain": get_speculative_chain,
+}
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
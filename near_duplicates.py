@@ -0,0 +1,121 @@
+# near_duplicates.py
+# Near-duplicate notes: MinHash/LSH over the extraction-relevant sections (patient information, complaint,
+# symptoms, vital signs) finds candidates, and exact equality of those sections decides which notes can
+# share one model extraction.
+
+import argparse
+import hashlib
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+from config import TEST_CSV, CHUNK_SIZE, MINHASH_PERMUTATIONS, LSH_BANDS
+from rule_extractor import UNIT_MENTION, split_sections
+
+# Section names (substrings) whose content determines the extraction; everything else is free prose.
+RELEVANT_SECTIONS = ("patient", "demographic", "complaint", "visit", "reason", "motivation", "symptom",
+                     "present illness", "vital")
+PRIME = (1 << 31) - 1
+WORD = re.compile(r"[a-z0-9]+(?:[./][a-z0-9]+)*|%|°")
+
+def relevant_text(note: str) -> str:
+    """
+    Normalized extraction-relevant content of a note: relevant sections in note order (lower-cased,
+    punctuation and markup dropped), plus every unit-bearing measurement anywhere in the note,
+    so a vital sign mentioned only in the prose still tells two notes apart. "" if no section is relevant.
+    """
+    parts = []
+    for name, lines in split_sections(note).items():
+        if name and any(key in name for key in RELEVANT_SECTIONS):
+            parts.append(name + ": " + " ".join(WORD.findall(" ".join(lines).lower())))
+    if not parts:
+        return ""
+    measurements = sorted(" ".join(m.lower().split()) for m in UNIT_MENTION.findall(note))
+    return "\n".join(parts + ["measurements: " + "; ".join(measurements)])
+
+class DuplicateIndex:
+    """
+    Notes are added in run order. A note whose relevant text exactly equals that of an earlier LSH candidate
+    is recorded as a follower of that note's representative; the rest are representatives themselves.
+    """
+
+    def __init__(self, num_perm: int = MINHASH_PERMUTATIONS, bands: int = LSH_BANDS, seed: int = 0):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, PRIME, size=num_perm, dtype=np.int64)
+        self.b = rng.integers(0, PRIME, size=num_perm, dtype=np.int64)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.buckets = defaultdict(list)
+        self.digests = {}
+        self.representative = {}
+        self.followers = defaultdict(int)
+        self.stats = {"notes": 0, "without_sections": 0, "duplicates": 0, "rejected_candidates": 0}
+
+    def signature(self, text: str) -> np.ndarray:
+        words = text.split()
+        shingles = {" ".join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))}
+        hashes = np.array([zlib.crc32(s.encode("utf-8")) & PRIME for s in shingles], dtype=np.int64)
+        return ((np.outer(self.a, hashes) + self.b[:, None]) % PRIME).min(axis=1)
+
+    def add(self, key: str, note: str):
+        """
+        Index one note; returns its representative's key if it is a verified duplicate, else None.
+        """
+        self.stats["notes"] += 1
+        text = relevant_text(note) if isinstance(note, str) else ""
+        if not text:
+            self.stats["without_sections"] += 1
+            return None
+        digest = hashlib.sha1(text.encode("utf-8")).digest()
+        signature = self.signature(text)
+        band_keys = [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+        candidates = []
+        for band_key in band_keys:
+            candidates += [c for c in self.buckets[band_key] if c not in candidates]
+        match = None
+        for candidate in candidates:
+            # Exact verification: LSH only proposes, identical relevant sections decide.
+            if self.digests[candidate] == digest:
+                match = self.representative.get(candidate, candidate)
+                break
+            self.stats["rejected_candidates"] += 1
+        if match is not None:
+            self.representative[key] = match
+            self.followers[match] += 1
+            self.stats["duplicates"] += 1
+            return match
+        self.digests[key] = digest
+        for band_key in band_keys:
+            self.buckets[band_key].append(key)
+        return None
+
+    def representative_of(self, key: str):
+        return self.representative.get(key)
+
+    def has_followers(self, key: str) -> bool:
+        return key in self.followers
+
+    def report(self) -> dict:
+        return {**self.stats, "groups_with_duplicates": len(self.followers)}
+
+def build_index(test_csv: str = TEST_CSV, chunksize: int = CHUNK_SIZE) -> DuplicateIndex:
+    """
+    Index every note of `test_csv` in file order (read in chunks).
+    """
+    import pandas as pd
+
+    index = DuplicateIndex()
+    for chunk in pd.read_csv(test_csv, usecols=["ID", "Note"], chunksize=chunksize):
+        for record_id, note in zip(chunk["ID"].astype(str), chunk["Note"]):
+            index.add(record_id, note)
+    return index
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Count near-duplicate notes that could share one extraction.")
+    arg_parser.add_argument("--csv", default=TEST_CSV)
+    args = arg_parser.parse_args()
+    print(build_index(args.csv).report())
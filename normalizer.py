@@ -0,0 +1,326 @@
+# normalizer.py
+# Maps free-form symptom / visit-motivation labels from the model onto the canonical training vocabulary:
+# exact and alias lookups first, then a token-bag index, then trigram-indexed edit-distance similarity.
+
+import json
+import re
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+# ----------------------------
+# Hand-written aliases (exact variants seen in model outputs)
+# ----------------------------
+sym_mapping = {
+    'abdominal_pain': 'abdominal_pain',
+    'anxiety': 'anxiety',
+    'blurred_vision': 'blurred_vision',
+    #'body_aches': 'joint_pain',  # Mapping general aches to the closest pain category     ----------
+    'chest_pain': 'chest_pain',
+    #'chills': 'fever',  # Chills are a common symptom accompanying fever      ------------------
+    'chronic_cough': 'cough',  # Specific type of cough
+    'congestion': 'runny_nose',  # Nasal congestion is closely related
+    'cough': 'cough',
+    #'decreased_appetite': 'nausea',  # Related GI symptom                      ---------------
+    'diarrhea': 'diarrhea',
+    'difficulty_breathing': 'difficulty_breathing',
+    'difficulty_concentrating': 'difficulty_concentrating',
+    'difficulty_swallowing': 'sore_throat',  # Often caused by a sore throat
+    'dizziness': 'dizziness',
+    'dry_skin': 'dry_skin',
+    'ear_pain': 'ear_pain',
+    'eczema': 'rash',  # Eczema is a specific type of rash
+    'facial_pain': 'facial_pain',
+    'fatigue': 'fatigue',
+    'fever': 'fever',
+    'frequent_urination': 'frequent_urination',
+    'headache': 'headache',
+    'headaches': 'headache',  # Plural
+    'heartburn': 'heartburn',
+    'increased_thirst': 'increased_thirst',
+    'increased_urination': 'frequent_urination',  # Closely related urinary symptom
+    'itching': 'rash',  # Itching is the primary symptom of many rashes
+    'itchy_eyes': 'itchy_eyes',
+    'itchy_skin': 'rash',  # Symptom associated with rash or dry skin
+    'joint_pain': 'joint_pain',
+    #'loss_of_appetite': 'nausea',  # Related GI symptom
+    #'loss_of_interest_in_activities': 'sadness',  # A key component of sadness/depression
+    'loss_of_taste_smell': 'loss_of_taste_smell',
+    'lower_abdominal_pain': 'abdominal_pain',  # Specific type of abdominal pain
+    'nasal_congestion': 'runny_nose',  # Both are symptoms of rhinitis
+    'nausea': 'nausea',
+    'night_sweats': 'night_sweats',
+    #'pain': 'joint_pain',  # Mapping general pain to the closest available pain category      ---------------
+    'painful_urination': 'painful_urination',
+    'pale_skin': 'pale_skin',
+    'paleness': 'pale_skin',  # Synonym
+    #'palpitations': 'anxiety',  # Palpitations are a common physical symptom of anxiety        ----------------
+    'persistent_cough': 'cough',  # Specific type of cough
+    'rash': 'rash',
+    'regurgitation': 'heartburn',  # Both are key symptoms of GERD
+    'restlessness': 'restlessness',
+    'runny_nose': 'runny_nose',
+    'sadness': 'sadness',
+    'shortness_of_breath': 'difficulty_breathing',  # Synonym
+    'sneezing': 'sneezing',
+    'sore_throat': 'sore_throat',
+    'swollen_lymph_nodes': 'swollen_lymph_nodes',
+    'throat_pain': 'sore_throat',  # Synonym
+    'vomiting': 'vomiting',
+    #'weakness': 'fatigue',  # Closely related symptoms           -----------------
+    'weight_loss': 'weight_loss',
+    'wheezing': 'wheezing'
+}
+
+vm_mapping = {
+    'Acute Coronary Syndrome': 'Heart Disease (Coronary Artery Disease)',
+    'Allergies': 'Allergies',
+    'Anemia': 'Anemia',
+    'Anxiety': 'Anxiety Disorders',
+    'Anxiety Disorders': 'Anxiety Disorders',
+    'Asthma': 'Asthma',
+    'Asthma (Exacerbation)': 'Asthma',
+    'COVID-19': 'COVID-19',
+    'Chronic Obstructive Pulmonary Disease (COPD)': 'Chronic Obstructive Pulmonary Disease (COPD)',
+    'Common Cold': 'Common Cold',
+    'Community-Acquired Pneumonia (CAP)': 'Pneumonia',
+    'Coronary Artery Disease': 'Heart Disease (Coronary Artery Disease)',
+    'Coronary Artery Disease (CAD)': 'Heart Disease (Coronary Artery Disease)',
+    'Depression': 'Depression',
+    'Diabetes (Type 2)': 'Diabetes (Type 2)',
+    'Ear Infection (Otitis Media)': 'Ear Infection (Otitis Media)',
+    'Eczema (Atopic Dermatitis)': 'Eczema (Atopic Dermatitis)',
+    'Exacerbation of Asthma': 'Asthma',
+    'Gastroesophageal Reflux Disease (GERD)': 'Gastroesophageal Reflux Disease (GERD)',
+    'Heart Disease (Coronary Artery Disease)': 'Heart Disease (Coronary Artery Disease)',
+    'Hypertension': 'Hypertension (High Blood Pressure)',
+    'Hypertension (High Blood Pressure)': 'Hypertension (High Blood Pressure)',
+    'Influenza': 'Influenza (Flu)',
+    'Influenza (Flu)': 'Influenza (Flu)',
+    'Major Depressive Disorder (MDD)': 'Depression',
+    'Pneumonia': 'Pneumonia',
+    'Sinusitis': 'Sinusitis',
+    'Strep Throat': 'Strep Throat',
+    'Tuberculosis (TB)': 'Tuberculosis (TB)',
+    'Urinary Tract Infection': 'Urinary Tract Infection (UTI)',
+    'Urinary Tract Infection (UTI)': 'Urinary Tract Infection (UTI)'
+}
+
+# ----------------------------
+# Text normalization
+# ----------------------------
+STOPWORDS = {"of", "the", "and", "with", "a", "an", "in", "due", "to"}
+
+def normalize_text(text: str) -> str:
+    """
+    Lower-case, treat "_", "-" and "/" as spaces, drop other punctuation and collapse whitespace.
+    """
+    text = re.sub(r"[_\-/]", " ", text.lower())
+    text = re.sub(r"[^a-z0-9() ]", "", text)
+    return " ".join(text.split())
+
+def variants(text: str):
+    """
+    Normalized label, the label without its parenthetical, and the parenthetical alone
+    ("Hypertension (HTN)" -> "hypertension htn", "hypertension", "htn").
+    """
+    norm = normalize_text(text)
+    out = [norm.replace("(", "").replace(")", "")]
+    bare = re.sub(r"\s*\(.*?\)", "", norm).strip()
+    out.append(bare)
+    out.extend(p.strip() for p in re.findall(r"\((.*?)\)", norm))
+    return [" ".join(v.split()) for v in dict.fromkeys(out) if v.strip()]
+
+def _stem(token: str) -> str:
+    return token[:-1] if len(token) > 3 and token.endswith("s") and not token.endswith("ss") else token
+
+def token_bag(text: str) -> tuple:
+    return tuple(sorted({_stem(t) for t in text.split() if t not in STOPWORDS}))
+
+def parentheticals(text: str) -> tuple:
+    return tuple(" ".join(p.split()) for p in re.findall(r"\((.*?)\)", normalize_text(text)) if p.strip())
+
+# Words that tell related conditions apart ("type 1" / "type 2", "decreased" / "frequent urination");
+# any number counts too. Prefixes and suffixes do the same inside a word ("hypotension" / "hypertension",
+# "pneumonitis" / "pneumonia").
+QUALIFIERS = {"type", "acute", "chronic", "increased", "decreased", "frequent", "reduced", "excessive", "elevated",
+              "loss", "gain", "left", "right", "upper", "lower", "partial", "total"}
+QUALIFIER_PREFIXES = ("hypo", "hyper", "brady", "tachy")
+CONDITION_SUFFIXES = ("algia", "pathy", "itis", "osis", "emia", "oma", "ia")
+
+def _affix(token: str, affixes, at_start: bool):
+    # First matching affix; CONDITION_SUFFIXES lists longer suffixes first ("anaemia" ends in "emia", not "ia").
+    return next((a for a in affixes if (token.startswith(a) if at_start else token.endswith(a))), None)
+
+def conflicting(a: str, b: str) -> bool:
+    """
+    Whether normalized forms `a` and `b` name different conditions although their text is close: the words
+    that differ hold a qualifier or number on both sides, or carry different prefixes or suffixes.
+    A qualifier on one side only ("diabetes" / "diabetes type 2") is a more specific name, not a conflict.
+    """
+    # Compared by stem, affixes read off the words as written ("pneumonitis" stems to "pneumoniti").
+    words_a = {_stem(t): t for t in a.split() if t not in STOPWORDS}
+    words_b = {_stem(t): t for t in b.split() if t not in STOPWORDS}
+    only_a = {words_a[t] for t in words_a.keys() - words_b.keys()}
+    only_b = {words_b[t] for t in words_b.keys() - words_a.keys()}
+
+    def qualified(tokens):
+        return any(t in QUALIFIERS or any(c.isdigit() for c in t) for t in tokens)
+
+    if qualified(only_a) and qualified(only_b):
+        return True
+    for affixes, at_start in ((QUALIFIER_PREFIXES, True), (CONDITION_SUFFIXES, False)):
+        found_a = {_affix(t, affixes, at_start) for t in only_a} - {None}
+        found_b = {_affix(t, affixes, at_start) for t in only_b} - {None}
+        if found_a and found_b and found_a != found_b:
+            return True
+    return False
+
+def trigrams(text: str) -> set:
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# ----------------------------
+# Normalizer
+# ----------------------------
+class LabelNormalizer:
+    """
+    Index of canonical labels (plus aliases) built once; `normalize` returns (label, score) with
+    score 1.0 for exact/alias hits, 0.95 for a hit on a label variant, 0.9 for the same bag of
+    tokens, and the best of trigram Dice and edit-distance ratio for fuzzy matches. Variant and fuzzy
+    candidates that name a different condition (see `conflicting`) are rejected, and fuzzy candidates
+    must have as many words as the value. Results are memoized per raw string.
+    """
+
+    def __init__(self, labels, aliases: dict = None, min_score: float = 0.8):
+        self.labels = set(labels)
+        self.min_score = min_score
+        self.exact, self.by_variant, self.by_tokens = {}, {}, {}
+        # Variant / token bag -> (full form, parentheticals) of the first label or alias text it came from.
+        self.variant_source, self.tokens_source = {}, {}
+        self.by_trigram = defaultdict(set)
+        self.trigram_sets = {}
+        sources = [(label, label) for label in sorted(self.labels)]
+        sources += sorted((aliases or {}).items())
+        for text, label in sources:
+            forms = variants(text)
+            if not forms:
+                continue
+            self.exact.setdefault(forms[0], label)
+            for form in forms:
+                self.variant_source.setdefault(form, (forms[0], parentheticals(text)))
+                # A variant shared by two different labels ("(Flu)" vs "Flu") is ambiguous: drop it.
+                if self.by_variant.get(form, label) != label:
+                    self.by_variant[form] = None
+                else:
+                    self.by_variant[form] = label
+                self.by_tokens.setdefault(token_bag(form), label)
+                self.tokens_source.setdefault(token_bag(form), (forms[0], parentheticals(text)))
+                grams = trigrams(form)
+                self.trigram_sets[form] = (grams, label)
+                for gram in grams:
+                    self.by_trigram[gram].add(form)
+        self.memo = {}
+        self.stats = Counter()
+
+    def _lookup(self, value: str):
+        forms = variants(value)
+        if not forms:
+            return None, 0.0
+        if forms[0] in self.exact:
+            return self.exact[forms[0]], 1.0
+        notes = parentheticals(value)
+
+        def compatible(form, source):
+            # "Diabetes (Type 1)" must not reach "Diabetes (Type 2)" through the bare "diabetes".
+            full, source_notes = source
+            if notes and source_notes and notes != source_notes and form not in notes:
+                return False
+            return not conflicting(forms[0], full)
+
+        for form in forms:
+            if self.by_variant.get(form) and compatible(form, self.variant_source[form]):
+                return self.by_variant[form], 0.95
+        for form in forms:
+            label = self.by_tokens.get(token_bag(form))
+            if label is not None and compatible(form, self.tokens_source[token_bag(form)]):
+                return label, 0.9
+        # Fuzzy: candidates share a character trigram; scored by trigram Dice or edit-distance ratio.
+        query = forms[0]
+        grams = trigrams(query)
+        candidates = set().union(*(self.by_trigram.get(g, ()) for g in grams))
+        best, best_score, tied = None, 0.0, False
+        words = len(token_bag(query))
+        for form in sorted(candidates):
+            if len(token_bag(form)) != words or conflicting(query, form):
+                continue
+            form_grams, label = self.trigram_sets[form]
+            dice = 2 * len(grams & form_grams) / (len(grams) + len(form_grams))
+            score = max(dice, SequenceMatcher(None, query, form).ratio())
+            if score > best_score:
+                best, best_score, tied = label, score, False
+            elif score == best_score and label != best:
+                tied = True
+        if best is None or tied or best_score < self.min_score:
+            return None, best_score
+        return best, best_score
+
+    def normalize(self, value):
+        """
+        (canonical label, confidence) for `value`, or (None, best score) when nothing is close enough.
+        """
+        if not isinstance(value, str):
+            return None, 0.0
+        if value not in self.memo:
+            self.memo[value] = self._lookup(value)
+        label, score = self.memo[value]
+        self.stats["exact" if score == 1.0 else "fuzzy" if label else "unmatched"] += 1
+        return label, score
+
+    def __call__(self, value):
+        """
+        Canonical label for `value`, or `value` unchanged when it cannot be matched.
+        """
+        label, _ = self.normalize(value)
+        return value if label is None else label
+
+# ----------------------------
+# Shared instances and inline use
+# ----------------------------
+_normalizers = {}
+
+def get_normalizers():
+    """
+    (symptom normalizer, visit-motivation normalizer) over the vocabularies schema_and_prompt
+    derives from train.csv; built once per process.
+    """
+    if not _normalizers:
+        from schema_and_prompt import symptoms, visit_motivation
+
+        _normalizers["symptoms"] = LabelNormalizer(symptoms, sym_mapping)
+        _normalizers["visit_motivation"] = LabelNormalizer(visit_motivation, vm_mapping)
+    return _normalizers["symptoms"], _normalizers["visit_motivation"]
+
+def normalize_labels(data: dict) -> dict:
+    """
+    Map symptoms (deduplicated, first occurrence wins) and visit_motivation of a parsed extraction in place.
+    A symptom list holding anything but strings is left as it is, as submission_builder.process_record does.
+    """
+    sym_normalizer, vm_normalizer = get_normalizers()
+    symptoms = data.get("symptoms")
+    if isinstance(symptoms, list) and all(isinstance(s, str) for s in symptoms):
+        data["symptoms"] = list(dict.fromkeys(sym_normalizer(s) for s in symptoms))
+    if isinstance(data.get("visit_motivation"), str):
+        data["visit_motivation"] = vm_normalizer(data["visit_motivation"])
+    return data
+
+def normalize_json(json_text: str) -> str:
+    """
+    normalize_labels on a JSON string; text that does not parse to an object is returned unchanged.
+    """
+    try:
+        data = json.loads(json_text)
+    except (json.JSONDecodeError, TypeError):
+        return json_text
+    if not isinstance(data, dict):
+        return json_text
+    return json.dumps(normalize_labels(data), ensure_ascii=False)
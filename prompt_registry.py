@@ -0,0 +1,102 @@
+# prompt_registry.py
+# Compact response log: each row keeps only the generated continuation plus the hash of its prompt template
+# (the rendered prompt around the note), and the templates are written once to a small registry file.
+
+import argparse
+import hashlib
+import json
+import os
+import re
+
+from config import PROMPT_REGISTRY, OUTPUT_LOG, TEST_CSV
+
+# Compact responses start with this marker; full responses start with the system prompt.
+COMPACT = re.compile(r"\[\[prompt:([0-9a-f]{16})\]\]")
+
+def prompt_hash(prefix: str, suffix: str) -> str:
+    return hashlib.sha256(json.dumps([prefix, suffix]).encode("utf-8")).hexdigest()[:16]
+
+def split_compact(text):
+    """
+    (prompt hash, continuation) of a compact response, or (None, text) for anything else.
+    """
+    match = COMPACT.match(text) if isinstance(text, str) else None
+    if match is None:
+        return None, text
+    return match.group(1), text[match.end():]
+
+class PromptRegistry:
+    """
+    Append-only JSONL of {"hash", "prefix", "suffix"}: the prompt text before and after the note.
+    Each template is written once, however many rows point to it.
+    """
+
+    def __init__(self, path: str = PROMPT_REGISTRY):
+        self.path = path
+        self.templates = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.templates[entry["hash"]] = (entry["prefix"], entry["suffix"])
+
+    def register(self, prefix: str, suffix: str) -> str:
+        key = prompt_hash(prefix, suffix)
+        if key not in self.templates:
+            self.templates[key] = (prefix, suffix)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"hash": key, "prefix": prefix, "suffix": suffix}, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        return key
+
+    def compact(self, full_response: str, note: str, prefix: str, suffix: str) -> str:
+        """
+        "[[prompt:<hash>]]<continuation>" when `full_response` is prompt + generation for this template,
+        otherwise `full_response` unchanged (e.g. the empty response of notes the rules resolved).
+        """
+        prompt_text = prefix + note + suffix
+        if not isinstance(full_response, str) or not full_response.startswith(prompt_text):
+            return full_response
+        return f"[[prompt:{self.register(prefix, suffix)}]]" + full_response[len(prompt_text):]
+
+    def expand(self, text: str, note: str) -> str:
+        """
+        Full prompt + generation text of a compact response (other text is returned as is).
+        """
+        key, continuation = split_compact(text)
+        if key is None:
+            return text
+        if key not in self.templates:
+            raise KeyError(f"prompt {key} is not in {self.path}")
+        prefix, suffix = self.templates[key]
+        return prefix + note + suffix + continuation
+
+def expand_log(log_path: str, output_path: str, test_csv: str, registry_path: str = PROMPT_REGISTRY):
+    """
+    Copy of a compact result log with every full_response rebuilt (notes are read from `test_csv` by ID).
+    """
+    import pandas as pd
+
+    registry = PromptRegistry(registry_path)
+    test = pd.read_csv(test_csv, usecols=["ID", "Note"])
+    notes = dict(zip(test["ID"].astype(str), test["Note"]))
+    with open(log_path, encoding="utf-8") as src, open(output_path, "w", encoding="utf-8") as dst:
+        for line in src:
+            record = json.loads(line)
+            note = notes.get(str(record["ID"]), "")
+            record["full_response"] = registry.expand(record.get("full_response"), note)
+            dst.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Rebuild full responses from a compact result log.")
+    arg_parser.add_argument("--log", default=OUTPUT_LOG)
+    arg_parser.add_argument("--output", required=True, help="Where to write the expanded JSONL log.")
+    arg_parser.add_argument("--registry", default=PROMPT_REGISTRY)
+    arg_parser.add_argument("--test-csv", default=TEST_CSV)
+    args = arg_parser.parse_args()
+    expand_log(args.log, args.output, args.test_csv, args.registry)
+    print(f"Saved {args.output}")
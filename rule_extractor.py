@@ -0,0 +1,245 @@
+# rule_extractor.py
+# Deterministic fast path: parse headed note sections ("Patient Information", "Vital Signs", ...)
+# and resolve fields without the model wherever a pattern matches with high confidence.
+
+import json
+import re
+
+from schema_and_prompt import JsonOutput, symptoms as SYMPTOMS, visit_motivation as VISIT_MOTIVATIONS
+
+FIELDS = ("patient_info", "visit_motivation", "symptoms", "vital_signs")
+
+# ----------------------------
+# Section splitting
+# ----------------------------
+HEADER = re.compile(r"^([A-Za-z][A-Za-z /&()-]{0,40}):\s*(.*)$")
+
+def split_sections(note: str) -> dict:
+    """
+    Map lower-cased section name -> content lines. A header is a bold "**Name:**" line
+    (optionally with inline content) or a bare "Name:" line with nothing after the colon.
+    """
+    sections = {"": []}
+    current = ""
+    for raw in note.splitlines():
+        line = raw.strip()
+        bold = "**" in line
+        stripped = line.lstrip("*#+- \t").replace("**", "").strip()
+        match = HEADER.match(stripped)
+        if match and (bold or not match.group(2)):
+            current = match.group(1).strip().lower()
+            sections.setdefault(current, [])
+            if match.group(2):
+                sections[current].append(match.group(2).strip())
+        elif line:
+            sections[current].append(stripped)
+    return sections
+
+def _find_section(sections: dict, *names):
+    for name, lines in sections.items():
+        if any(n in name for n in names):
+            return lines
+    return None
+
+# ----------------------------
+# Patient information
+# ----------------------------
+AGE_LINE = re.compile(r"^\W*age:\s*(\d{1,3})\b", re.IGNORECASE)
+GENDER_LINE = re.compile(r"^\W*(?:gender|sex):\s*(male|female)\b", re.IGNORECASE)
+PATIENT_LINE = re.compile(r"^\W*patient:\s*(\d{1,3})[- ]year[- ]old\s+(male|female)\b", re.IGNORECASE)
+
+def extract_patient_info(note: str, sections: dict):
+    ages, genders = set(), set()
+    for line in note.splitlines():
+        line = line.replace("*", "")
+        if m := AGE_LINE.match(line):
+            ages.add(int(m.group(1)))
+        if m := GENDER_LINE.match(line):
+            genders.add(m.group(1).capitalize())
+        if m := PATIENT_LINE.match(line):
+            ages.add(int(m.group(1)))
+            genders.add(m.group(2).capitalize())
+    # Only resolved when both are stated exactly once (or consistently).
+    if len(ages) == 1 and len(genders) == 1 and 0 < next(iter(ages)) <= 120:
+        return {"age": ages.pop(), "gender": genders.pop()}
+    return None
+
+# ----------------------------
+# Vital signs
+# ----------------------------
+NUMBER = r"(\d+(?:\.\d+)?)"
+VITAL_PATTERNS = {
+    "blood_pressure": (("blood pressure", "bp"), re.compile(r"(\d{2,3})\s*/\s*(\d{2,3})\s*mmhg", re.IGNORECASE)),
+    "cholesterol_level": (("cholesterol",), re.compile(NUMBER + r"\s*mg/dl", re.IGNORECASE)),
+    "glucose_level": (("glucose",), re.compile(NUMBER + r"\s*mg/dl", re.IGNORECASE)),
+    "heart_rate": (("heart rate", "pulse"), re.compile(NUMBER + r"\s*(?:bpm|beats per minute)", re.IGNORECASE)),
+    "oxygen_saturation": (("oxygen saturation", "spo2", "o2 sat"), re.compile(NUMBER + r"\s*%")),
+    "respiratory_rate": (("respiratory rate",), re.compile(NUMBER + r"\s*(?:breaths/min|breaths per minute)", re.IGNORECASE)),
+    "temperature": (("temperature", "temp"), re.compile(NUMBER + r"\s*°\s*c\b", re.IGNORECASE)),
+}
+# Every measurement with a vital-sign unit anywhere in the note.
+UNIT_MENTION = re.compile(
+    r"\d[\d./\s]*(?:mmhg|bpm|beats per minute|breaths/min|breaths per minute|°\s*[cf]\b|%|mg/dl)", re.IGNORECASE
+)
+
+def _number(text: str):
+    return float(text) if "." in text else int(text)
+
+def _default_unit(key: str, sub: str = None):
+    model = JsonOutput.model_fields["vital_signs"].annotation.model_fields[key].annotation.__args__[0]
+    if sub is not None:
+        model = model.model_fields[sub].annotation
+    return model.model_fields["unit"].default
+
+def extract_vital_signs(note: str, sections: dict):
+    """
+    Parse the "Vital Signs" block. Resolved only if every unit-bearing measurement in the
+    whole note was consumed by the block, so no vital mentioned in prose is missed.
+    """
+    lines = _find_section(sections, "vital")
+    if lines is None:
+        return None
+    vitals, consumed = {}, 0
+    for line in lines:
+        label, _, value = line.partition(":")
+        key = next((k for k, (names, _) in VITAL_PATTERNS.items() if any(n in label.lower() for n in names)), None)
+        match = VITAL_PATTERNS[key][1].search(value) if key else None
+        if match is None:
+            if vitals:
+                break  # End of the vitals block.
+            continue
+        if key in vitals:
+            return None  # Same vital listed twice: ambiguous.
+        if key == "blood_pressure":
+            vitals[key] = {
+                "systolic": {"value": int(match.group(1)), "unit": _default_unit(key, "systolic")},
+                "diastolic": {"value": int(match.group(2)), "unit": _default_unit(key, "diastolic")},
+            }
+        else:
+            vitals[key] = {"value": _number(match.group(1)), "unit": _default_unit(key)}
+        consumed += 1
+    if consumed != len(UNIT_MENTION.findall(note)):
+        return None
+    return vitals
+
+# ----------------------------
+# Visit motivation and symptoms
+# ----------------------------
+def _aliases(label: str):
+    aliases = {label, re.sub(r"\s*\(.*?\)", "", label).strip()}
+    aliases.update(re.findall(r"\((.*?)\)", label))
+    return {a for a in aliases if a}
+
+VM_ALIASES = {label: [re.compile(r"\b" + re.escape(a) + r"\b", re.IGNORECASE) for a in _aliases(label)]
+              for label in VISIT_MOTIVATIONS}
+
+COMPLAINT_LINE = re.compile(r"^\W*(?:chief complaint|visit motivation|reason for visit):\s*(.+)$", re.IGNORECASE)
+# Negated or hedged mentions ("Rule out anemia", "history of asthma", "no flu") do not state the motivation.
+HEDGE = re.compile(
+    r"\b(?:rule[sd]? out|r/o|history of|h/o|hx of|no|not|denies|denied|negative for|without|possible|possibly|"
+    r"probable|suspected|suspect|query|vs|versus)\b|\?",
+    re.IGNORECASE,
+)
+
+def extract_visit_motivation(note: str, sections: dict):
+    lines = _find_section(sections, "visit motivation", "chief complaint", "reason for visit") or []
+    # Plain "Chief Complaint: ..." lines are not section headers but state the motivation just as clearly.
+    lines += [m.group(1) for line in note.splitlines() if (m := COMPLAINT_LINE.match(line.replace("*", "")))]
+    matches = set()
+    for line in lines:
+        found = {label for label, patterns in VM_ALIASES.items() if any(p.search(line) for p in patterns)}
+        # A hedged line leaves the field to the model.
+        if found and HEDGE.search(line):
+            return None
+        matches |= found
+    return matches.pop() if len(matches) == 1 else None
+
+# Vocabulary labels as they read in prose ("chest_pain" -> "chest pain").
+SYMPTOM_MENTION = re.compile(
+    r"\b(?:" + "|".join(re.escape(s.replace("_", " ")) for s in sorted(SYMPTOMS, key=len, reverse=True)) + r")\b",
+    re.IGNORECASE,
+)
+
+def extract_symptoms(note: str, sections: dict):
+    """
+    Symptoms from a headed bullet list; resolved only if every bullet is a known symptom label and no
+    other vocabulary symptom is mentioned elsewhere in the note (history, assessment, ...).
+    """
+    lines = _find_section(sections, "symptoms")
+    if not lines:
+        return None
+    found = []
+    for line in lines:
+        label = re.sub(r"[^a-z ]", "", line.lower()).strip().replace(" ", "_")
+        if label not in SYMPTOMS:
+            return None
+        if label not in found:
+            found.append(label)
+    # Like the unit-mention check for vitals: a symptom the list misses leaves the field to the model.
+    prose = " ".join(line for name, content in sections.items() if "symptom" not in name for line in content)
+    if any(" ".join(m.lower().split()).replace(" ", "_") not in found for m in SYMPTOM_MENTION.findall(prose)):
+        return None
+    return found or None
+
+# ----------------------------
+# Fast path
+# ----------------------------
+EXTRACTORS = {
+    "patient_info": extract_patient_info,
+    "visit_motivation": extract_visit_motivation,
+    "symptoms": extract_symptoms,
+    "vital_signs": extract_vital_signs,
+}
+
+def extract_rules(note: str) -> dict:
+    """
+    Fields resolved without the model: {field: value} for the subset that matched confidently.
+    """
+    resolved = {}
+    sections = split_sections(note)
+    for field, extractor in EXTRACTORS.items():
+        value = extractor(note, sections)
+        if value is not None:
+            resolved[field] = value
+    return resolved
+
+def merge_rules(resolved: dict, json_text: str) -> str:
+    """
+    Overlay rule-resolved fields on the model's JSON. If the model output does not parse,
+    it is returned unchanged so the usual validity checks still flag it.
+    """
+    if not resolved:
+        return json_text
+    try:
+        data = json.loads(json_text)
+    except (json.JSONDecodeError, TypeError):
+        return json_text
+    if not isinstance(data, dict):
+        return json_text
+    data.update(resolved)
+    return json.dumps(data, ensure_ascii=False)
+
+class RuleStats:
+    """
+    How much of the work the fast path handled: whole notes and individual fields.
+    """
+
+    def __init__(self):
+        self.notes = 0
+        self.notes_skipped = 0
+        self.fields = {field: 0 for field in FIELDS}
+
+    def add(self, resolved: dict):
+        self.notes += 1
+        self.notes_skipped += len(resolved) == len(FIELDS)
+        for field in resolved:
+            self.fields[field] += 1
+
+    def report(self) -> dict:
+        notes = max(self.notes, 1)
+        return {
+            "notes": self.notes,
+            "notes_without_model": self.notes_skipped / notes,
+            "fields_without_model": sum(self.fields.values()) / (notes * len(FIELDS)),
+            "per_field": {field: count / notes for field, count in self.fields.items()},
+        }
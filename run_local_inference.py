@@ -1,45 +1,563 @@
 # run.py
-# Simple runner script: reads test.csv, invokes the chain row-by-row, saves outputs.
+# Streaming runner script: reads test.csv in chunks, invokes the chain row-by-row or in length-bucketed
+# batches, and appends every result to a resumable on-disk log.
 
+import argparse
+import functools
+import json
+import os
 import time
 import pandas as pd
 from tqdm.auto import tqdm
 
-from config import TEST_CSV
-from schema_and_prompt import EXAMPLES_TEXT, parser
-from model_chain import chain
+from config import (
+    TEST_CSV, MODEL_ID, BATCH_SIZE, CONSTRAINED_DECODING, OUTPUT_LOG, OUTPUT_CSV, OUTPUT_PARQUET, CHUNK_SIZE, FSYNC_EVERY,
+    TRACING, TRACE_PIPELINE, DYNAMIC_EXAMPLES, EXAMPLE_K, EXAMPLE_TOKEN_BUDGET, MAX_REGENERATIONS, COMPACT_LOG,
+    NEAR_DUPLICATES, BACKEND, ADAPTIVE_BUDGET,
+)
+from schema_and_prompt import EXAMPLES_TEXT, format_instructions
+from model_chain import (
+    get_cached_chain, get_speculative_chain, get_speculative_decoder, get_pipeline, split_prompt,
+    GENERATION_KWARGS,
+)
+from backends import get_backend, record_throughput
+from extraction_cache import ExtractionCache, cache_key
+from rule_extractor import FIELDS, RuleStats, extract_rules, merge_rules
+from normalizer import get_normalizers, normalize_json
+from json_repair import RepairStats, repair_result
+from prompt_registry import PromptRegistry
+from token_budget import BudgetStats, estimate_budget, json_closed
+from validation import ValidationStats, validate_texts
 
-def main():
+# Retrieved few-shot examples; None means every note gets the fixed EXAMPLES_TEXT (see use_example_store).
+_example_store = None
+
+def use_example_store(store):
+    global _example_store
+    _example_store = store
+
+# Prompt-lookup speculative decoding for row-by-row generation (see use_speculative).
+_speculative = False
+
+def use_speculative(enabled: bool):
+    global _speculative
+    _speculative = enabled
+
+# Compact line-per-field answers expanded to JSON by compact_format.py (see use_compact_output).
+_compact_output = False
+
+def use_compact_output(enabled: bool):
+    global _compact_output
+    _compact_output = enabled
+
+# Inference backend the chains run on (see backends.py and use_backend).
+_backend_name = BACKEND
+
+def use_backend(name: str):
+    global _backend_name
+    _backend_name = name
+
+def current_backend():
+    return get_backend(_backend_name)
+
+# Per-note max_new_tokens with retries of cut-off answers; None means the fixed budget (see use_adaptive_budget).
+_budget_stats = BudgetStats(GENERATION_KWARGS["max_new_tokens"]) if ADAPTIVE_BUDGET else None
+
+def use_adaptive_budget(stats):
+    global _budget_stats
+    _budget_stats = stats
+
+def examples_for(note: str) -> str:
+    if _example_store is None:
+        return EXAMPLES_TEXT
+    return _example_store.examples_text(note, EXAMPLE_K, EXAMPLE_TOKEN_BUDGET, current_backend().count_tokens)
+
+def build_inputs(note: str) -> dict:
+    """
+    Prompt variables for a single note.
+    """
+    return {
+        "Note": note,
+        "format_instructions": format_instructions,
+        "EXAMPLES_TEXT": examples_for(note),
+    }
+
+def length_buckets(notes, batch_size: int):
+    """
+    Group note positions into buckets of similar tokenized length, longest first,
+    so each padded batch wastes as little compute as possible on padding.
+    """
+    if not len(notes):
+        return []
+    lengths = current_backend().token_counts(list(notes))
+    order = sorted(range(len(notes)), key=lambda i: lengths[i], reverse=True)
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+def truncated(note: str, result, budget: int) -> bool:
+    """
+    True when the answer's JSON object never closed and the generation used (about) its whole budget.
+    """
+    prefix, suffix = prompt_parts(examples_for(note))
+    prompt_text = prefix + note + suffix
+    continuation = result[0][len(prompt_text):] if result[0].startswith(prompt_text) else result[0]
+    if json_closed(continuation):
+        return False
+    # Re-tokenizing decoded text can come out a few tokens shorter than what was generated.
+    return current_backend().count_tokens(continuation) >= 0.95 * budget
+
+def budgeted_batch(notes, rows, batch_size: int, run_config=None):
+    """
+    Generate `rows` of `notes` as one batch. With adaptive budgets, max_new_tokens is the largest estimated
+    budget of the rows; rows whose answer was cut off at it are regenerated with double the budget,
+    up to the fixed max_new_tokens. Returns the results in `rows` order and the tokens saved by the JSON
+    early stop per generated sequence, each against the budget of the call that generated it.
+    """
+    inputs = {i: build_inputs(notes[i]) for i in rows}
+    if _budget_stats is None:
+        outputs = current_backend().chain(batch_size).batch([inputs[i] for i in rows], config=run_config)
+        return outputs, current_backend().pop_saved()
+    max_tokens = GENERATION_KWARGS["max_new_tokens"]
+    budgets = [estimate_budget(notes[i], max_tokens) for i in rows]
+    _budget_stats.add(budgets)
+    budget, pending, results, saved = max(budgets), list(rows), {}, []
+    while pending:
+        outputs = current_backend().chain(batch_size, max_new_tokens=budget).batch([inputs[i] for i in pending],
+                                                                                   config=run_config)
+        saved += current_backend().pop_saved(budget)
+        results.update(zip(pending, outputs))
+        if budget >= max_tokens:
+            break
+        pending = [i for i in pending if truncated(notes[i], results[i], budget)]
+        budget = min(2 * budget, max_tokens)
+        if pending:
+            _budget_stats.retried[budget] += len(pending)
+    return [results[i] for i in rows], saved
+
+def generate_results(notes, batch_size: int, use_prefix_cache: bool = False, tracer=None):
+    """
+    Yield (position, result) pairs as soon as each bucket (or row) is generated.
+    result[0] is full model output; result[1] is extracted JSON-only portion.
+    """
+    run_config = {"callbacks": [tracer]} if tracer is not None else None
+    if _compact_output:
+        from compact_format import compact_chain
+        runner = compact_chain(batch_size)
+        for bucket in length_buckets(notes, batch_size):
+            outputs = runner.batch([build_inputs(notes[i]) for i in bucket], config=run_config)
+            print(f"Bucket of {len(bucket)} rows Completed (compact output).")
+            yield from zip(bucket, outputs)
+    elif batch_size > 1 and not use_prefix_cache and not _speculative:
+        for bucket in length_buckets(notes, batch_size):
+            outputs, saved = budgeted_batch(notes, bucket, batch_size, run_config)
+            print(f"Bucket of {len(bucket)} rows Completed. Tokens saved by early stop: {saved}")
+            yield from zip(bucket, outputs)
+    else:
+        # Row by row (the prefix cache only prefills each note's own tokens; speculative decoding is batch size 1).
+        # (Adaptive budgets apply to the plain chain; the prefix cache and speculative decoder keep their own.)
+        if _speculative:
+            runner = get_speculative_chain()
+        else:
+            runner = get_cached_chain() if use_prefix_cache else None
+        for i, note in enumerate(notes):
+            if runner is None:
+                outputs, saved = budgeted_batch(notes, [i], 1, run_config)
+                result, saved = outputs[0], sum(saved)
+            else:
+                result = runner.invoke(build_inputs(note), config=run_config)
+                saved = sum(current_backend().pop_saved())
+            print(f"Row {i} Completed. Tokens saved by early stop: {saved}")
+            yield i, result
+
+def repaired_results(notes, batch_size: int, use_prefix_cache: bool = False, tracer=None, repair_stats=None,
+                     gave_up: set = None):
+    """
+    generate_results with inline repair: outputs are fixed deterministically where possible and
+    validated against JsonOutput; only rows that still fail are regenerated with the backend's strict chain,
+    up to MAX_REGENERATIONS times. Rows still broken after that are yielded as generated, and their
+    positions are added to `gave_up` (without repair, every row that fails repair_result is).
+    """
+    if repair_stats is None:
+        for i, result in generate_results(notes, batch_size, use_prefix_cache, tracer):
+            if gave_up is not None and repair_result(result)[0] is None:
+                gave_up.add(i)
+            yield i, result
+        return
+    failed = {}
+    for i, result in generate_results(notes, batch_size, use_prefix_cache, tracer):
+        fixed, method = repair_result(result)
+        repair_stats.methods[method] += 1
+        if fixed is None:
+            failed[i] = result
+        else:
+            yield i, fixed
+    run_config = {"callbacks": [tracer]} if tracer is not None else None
+    for attempt in range(MAX_REGENERATIONS):
+        if not failed:
+            break
+        print(f"Regenerating {len(failed)} rows (attempt {attempt + 1}/{MAX_REGENERATIONS}).")
+        runner = current_backend().chain(max(batch_size, 1), strict=True)
+        positions = list(failed)
+        for bucket in length_buckets([notes[i] for i in positions], max(batch_size, 1)):
+            rows = [positions[j] for j in bucket]
+            outputs = runner.batch([build_inputs(notes[i]) for i in rows], config=run_config)
+            current_backend().pop_saved()
+            repair_stats.regenerated += len(rows)
+            for i, result in zip(rows, outputs):
+                fixed, method = repair_result(result)
+                if fixed is None:
+                    failed[i] = result
+                else:
+                    repair_stats.methods[f"regenerated_{method}"] += 1
+                    del failed[i]
+                    yield i, fixed
+    repair_stats.gave_up += len(failed)
+    if gave_up is not None:
+        gave_up.update(failed)
+    yield from failed.items()
+
+def cache_context(note: str = None):
+    """
+    Static prompt text and generation settings that, together with the note, determine the output.
+    With retrieved examples the "static" text depends on the note, so pass it.
+    """
+    examples = EXAMPLES_TEXT if _example_store is None or note is None else examples_for(note)
+    static_prompt = "".join(split_prompt(format_instructions, examples))
+    settings = {**GENERATION_KWARGS, "constrained": CONSTRAINED_DECODING, "json_early_stop": True}
+    if _speculative:
+        settings.update(constrained=False, greedy=True)
+    if _compact_output:
+        settings.update(constrained=False, json_early_stop=False, output_format="compact")
+    settings.update(current_backend().cache_settings())
+    return static_prompt, settings
+
+def cached_generate_results(notes, batch_size: int, use_prefix_cache: bool = False, cache=None, tracer=None,
+                            repair_stats=None):
+    """
+    Like generate_results, but notes found in the extraction cache are served from it
+    and only the misses reach the model.
+    """
+    if cache is None:
+        yield from repaired_results(notes, batch_size, use_prefix_cache, tracer, repair_stats)
+        return
+    keys = []
+    for note in notes:
+        static_prompt, settings = cache_context(note)
+        keys.append(cache_key(note, static_prompt, MODEL_ID, settings))
+    misses = []
+    for i, key in enumerate(keys):
+        hit = cache.get(key)
+        if hit is None:
+            misses.append(i)
+        else:
+            yield i, hit
+    # Broken answers are not cached: the key does not change, so they would be replayed instead of regenerated.
+    gave_up = set()
+    for j, result in repaired_results([notes[i] for i in misses], batch_size, use_prefix_cache, tracer, repair_stats,
+                                      gave_up):
+        if j not in gave_up:
+            cache.put(keys[misses[j]], result)
+        yield misses[j], result
+
+def fast_path_results(notes, batch_size: int, use_prefix_cache: bool = False, cache=None, rule_stats=None,
+                      tracer=None, repair_stats=None):
+    """
+    Resolve fields with the rule-based extractor first. Notes with every field resolved skip the
+    model entirely (empty full_response); the rest go through the cache/model and the
+    rule-resolved fields override the model's values.
+    """
+    if rule_stats is None:
+        yield from cached_generate_results(notes, batch_size, use_prefix_cache, cache, tracer, repair_stats)
+        return
+    resolved = [extract_rules(note) for note in notes]
+    pending = []
+    for i, fields in enumerate(resolved):
+        rule_stats.add(fields)
+        if len(fields) == len(FIELDS):
+            yield i, ["", json.dumps({field: fields[field] for field in FIELDS}, ensure_ascii=False)]
+        else:
+            pending.append(i)
+    pending_notes = [notes[i] for i in pending]
+    for j, result in cached_generate_results(pending_notes, batch_size, use_prefix_cache, cache, tracer, repair_stats):
+        i = pending[j]
+        yield i, [result[0], merge_rules(resolved[i], result[1])]
+
+def checked_results(results, normalize: bool = True, batch_size: int = BATCH_SIZE, validation_stats=None):
+    """
+    (position, json text, full_response) for each (position, result): labels mapped to the training vocabulary,
+    then, with `validation_stats`, every `batch_size` rows validated and coerced against JsonOutput in one call.
+    """
+    batch = []
+    for i, result in results:
+        # Symptom / visit-motivation labels are mapped to the training vocabulary as results arrive.
+        batch.append((i, normalize_json(result[1]) if normalize else result[1], result[0]))
+        if validation_stats is None or len(batch) >= batch_size:
+            yield from _checked_batch(batch, validation_stats)
+            batch = []
+    yield from _checked_batch(batch, validation_stats)
+
+def _checked_batch(batch, validation_stats):
+    if validation_stats is None or not batch:
+        return batch
+    # Valid rows are logged in coerced form; invalid rows as generated (their errors go to the stats).
+    checked = validate_texts([json_text for _, json_text, _ in batch], validation_stats)
+    return [(i, json_text, full_response) for (i, _, full_response), (json_text, _) in zip(batch, checked)]
+
+# ----------------------------
+# Resumable result log
+# ----------------------------
+def completed_ids(path: str) -> set:
+    """
+    IDs already present in the log. A trailing line cut off by a crash is truncated away.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    valid_end = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                done.add(str(json.loads(line)["ID"]))
+            except (ValueError, KeyError):
+                break
+            valid_end += len(line)
+    if valid_end != os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(valid_end)
+    return done
+
+class ResultLog:
+    """
+    Append-only JSONL log of {"ID", "json", "full_response"} records, fsynced every `fsync_every` writes.
+    """
+
+    def __init__(self, path: str, fsync_every: int = FSYNC_EVERY):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.pending = 0
+
+    def __enter__(self):
+        self.file = open(self.path, "a", encoding="utf-8")
+        return self
+
+    def write(self, record: dict):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.pending += 1
+        if self.pending >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def __exit__(self, *exc):
+        self.sync()
+        self.file.close()
+
+@functools.lru_cache(maxsize=64)
+def prompt_parts(examples_text: str):
+    return split_prompt(format_instructions, examples_text)
+
+def compact_response(registry: PromptRegistry, full_response, note: str):
+    """
+    The logged form of a response: continuation + prompt-template hash (see prompt_registry.py).
+    """
+    examples = examples_for(note)
+    templates = [prompt_parts(examples)]
+    if _compact_output:
+        # Compact-format answers, except rows re-generated in JSON by the repair stage.
+        from compact_format import split_compact_prompt
+        templates.insert(0, split_compact_prompt(examples))
+    for prefix, suffix in templates:
+        compacted = registry.compact(full_response, note, prefix, suffix)
+        if compacted is not full_response:
+            break
+    return compacted
+
+def export_csv(log_path: str, csv_path: str, chunksize: int = CHUNK_SIZE):
+    """
+    Stream the JSONL log into the ID/json/full_response CSV read by submission_builder.py.
+    Rows keep the order they were generated in; downstream steps key on ID.
+    """
+    if os.path.exists(csv_path):
+        os.remove(csv_path)
+    reader = pd.read_json(log_path, lines=True, chunksize=chunksize, dtype=False, convert_dates=False)
+    for i, part in enumerate(reader):
+        part.to_csv(csv_path, mode="a", header=(i == 0), index=False)
+
+def main(batch_size: int = BATCH_SIZE, use_prefix_cache: bool = False, output_path: str = OUTPUT_LOG,
+         use_cache: bool = True, use_rules: bool = True, normalize: bool = True, trace: bool = TRACING,
+         dynamic_examples: bool = DYNAMIC_EXAMPLES, repair: bool = True, speculative: bool = False,
+         compact: bool = COMPACT_LOG, compact_output: bool = False, score_against: str = None,
+         near_duplicates: bool = NEAR_DUPLICATES, backend: str = BACKEND, adaptive_budget: bool = ADAPTIVE_BUDGET,
+         validate: bool = True, trace_pipeline: bool = TRACE_PIPELINE):
     start_time = time.time()
+    cache = ExtractionCache() if use_cache else None
+    rule_stats = RuleStats() if use_rules else None
+    repair_stats = RepairStats() if repair else None
+    validation_stats = ValidationStats() if validate else None
+    # Log continuations only; the prompt each one follows is stored once in the registry.
+    registry = PromptRegistry() if compact else None
 
-    # Read test data.
-    test = pd.read_csv(TEST_CSV)
-
-    # Optional slicing as in the original script (uncomment one block at a time).
-    # test = test[:900]        # ---- part 1
-    # test = test[900:1800]    # ---- part 2
-    # test = test[1800:2700]   # ---- part 3
-    # test = test[2700:]       # ---- part 4
-
-    # Iterate rows and run inference.
-    for idx, row in tqdm(test.iterrows(), total=len(test)):
-        result = chain.invoke(
-            {
-                "Note": row["Note"],
-                "format_instructions": parser.get_format_instructions(),
-                "EXAMPLES_TEXT": EXAMPLES_TEXT,
-            }
-        )
-        # result[0] is full model output; result[1] is extracted JSON-only portion.
-        test.at[idx, "json"] = result[1]
-        test.at[idx, "full_response"] = result[0]
-        print(f"Row {idx} Completed.")
+    # Skip IDs a previous (possibly crashed) run already wrote.
+    done = completed_ids(output_path)
+    if done:
+        print(f"Resuming: {len(done)} rows already in {output_path}.")
+
+    # The prefix cache, speculative decoding and the compact format drive the HF model directly.
+    use_backend(backend)
+    if backend != "hf" and (use_prefix_cache or speculative or compact_output):
+        raise ValueError("--prefix-cache, --speculative and --compact-output need the hf backend")
+
+    # Load the model up front so the first note's latency is not dominated by weight loading.
+    load_start = time.time()
+    current_backend().warm_up()
+    print(f"Model loaded and warmed up in {time.time() - load_start:.1f}s")
+
+    # Few-shot examples retrieved per note from train.csv instead of the fixed EXAMPLES_TEXT.
+    if dynamic_examples:
+        from example_store import load_store
+        use_example_store(load_store())
+
+    # Greedy decoding with drafts copied from the note and schema strings; forces row-by-row generation.
+    use_speculative(speculative)
+    # The model answers in the compact line format; rows are expanded to JSON before repair and logging.
+    use_compact_output(compact_output)
+    # max_new_tokens sized per note from its symptom / vital-sign counts; cut-off answers are retried larger.
+    budget_stats = BudgetStats(GENERATION_KWARGS["max_new_tokens"]) if adaptive_budget else None
+    use_adaptive_budget(budget_stats)
+
+    # Per-note stage timings, token counts and peak memory (see tracing.py); the model-call breakdown
+    # needs the pipeline hooks.
+    tracer = None
+    if trace:
+        from tracing import ChainTracer
+        tracer = ChainTracer()
+        if trace_pipeline and backend == "hf":
+            tracer.instrument(get_pipeline().pipeline)
+
+    # Notes whose relevant sections exactly match an earlier note's reuse that note's extraction.
+    dedup, shared, generated, reused = None, {}, set(), 0
+    if near_duplicates:
+        from near_duplicates import build_index
+        dedup = build_index(TEST_CSV)
+
+    # Read test data in chunks so memory stays flat regardless of the number of notes.
+    with ResultLog(output_path) as log:
+        for chunk in tqdm(pd.read_csv(TEST_CSV, chunksize=CHUNK_SIZE)):
+            chunk = chunk[~chunk["ID"].astype(str).isin(done)]
+            if chunk.empty:
+                continue
+            ids = chunk["ID"].tolist()
+            notes = chunk["Note"].tolist()
+            # Followers whose representative is generated in this run share its result; the rest are generated.
+            followers, generate = {}, []
+            for i, record_id in enumerate(ids):
+                rep = dedup.representative_of(str(record_id)) if dedup is not None else None
+                if rep is not None and (rep in shared or rep in generated):
+                    followers[i] = rep
+                else:
+                    generate.append(i)
+                    generated.add(str(record_id))
+            results = fast_path_results([notes[i] for i in generate], batch_size, use_prefix_cache, cache, rule_stats,
+                                        tracer, repair_stats)
+            for j, json_text, full_response in checked_results(results, normalize, max(batch_size, 1), validation_stats):
+                i = generate[j]
+                full_response = full_response if registry is None else compact_response(registry, full_response, notes[i])
+                log.write({"ID": ids[i], "json": json_text, "full_response": full_response})
+                if dedup is not None and dedup.has_followers(str(ids[i])):
+                    shared[str(ids[i])] = json_text
+            for i, rep in followers.items():
+                log.write({"ID": ids[i], "json": shared[rep], "full_response": ""})
+                reused += 1
+
+    if tracer is not None:
+        tracer.close()
 
     # Save outputs.
-    test.to_csv("final_output_fewshot.csv", index=False)
+    export_csv(output_path, OUTPUT_CSV)
+    if OUTPUT_PARQUET:
+        from columnar_output import export_parquet
+        export_parquet(output_path, OUTPUT_PARQUET)
+
+    # Per-backend throughput, also appended to BACKEND_STATS to compare hardware across runs.
+    backend_report = current_backend().report()
+    record_throughput(backend_report)
+    print(f"Backend throughput: {backend_report}")
+    if dedup is not None:
+        print(f"Near-duplicates: {dedup.report()}; model calls avoided: {reused}")
+    if budget_stats is not None:
+        print(f"Adaptive token budget: {budget_stats.report()}")
+    if validation_stats is not None:
+        print(f"Schema validation: {validation_stats.report()}")
+    if rule_stats is not None:
+        print(f"Rule-based fast path: {rule_stats.report()}")
+    if repair_stats is not None:
+        print(f"JSON repair: {repair_stats.report()}")
+    if speculative:
+        print(f"Speculative decoding: {get_speculative_decoder().report()}")
+    if normalize:
+        sym_normalizer, vm_normalizer = get_normalizers()
+        print(f"Label normalization: symptoms {dict(sym_normalizer.stats)}, visit motivation {dict(vm_normalizer.stats)}")
+    if cache is not None:
+        print(f"Extraction cache: {cache.stats()}")
+        cache.close()
 
     elapsed = time.time() - start_time
     print(f"Time elapsed: {elapsed:.1f}s")
 
+    # Local competition-style score, so a throughput change is reported with its accuracy change.
+    if score_against:
+        from scorer import score_file
+        report = score_file(output_path, score_against)
+        print(f"Score: {report['score']:.4f} (valid JSON {report['valid_json']:.1%}, {report['rows']} rows) "
+              f"in {elapsed:.1f}s; lowest fields: {dict(list(report['fields'].items())[:5])}")
+
 if __name__ == "__main__":
-    main()
+    arg_parser = argparse.ArgumentParser(description="Run local inference over TEST_CSV.")
+    arg_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                            help="Notes per padded generate call (1 = row-by-row).")
+    arg_parser.add_argument("--backend", choices=["hf", "cpu", "stub"], default=BACKEND,
+                            help="Inference backend (default: BACKEND in config.py); see backends.py.")
+    arg_parser.add_argument("--prefix-cache", action="store_true",
+                            help="Run row-by-row, reusing the KV-cache of the static prompt prefix.")
+    arg_parser.add_argument("--output", default=OUTPUT_LOG,
+                            help="Result log to append to; rows already in it are skipped.")
+    arg_parser.add_argument("--no-cache", action="store_true",
+                            help="Always call the model, ignoring the extraction cache.")
+    arg_parser.add_argument("--no-rules", action="store_true",
+                            help="Send every note to the model, skipping the rule-based fast path.")
+    arg_parser.add_argument("--dynamic-examples", action="store_true",
+                            help="Retrieve similar train.csv examples per note (within EXAMPLE_TOKEN_BUDGET) instead of EXAMPLES_TEXT.")
+    arg_parser.add_argument("--no-repair", action="store_true",
+                            help="Log outputs as generated, without inline repair, validation and re-generation.")
+    arg_parser.add_argument("--speculative", action="store_true",
+                            help="Run row-by-row with prompt-lookup speculative decoding (greedy, identical to greedy generate).")
+    arg_parser.add_argument("--compact-output", action="store_true",
+                            help="Ask the model for compact field lines instead of JSON and expand them (fewer generated tokens).")
+    arg_parser.add_argument("--score-against", default=None, metavar="TRAIN_CSV",
+                            help="Score the results against this labelled CSV (e.g. train.csv notes run as TEST_CSV).")
+    arg_parser.add_argument("--full-log", action="store_true",
+                            help="Log the full prompt + generation per row instead of the compact form.")
+    arg_parser.add_argument("--fixed-budget", action="store_true",
+                            help="Give every note the full max_new_tokens instead of a per-note budget.")
+    arg_parser.add_argument("--no-dedup", action="store_true",
+                            help="Generate every note, even when its relevant sections duplicate an earlier note.")
+    arg_parser.add_argument("--no-validate", action="store_true",
+                            help="Log JSON as generated, without batched validation and coercion against JsonOutput.")
+    arg_parser.add_argument("--trace", action="store_true",
+                            help="Also hook the HF pipeline to split each model call into tokenize / prefill / decode / "
+                                 "detokenize in the trace.")
+    arg_parser.add_argument("--no-trace", action="store_true",
+                            help="Disable the per-note JSONL trace and Prometheus snapshot.")
+    arg_parser.add_argument("--no-normalize", action="store_true",
+                            help="Log raw symptom / visit-motivation labels instead of mapping them to the training vocabulary.")
+    args = arg_parser.parse_args()
+    main(batch_size=args.batch_size, use_prefix_cache=args.prefix_cache, output_path=args.output,
+         use_cache=not args.no_cache, use_rules=not args.no_rules, normalize=not args.no_normalize,
+         trace=TRACING and not args.no_trace, dynamic_examples=DYNAMIC_EXAMPLES or args.dynamic_examples,
+         repair=not args.no_repair, speculative=args.speculative, compact=COMPACT_LOG and not args.full_log,
+         compact_output=args.compact_output, score_against=args.score_against,
+         near_duplicates=NEAR_DUPLICATES and not args.no_dedup, backend=args.backend,
+         adaptive_budget=ADAPTIVE_BUDGET and not args.fixed_budget, validate=not args.no_validate,
+         trace_pipeline=TRACE_PIPELINE or args.trace)
@@ -1,24 +1,77 @@
 import ast
-import pandas as pd
+import hashlib
+import json
+import os
 from typing import Annotated, Literal, Optional, List
 
 from pydantic import BaseModel, Field, ConfigDict
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 
-from config import TRAIN_CSV
+from config import TRAIN_CSV, VOCAB_CACHE
+from prompt_registry import split_compact
 
-# Read training data to derive allowed literal values for visit_motivation and symptoms.
-train = pd.read_csv(TRAIN_CSV)
-
-visit_motivation = set()
-for i in range(len(train)):
-    visit_motivation.add(ast.literal_eval(train["json"][i])["visit_motivation"])
+# ----------------------------
+# Vocabularies from train.csv (cached)
+# ----------------------------
 
-symptoms = set()
-for i in range(len(train)):
-    for sym in ast.literal_eval(train["json"][i])["symptoms"]:
-        symptoms.add(sym)
+def _source_signature(train_csv: str) -> dict:
+    # train.csv identity plus this file's contents, so schema edits also invalidate the artifact.
+    stat = os.stat(train_csv)
+    with open(__file__, "rb") as f:
+        schema_hash = hashlib.sha256(f.read()).hexdigest()
+    return {"path": os.path.abspath(train_csv), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "schema": schema_hash}
+
+def build_vocabularies(train_csv: str = TRAIN_CSV):
+    """
+    Allowed literal values for visit_motivation and symptoms, parsed from the training labels.
+    """
+    import pandas as pd
+
+    visit_motivation, symptoms = set(), set()
+    for js in pd.read_csv(train_csv, usecols=["json"])["json"]:
+        data = ast.literal_eval(js)
+        visit_motivation.add(data["visit_motivation"])
+        symptoms.update(data["symptoms"])
+    return visit_motivation, symptoms
+
+def load_artifact(train_csv: str = TRAIN_CSV, cache_path: str = VOCAB_CACHE):
+    """
+    Read the precomputed vocabularies (and format instructions) if they still match train.csv
+    and this schema; returns None when the artifact is missing or stale. Without train.csv
+    (e.g. a serving box that only has the artifact) the artifact is used as is, with a warning.
+    """
+    if not os.path.exists(cache_path):
+        return None
+    with open(cache_path, encoding="utf-8") as f:
+        artifact = json.load(f)
+    try:
+        source = _source_signature(train_csv)
+    except OSError:
+        print(f"Warning: {train_csv} not found; using {cache_path} without checking that it is up to date.")
+        return artifact
+    if artifact.get("source") != source:
+        return None
+    return artifact
+
+def save_artifact(artifact: dict, cache_path: str = VOCAB_CACHE):
+    directory = os.path.dirname(cache_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(artifact, f, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+
+_artifact = load_artifact()
+if _artifact is None:
+    visit_motivation, symptoms = build_vocabularies()
+else:
+    visit_motivation, symptoms = set(_artifact["visit_motivation"]), set(_artifact["symptoms"])
+
+# Sorted so the rendered schema (and hence the prompt) is identical across processes.
+_VISIT_MOTIVATIONS = tuple(sorted(visit_motivation))
+_SYMPTOMS = tuple(sorted(symptoms))
 
 # ----------------------------
 # Pydantic schema definitions
@@ -113,12 +166,12 @@ class JsonOutput(BaseModel):
         Field(description="Patient demographic information extracted from the medical note", default_factory=dict)
     ]
     visit_motivation: Annotated[
-        Literal[*visit_motivation],
+        Literal[*_VISIT_MOTIVATIONS],
         Field(description="Patient visit motivation or main motive of patient to visit extracted from the medical note", default_factory=str)
     ]
     # symptoms: Annotated[List[SymptomCategory], Field(description="List of symptoms mentioned in the medical note")]
     symptoms: Annotated[
-        List[Literal[*symptoms]],
+        List[Literal[*_SYMPTOMS]],
         Field(description="List of symptoms mentioned in the medical note")
     ]
     vital_signs: Annotated[
@@ -126,9 +179,20 @@ class JsonOutput(BaseModel):
         Field(description="Patient vital signs information extracted from the medical note", default_factory=dict)
     ]
 
-# Parser and format instructions used by the prompt.
+# Parser and format instructions used by the prompt (rendered once, then served from the artifact).
 parser = PydanticOutputParser(pydantic_object=JsonOutput)
-format_instructions = parser.get_format_instructions()
+if _artifact is None:
+    format_instructions = parser.get_format_instructions()
+    save_artifact(
+        {
+            "source": _source_signature(TRAIN_CSV),
+            "visit_motivation": list(_VISIT_MOTIVATIONS),
+            "symptoms": list(_SYMPTOMS),
+            "format_instructions": format_instructions,
+        }
+    )
+else:
+    format_instructions = _artifact["format_instructions"]
 
 # High-quality examples text block (kept identical to original).
 EXAMPLES_TEXT = """
@@ -270,6 +334,21 @@ Follow-up:
 Assistant: {"patient_info": {"age": 82, "gender": "Female"}, "visit_motivation": "Chronic Obstructive Pulmonary Disease (COPD)", "symptoms": ["cough", "fatigue", "difficulty_breathing", "chest_pain", "dizziness", "sneezing", "increased_thirst", "heartburn"], "vital_signs": {"blood_pressure": {"systolic": {"value": 95, "unit": "mmHg"}, "diastolic": {"value": 62, "unit": "mmHg"}}, "oxygen_saturation": {"value": 96.5, "unit": "%"}, "glucose_level": {"value": 98.2, "unit": "mg/dL"}}}
 """
 
+# Sentence that follows the few-shot examples in the human message. The model's answer is the text
+# after the next "Assistant:", however many examples (each with its own "Assistant:") precede it.
+NOTE_ANCHOR = "Now extract the data from the following Medical Note."
+
+def extract_assistant_response(text: str) -> str:
+    """
+    JSON part of a full pipeline response (prompt + generation) or of a compact one (prompt hash + generation).
+    """
+    key, continuation = split_compact(text)
+    if key is not None:
+        return continuation.split("Assistant:")[0].strip()
+    start = text.rfind(NOTE_ANCHOR)
+    parts = text[max(start, 0):].split("Assistant:")
+    return parts[1].strip() if len(parts) > 1 else text.strip()
+
 # Chat prompt template kept identical to original behavior.
 prompt = ChatPromptTemplate([
     (
@@ -0,0 +1,193 @@
+# scorer.py
+# Local stand-in for the competition metric: type-aware similarity between predicted and ground-truth JSON
+# (numbers by relative error, strings by similarity ratio, lists as sets, dicts averaged over their keys),
+# scored in parallel over chunks with a per-field breakdown.
+
+import argparse
+import ast
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+
+import pandas as pd
+
+from config import TRAIN_CSV, CHUNK_SIZE, POSTPROCESS_WORKERS
+
+# ----------------------------
+# Similarity
+# ----------------------------
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _text(value) -> str:
+    return " ".join(str(value).lower().replace("_", " ").split())
+
+def leaf_similarity(pred, truth) -> float:
+    """
+    Similarity in [0, 1] of two non-dict values, by the type of the ground truth.
+    """
+    if truth is None:
+        return float(pred is None)
+    if _is_number(truth):
+        if not _is_number(pred):
+            return 0.0
+        scale = max(abs(truth), abs(pred))
+        return 1.0 if scale == 0 else max(0.0, 1.0 - abs(pred - truth) / scale)
+    if isinstance(truth, list):
+        if not isinstance(pred, list):
+            return 0.0
+        truth_set, pred_set = {_text(v) for v in truth}, {_text(v) for v in pred}
+        union = truth_set | pred_set
+        return 1.0 if not union else len(truth_set & pred_set) / len(union)
+    if not isinstance(truth, str):
+        return float(pred == truth)
+    if not isinstance(pred, str):
+        return 0.0
+    a, b = _text(pred), _text(truth)
+    return 1.0 if a == b else SequenceMatcher(None, a, b).ratio()
+
+def similarity(pred, truth, fields: dict = None, path: str = "") -> float:
+    """
+    Type-aware similarity of a prediction to the ground truth. Dicts score the mean over the union of
+    their keys, so missing and extra keys both cost. Leaf scores are recorded in `fields` by dotted path.
+    """
+    if isinstance(truth, dict):
+        pred = pred if isinstance(pred, dict) else {}
+        keys = list(truth) + [key for key in pred if key not in truth]
+        if not keys:
+            return 1.0
+        scores = [similarity(pred.get(key), truth.get(key), fields, f"{path}.{key}" if path else key) for key in keys]
+        return sum(scores) / len(scores)
+    score = leaf_similarity(pred, truth)
+    if fields is not None:
+        fields[path] = score
+    return score
+
+def score_record(pred_text, truth: dict):
+    """
+    (score, valid JSON, {field: score}) for one prediction. Output that is not a JSON object scores 0
+    on every ground-truth field.
+    """
+    fields = {}
+    try:
+        pred = json.loads(pred_text)
+    except (json.JSONDecodeError, TypeError):
+        pred = None
+    valid = isinstance(pred, dict)
+    score = similarity(pred if valid else {}, truth, fields)
+    return (score if valid else 0.0), valid, fields
+
+# ----------------------------
+# Parallel scoring
+# ----------------------------
+def score_chunk(rows):
+    """
+    [(ID, prediction text, truth dict), ...] -> (per-row frame, long per-field frame).
+    """
+    records, field_rows = [], []
+    for record_id, pred_text, truth in rows:
+        score, valid, fields = score_record(pred_text, truth)
+        records.append((record_id, score, valid))
+        field_rows += [(record_id, field, value) for field, value in fields.items()]
+    return (pd.DataFrame(records, columns=["ID", "score", "valid"]),
+            pd.DataFrame(field_rows, columns=["ID", "field", "score"]))
+
+def score_rows(rows, workers: int = POSTPROCESS_WORKERS, chunksize: int = CHUNK_SIZE):
+    """
+    Score an iterable of (ID, prediction text, truth dict), in a process pool when workers != 1.
+    Returns (per-row frame, per-field frame).
+    """
+    chunks, chunk = [], []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunksize:
+            chunks.append(chunk)
+            chunk = []
+    if chunk:
+        chunks.append(chunk)
+    if workers == 1 or len(chunks) <= 1:
+        results = [score_chunk(c) for c in chunks]
+    else:
+        results = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = deque()
+            limit = 2 * (workers or os.cpu_count() or 1)
+            for c in chunks:
+                in_flight.append(pool.submit(score_chunk, c))
+                if len(in_flight) >= limit:
+                    results.append(in_flight.popleft().result())
+            results += [future.result() for future in in_flight]
+    if not results:
+        return score_chunk([])
+    return pd.concat([r[0] for r in results], ignore_index=True), pd.concat([r[1] for r in results], ignore_index=True)
+
+def summarize(per_row: pd.DataFrame, per_field: pd.DataFrame) -> dict:
+    """
+    Mean score, JSON validity and mean score per field (grouped over all scored rows).
+    """
+    by_field = per_field.groupby("field")["score"].mean().sort_values()
+    return {
+        "rows": int(len(per_row)),
+        "score": float(per_row["score"].mean()) if len(per_row) else 0.0,
+        "valid_json": float(per_row["valid"].mean()) if len(per_row) else 0.0,
+        "fields": {field: round(float(value), 4) for field, value in by_field.items()},
+    }
+
+def score_texts(pred_texts, truths, workers: int = 1) -> dict:
+    """
+    Summary for parallel lists of prediction texts and ground-truth dicts (e.g. benchmark answers).
+    """
+    return summarize(*score_rows(zip(range(len(truths)), pred_texts, truths), workers))
+
+# ----------------------------
+# Files
+# ----------------------------
+def load_truth(train_csv: str = TRAIN_CSV) -> dict:
+    """
+    ID -> ground-truth dict from train.csv (labels are Python-literal dicts).
+    """
+    train = pd.read_csv(train_csv, usecols=["ID", "json"])
+    return {str(record_id): ast.literal_eval(js) for record_id, js in zip(train["ID"], train["json"])}
+
+def read_predictions(path: str):
+    """
+    ID/json frames from a result log (.jsonl), results / submission CSV, Parquet file or queue DB.
+    """
+    if path.endswith(".jsonl"):
+        for frame in pd.read_json(path, lines=True, chunksize=CHUNK_SIZE, dtype=False, convert_dates=False):
+            yield frame[["ID", "json"]]
+        return
+    from submission_builder import read_results
+
+    for frame in read_results(CHUNK_SIZE, path):
+        yield frame[["ID", "json"]]
+
+def score_file(predictions_path: str, train_csv: str = TRAIN_CSV, workers: int = POSTPROCESS_WORKERS) -> dict:
+    """
+    Score every prediction whose ID is in train.csv; the summary also counts predictions without ground truth.
+    """
+    truth = load_truth(train_csv)
+    rows, unmatched = [], 0
+    for frame in read_predictions(predictions_path):
+        for record_id, pred_text in zip(frame["ID"].astype(str), frame["json"]):
+            if record_id in truth:
+                rows.append((record_id, pred_text, truth[record_id]))
+            else:
+                unmatched += 1
+    start = time.perf_counter()
+    report = summarize(*score_rows(rows, workers))
+    report["unmatched_predictions"] = unmatched
+    report["scoring_sec"] = time.perf_counter() - start
+    return report
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Score predictions against train.csv ground truth.")
+    arg_parser.add_argument("predictions", help="Result log (.jsonl), results/submission CSV, Parquet or queue DB.")
+    arg_parser.add_argument("--truth", default=TRAIN_CSV)
+    arg_parser.add_argument("--workers", type=int, default=POSTPROCESS_WORKERS,
+                            help="Scoring processes (1 = in-process; default: one per CPU).")
+    args = arg_parser.parse_args()
+    print(json.dumps(score_file(args.predictions, args.truth, args.workers), indent=2))
@@ -0,0 +1,33 @@
+# stub_llm.py
+# Deterministic stand-in for the LLM so queueing and batching code can be exercised on a CPU box.
+
+import json
+import re
+import time
+
+def stub_extract(note: str) -> dict:
+    """
+    Cheap regex guess of the output JSON; only meant to look like a model response.
+    """
+    age = re.search(r"(\d{1,3})[- ]year[- ]old|Age:\s*(\d{1,3})", note, re.IGNORECASE)
+    gender = re.search(r"\b(male|female)\b", note, re.IGNORECASE)
+    return {
+        "patient_info": {
+            "age": int(next(g for g in age.groups() if g)) if age else None,
+            "gender": gender.group(1).capitalize() if gender else None,
+        },
+        "visit_motivation": None,
+        "symptoms": [],
+        "vital_signs": {},
+    }
+
+def stub_response(note: str) -> list:
+    """
+    [full_response, json] in the same shape the chain returns.
+    """
+    json_text = json.dumps(stub_extract(note))
+    return [f"Medical Note:\n{note}\n\nAssistant: {json_text}", json_text]
+
+def stub_invoke_batch(notes, delay: float = 0.0):
+    time.sleep(delay * len(notes))
+    return [stub_response(note) for note in notes]
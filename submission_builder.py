@@ -1,31 +1,17 @@
+# submission_builder.py
+# Post-processing engine: each model output is parsed once, cleaned and normalized as a dict,
+# validated and serialized once. Chunks stream through a process pool, so memory stays flat.
+
+import argparse
 import json
-import ast
+import os
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 
-# ----------------------------
-# Load model outputs (parts)
-# ----------------------------
-
-# Four parts generated from the extraction pipeline
-df1 = pd.read_csv("final_output_fewshot_part1.csv")
-df2 = pd.read_csv("final_output_fewshot_part2.csv")
-df3 = pd.read_csv("final_output_fewshot_part3.csv")
-df4 = pd.read_csv("final_output_fewshot_part4.csv")
-
-# Remaining outputs that need postprocessing/corrections
-# df_rem = pd.read_csv("final_output_fewshot_remaining.csv")
-# df_rem2 = pd.read_csv("final_output_fewshot_remaining_more.csv")
-
-# Optional inspection (kept same as notebook display call)
-# df_rem2
-
-# ----------------------------
-# Combine primary parts
-# ----------------------------
-sub = pd.concat([df1, df2, df3, df4], axis=0).reset_index(drop=True)
-
-# Ensure the json column is string-typed before validation/transforms
-sub["json"] = sub["json"].astype(str)
+from config import QUEUE_DB, OUTPUT_CSV, OUTPUT_PARQUET, CHUNK_SIZE, SUBMISSION_CSV, POSTPROCESS_WORKERS
+from normalizer import get_normalizers
+from validation import ValidationStats, remove_nulls, validate_records
 
 # ----------------------------
 # JSON validation helper
@@ -44,265 +30,185 @@ def is_valid_json_dict(x):
     except Exception:
         return False
 
-# Validate JSON for combined results
-sub["is_valid_dict"] = sub["json"].apply(is_valid_json_dict)
-
-# Filter invalid rows for review (mirrors notebook inspection)
-rows = sub[~sub["is_valid_dict"]]
-
-# Validate JSON for the 'remaining' CSVs as well
-# df_rem["is_valid_dict"] = df_rem["json"].apply(is_valid_json_dict)
-# rows_rem = df_rem[~df_rem["is_valid_dict"]]
-
-# df_rem2["is_valid_dict"] = df_rem2["json"].apply(is_valid_json_dict)
-# rows_rem2 = df_rem2[~df_rem2["is_valid_dict"]]
-
 # ----------------------------
 # Manual JSON extraction from full_response (when needed)
 # ----------------------------
 def output_extract_text(text: str) -> str:
     """
-    Extract the JSON string by splitting on the 'Assistant:' delimiter.
-    Uses the same index as the original pipeline for consistency.
+    Extract the JSON string after the 'Assistant:' that follows the note,
+    the same way the pipeline's extractor does.
     """
+    from schema_and_prompt import extract_assistant_response
+
     try:
-        return text.split("Assistant:")[6].strip()
+        return extract_assistant_response(text)
     except Exception:
         # If extraction fails, return original text for later checks
         return text
 
-# Try to recover JSON from full_response where df_rem2 json is invalid
-# df_rem2["json_manual"] = df_rem2["full_response"].apply(output_extract_text)
-# df_rem2["is_valid_dict"] = df_rem2["json_manual"].apply(is_valid_json_dict)
-
-# Show invalid rows after manual extraction (mirrors notebook inspection)
-# invalid_rows_rem2 = df_rem2[~df_rem2["is_valid_dict"]]
-
 # ----------------------------
-# Update main 'sub' JSON with corrections from df_rem and df_rem2
+# Symptom / visit motivation normalization
 # ----------------------------
-
-# Update overlaps using df_rem row indices (as in notebook)
-# Note: This assumes df_rem rows align with indices to patch in 'sub'
-# update_indices = df_rem.index
-# sub.loc[update_indices, "json"] = df_rem.loc[update_indices, "json"]
-
-# # Update by ID using df_rem2 manual extraction where available
-# df_rem2_map = df_rem2.set_index("ID")["json_manual"]
-# mask = sub["ID"].isin(df_rem2_map.index)
-# sub.loc[mask, "json"] = sub.loc[mask, "ID"].map(df_rem2_map)
-
-# Optional checks preserved from notebook
-# _ = sub.isna().sum()
-# sub["cleaned_json"] = sub["json"].astype(str)
-
-# ----------------------------
-# Remove nulls from nested JSON objects
-# ----------------------------
-def remove_nulls(d):
+def map_and_deduplicate_symptoms(data: dict) -> dict:
     """
-    Recursively remove keys with None values from dicts and lists.
+    Map symptoms onto the training vocabulary (aliases from sym_mapping, then fuzzy matching)
+    and deduplicate (first occurrence wins) in place.
     """
-    if isinstance(d, dict):
-        return {k: remove_nulls(v) for k, v in d.items() if v is not None}
-    if isinstance(d, list):
-        return [remove_nulls(v) for v in d if v is not None]
-    return d
+    sym_normalizer, _ = get_normalizers()
+    mapped = (sym_normalizer(s) for s in data.get("symptoms", []))
+    data["symptoms"] = list(dict.fromkeys(mapped))
+    return data
 
-def clean_json_string(json_string: str):
+def map_visit_motivation(data: dict) -> dict:
     """
-    Parse, remove nulls, and re-serialize; return None on failure.
+    Map visit_motivation onto the training vocabulary (aliases from vm_mapping, then fuzzy matching)
+    without altering other fields.
     """
-    try:
-        data = json.loads(json_string)
-        cleaned = remove_nulls(data)
-        return json.dumps(cleaned, ensure_ascii=False)
-    except Exception:
-        return None
-
-# Apply cleaning
-sub["cleaned_json"] = sub["json"].apply(clean_json_string)
-
-# Replace original 'json' with the cleaned version
-sub = sub.drop(columns=["json"])
-sub.rename(columns={"cleaned_json": "json"}, inplace=True)
-
-# Optional inspection of empties (preserved)
-# sub[sub["json"].isna()]
+    _, vm_normalizer = get_normalizers()
+    orig = data.get("visit_motivation")
+    data["visit_motivation"] = vm_normalizer(orig) if isinstance(orig, str) else orig
+    return data
 
 # ----------------------------
-# Symptom normalization/deduplication
+# Single-pass record processing
 # ----------------------------
-
-train = pd.read_csv('data/train.csv')
-
-symptoms = set()
-for i, row in sub.iterrows():
-    #j = row['json'].strip("'\\'")
-    try:
-        js = json.loads(row['json'])
-        if 'symptoms' in js:
-            for sym in js['symptoms']:
-                symptoms.add(sym)
-    except Exception as e:
-        print(i)
-        print(e, "="*100)
-
-symptoms_og = set()
-for i in range(len(train)):
-    for sym in ast.literal_eval(train['json'][i])['symptoms']:
-        symptoms_og.add(sym)
-
-sym_mapping = {
-    'abdominal_pain': 'abdominal_pain',
-    'anxiety': 'anxiety',
-    'blurred_vision': 'blurred_vision',
-    #'body_aches': 'joint_pain',  # Mapping general aches to the closest pain category     ----------
-    'chest_pain': 'chest_pain',
-    #'chills': 'fever',  # Chills are a common symptom accompanying fever      ------------------
-    'chronic_cough': 'cough',  # Specific type of cough
-    'congestion': 'runny_nose',  # Nasal congestion is closely related
-    'cough': 'cough',
-    #'decreased_appetite': 'nausea',  # Related GI symptom                      ---------------
-    'diarrhea': 'diarrhea',
-    'difficulty_breathing': 'difficulty_breathing',
-    'difficulty_concentrating': 'difficulty_concentrating',
-    'difficulty_swallowing': 'sore_throat',  # Often caused by a sore throat
-    'dizziness': 'dizziness',
-    'dry_skin': 'dry_skin',
-    'ear_pain': 'ear_pain',
-    'eczema': 'rash',  # Eczema is a specific type of rash
-    'facial_pain': 'facial_pain',
-    'fatigue': 'fatigue',
-    'fever': 'fever',
-    'frequent_urination': 'frequent_urination',
-    'headache': 'headache',
-    'headaches': 'headache',  # Plural
-    'heartburn': 'heartburn',
-    'increased_thirst': 'increased_thirst',
-    'increased_urination': 'frequent_urination',  # Closely related urinary symptom
-    'itching': 'rash',  # Itching is the primary symptom of many rashes
-    'itchy_eyes': 'itchy_eyes',
-    'itchy_skin': 'rash',  # Symptom associated with rash or dry skin
-    'joint_pain': 'joint_pain',
-    #'loss_of_appetite': 'nausea',  # Related GI symptom
-    #'loss_of_interest_in_activities': 'sadness',  # A key component of sadness/depression
-    'loss_of_taste_smell': 'loss_of_taste_smell',
-    'lower_abdominal_pain': 'abdominal_pain',  # Specific type of abdominal pain
-    'nasal_congestion': 'runny_nose',  # Both are symptoms of rhinitis
-    'nausea': 'nausea',
-    'night_sweats': 'night_sweats',
-    #'pain': 'joint_pain',  # Mapping general pain to the closest available pain category      ---------------
-    'painful_urination': 'painful_urination',
-    'pale_skin': 'pale_skin',
-    'paleness': 'pale_skin',  # Synonym
-    #'palpitations': 'anxiety',  # Palpitations are a common physical symptom of anxiety        ----------------
-    'persistent_cough': 'cough',  # Specific type of cough
-    'rash': 'rash',
-    'regurgitation': 'heartburn',  # Both are key symptoms of GERD
-    'restlessness': 'restlessness',
-    'runny_nose': 'runny_nose',
-    'sadness': 'sadness',
-    'shortness_of_breath': 'difficulty_breathing',  # Synonym
-    'sneezing': 'sneezing',
-    'sore_throat': 'sore_throat',
-    'swollen_lymph_nodes': 'swollen_lymph_nodes',
-    'throat_pain': 'sore_throat',  # Synonym
-    'vomiting': 'vomiting',
-    #'weakness': 'fatigue',  # Closely related symptoms           -----------------
-    'weight_loss': 'weight_loss',
-    'wheezing': 'wheezing'
-}
-
-def map_and_deduplicate_symptoms(json_string: str):
+def process_record(json_string):
     """
-    Map symptoms using sym_mapping and deduplicate while preserving JSON structure.
+    Model JSON text -> (cleaned JSON text, parsed dict or None). Parses once, applies null removal
+    and label mapping on the dict, and serializes once. Unparseable output becomes "".
     """
     try:
-        data = json.loads(json_string)
-        original = data.get("symptoms", [])
-        mapped = {sym_mapping[s] if s in sym_mapping else s for s in original}
-        data["symptoms"] = list(mapped)
-        return json.dumps(data, ensure_ascii=False)
+        data = remove_nulls(json.loads(json_string))
     except (json.JSONDecodeError, TypeError):
-        return json_string
-
-sub["json"] = sub["json"].apply(map_and_deduplicate_symptoms)
-
-# ----------------------------
-# Visit motivation normalization
-visit_motivation = set()
-for i, row in sub.iterrows():
-    j = row['json'].strip("'\\'")
-    try:
-        js = json.loads(j)
-        if 'visit_motivation' in js:
-            visit_motivation.add(js['visit_motivation'])
-    except Exception as e:
-        print(i)
-        print(e, "="*100)
-
-visit_motivation_og = set()
-for i in range(len(train)):
-    visit_motivation_og.add(ast.literal_eval(train['json'][i])['visit_motivation'])
-
-
-vm_mapping = {
-    'Acute Coronary Syndrome': 'Heart Disease (Coronary Artery Disease)',
-    'Allergies': 'Allergies',
-    'Anemia': 'Anemia',
-    'Anxiety': 'Anxiety Disorders',
-    'Anxiety Disorders': 'Anxiety Disorders',
-    'Asthma': 'Asthma',
-    'Asthma (Exacerbation)': 'Asthma',
-    'COVID-19': 'COVID-19',
-    'Chronic Obstructive Pulmonary Disease (COPD)': 'Chronic Obstructive Pulmonary Disease (COPD)',
-    'Common Cold': 'Common Cold',
-    'Community-Acquired Pneumonia (CAP)': 'Pneumonia',
-    'Coronary Artery Disease': 'Heart Disease (Coronary Artery Disease)',
-    'Coronary Artery Disease (CAD)': 'Heart Disease (Coronary Artery Disease)',
-    'Depression': 'Depression',
-    'Diabetes (Type 2)': 'Diabetes (Type 2)',
-    'Ear Infection (Otitis Media)': 'Ear Infection (Otitis Media)',
-    'Eczema (Atopic Dermatitis)': 'Eczema (Atopic Dermatitis)',
-    'Exacerbation of Asthma': 'Asthma',
-    'Gastroesophageal Reflux Disease (GERD)': 'Gastroesophageal Reflux Disease (GERD)',
-    'Heart Disease (Coronary Artery Disease)': 'Heart Disease (Coronary Artery Disease)',
-    'Hypertension': 'Hypertension (High Blood Pressure)',
-    'Hypertension (High Blood Pressure)': 'Hypertension (High Blood Pressure)',
-    'Influenza': 'Influenza (Flu)',
-    'Influenza (Flu)': 'Influenza (Flu)',
-    'Major Depressive Disorder (MDD)': 'Depression',
-    'Pneumonia': 'Pneumonia',
-    'Sinusitis': 'Sinusitis',
-    'Strep Throat': 'Strep Throat',
-    'Tuberculosis (TB)': 'Tuberculosis (TB)',
-    'Urinary Tract Infection': 'Urinary Tract Infection (UTI)',
-    'Urinary Tract Infection (UTI)': 'Urinary Tract Infection (UTI)'
-}
-
-def map_visit_motivation(json_string: str):
+        return "", None
+    if isinstance(data, dict):
+        # Each mapping is skipped on its own if the field holds unhashable values, as before.
+        for mapping in (map_and_deduplicate_symptoms, map_visit_motivation):
+            try:
+                data = mapping(data)
+            except TypeError:
+                pass
+    # Literal 'None' substrings are dropped from the serialized JSON, as in the original notebook.
+    text = json.dumps(data, ensure_ascii=False).replace("None", "")
+    return text, (data if isinstance(data, dict) else None)
+
+def process_chunk(chunk: pd.DataFrame):
+    """
+    Clean one chunk of ID/json rows. Returns the ID/json frame and counters of invalid rows,
+    labels that are still outside the training vocabulary after mapping, and schema errors by field.
     """
-    Map visit_motivation using vm_mapping without altering other fields.
+    sym_normalizer, vm_normalizer = get_normalizers()
+    stats = {"rows": len(chunk), "invalid": 0, "unknown_symptoms": Counter(), "unknown_visit_motivations": Counter(),
+             "schema_errors": Counter()}
+    cleaned, parsed = [], []
+    for json_string in chunk["json"].astype(str):
+        text, data = process_record(json_string)
+        cleaned.append(text)
+        if data is None:
+            stats["invalid"] += 1
+            continue
+        parsed.append(data)
+        symptoms = data.get("symptoms")
+        if isinstance(symptoms, list):
+            stats["unknown_symptoms"].update(s for s in symptoms if isinstance(s, str) and s not in sym_normalizer.labels)
+        vm = data.get("visit_motivation")
+        if isinstance(vm, str) and vm not in vm_normalizer.labels:
+            stats["unknown_visit_motivations"][vm] += 1
+    # Report only: the whole chunk is checked against JsonOutput in one call, the output is left as cleaned.
+    validation_stats = ValidationStats()
+    validate_records(parsed, validation_stats)
+    stats["schema_errors"] = validation_stats.fields
+    return pd.DataFrame({"ID": chunk["ID"].values, "json": cleaned}), stats
+
+# ----------------------------
+# Streaming API
+# ----------------------------
+def read_results(chunksize: int = CHUNK_SIZE, source: str = None):
     """
+    Model outputs as an iterator of ID/json chunks from `source`: a results CSV, Parquet file or work queue DB
+    (all workers merged, in TEST_CSV order). By default OUTPUT_PARQUET if it exists, otherwise OUTPUT_CSV; the
+    queue is only read when named, so a stale queue DB never replaces a fresh run. Parquet is memory-mapped and only the ID and raw JSON columns are read (parsing the small JSON
+    text is cheaper than rebuilding each record from its typed columns in Python).
+    """
+    if source is None:
+        source = OUTPUT_PARQUET if OUTPUT_PARQUET and os.path.exists(OUTPUT_PARQUET) else OUTPUT_CSV
+    if source.endswith(".parquet"):
+        from columnar_output import iter_frames
+        for frame in iter_frames(source, ["ID", "raw.json"], chunksize):
+            yield frame.rename(columns={"raw.json": "json"})
+        return
+    if source.endswith(".csv"):
+        yield from pd.read_csv(source, chunksize=chunksize, dtype={"json": str})
+        return
+    from work_queue import WorkQueue
+    queue = WorkQueue(source)
+    unfinished = {status: n for status, n in queue.counts().items() if status != "done"}
+    if unfinished:
+        print(f"Warning: {source} still has unfinished tasks {unfinished}; their IDs are missing from the results.")
     try:
-        data = json.loads(json_string)
-        orig = data.get("visit_motivation")
-        data["visit_motivation"] = vm_mapping.get(orig, orig)
-        return json.dumps(data, ensure_ascii=False)
-    except (json.JSONDecodeError, TypeError):
-        return json_string
-
-sub["json"] = sub["json"].apply(map_visit_motivation)
-
-# Replace literal 'None' substrings if they appear inside the JSON string
-sub["json"] = sub["json"].astype(str).str.replace("None", "")
-
-# Final validity check (mirrors notebook)
-sub["is_valid_dict"] = sub["json"].apply(is_valid_json_dict)
+        yield from queue.iter_results(chunksize)
+    finally:
+        queue.close()
 
-# ----------------------------
-# Save final submission file
-# ----------------------------
-# Keep the Kaggle working path consistent with typical submissions
-sub[["ID", "json"]].to_csv("submission_llm.csv", index=False)
+def process_stream(chunks, workers: int = POSTPROCESS_WORKERS):
+    """
+    Yield (frame, stats) for every input chunk, in input order. With more than one worker,
+    chunks are cleaned in a process pool with a bounded number in flight.
+    """
+    if workers == 1:
+        for chunk in chunks:
+            yield process_chunk(chunk[["ID", "json"]])
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        limit = 2 * (workers or os.cpu_count() or 1)
+        for chunk in chunks:
+            in_flight.append(pool.submit(process_chunk, chunk[["ID", "json"]]))
+            if len(in_flight) >= limit:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+def build_submission(output_path: str = SUBMISSION_CSV, source: str = None, chunksize: int = CHUNK_SIZE,
+                     workers: int = POSTPROCESS_WORKERS) -> dict:
+    """
+    Stream model outputs through the cleaning pipeline into the ID/json submission CSV.
+    Returns totals of rows, invalid rows, out-of-vocabulary labels and schema errors by field.
+    """
+    totals = {"rows": 0, "invalid": 0, "unknown_symptoms": Counter(), "unknown_visit_motivations": Counter(),
+              "schema_errors": Counter()}
+    tmp_path = output_path + ".tmp"
+    header = True
+    for frame, stats in process_stream(read_results(chunksize, source), workers):
+        frame.to_csv(tmp_path, mode="w" if header else "a", header=header, index=False)
+        header = False
+        for key, value in stats.items():
+            totals[key] += value
+    if header:
+        pd.DataFrame(columns=["ID", "json"]).to_csv(tmp_path, index=False)
+    os.replace(tmp_path, output_path)
+    return totals
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Build the ID/json submission CSV from model outputs.")
+    arg_parser.add_argument("--source", default=None,
+                            help=f"Results CSV, Parquet or work queue DB (e.g. {QUEUE_DB}; default: OUTPUT_PARQUET, "
+                                 "then OUTPUT_CSV).")
+    arg_parser.add_argument("--output", default=SUBMISSION_CSV)
+    arg_parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    arg_parser.add_argument("--workers", type=int, default=POSTPROCESS_WORKERS,
+                            help="Post-processing processes (1 = in-process; default: one per CPU).")
+    args = arg_parser.parse_args()
+
+    totals = build_submission(args.output, args.source, args.chunk_size, args.workers)
+    print(f"Rows: {totals['rows']}, invalid JSON: {totals['invalid']}")
+    if totals["unknown_symptoms"]:
+        print(f"Symptoms outside the training vocabulary: {dict(totals['unknown_symptoms'].most_common(20))}")
+    if totals["unknown_visit_motivations"]:
+        print(f"Visit motivations outside the training vocabulary: {dict(totals['unknown_visit_motivations'].most_common(20))}")
+    if totals["schema_errors"]:
+        print(f"Schema errors by field: {dict(totals['schema_errors'].most_common(20))}")
+    print(f"Saved {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# conftest.py
+# Shared test setup: a small synthetic train.csv stands in for the competition data, so the vocabularies
+# (and everything built on schema_and_prompt) load without the real files or a GPU.
+
+import os
+import sys
+import tempfile
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+VISIT_MOTIVATIONS = ["Anemia", "Asthma", "Chronic Obstructive Pulmonary Disease (COPD)",
+                     "Hypertension (High Blood Pressure)", "Influenza (Flu)", "Sinusitis"]
+SYMPTOMS = ["anxiety", "chest_pain", "cough", "dizziness", "facial_pain", "fatigue", "fever", "heartburn",
+            "pale_skin", "rash", "runny_nose", "sneezing", "weight_loss"]
+
+def make_record(i: int) -> dict:
+    return {
+        "patient_info": {"age": 20 + i, "gender": "Male" if i % 2 else "Female"},
+        "visit_motivation": VISIT_MOTIVATIONS[i % len(VISIT_MOTIVATIONS)],
+        "symptoms": [SYMPTOMS[i % len(SYMPTOMS)], SYMPTOMS[(i + 5) % len(SYMPTOMS)]],
+        "vital_signs": {"heart_rate": {"value": 60 + i, "unit": "bpm"}},
+    }
+
+def make_note(record: dict) -> str:
+    return "\n".join([
+        "**Patient Information:**",
+        f"- Age: {record['patient_info']['age']}",
+        f"- Gender: {record['patient_info']['gender']}",
+        "",
+        "**Visit Motivation:**",
+        f"- Primary complaint of {record['visit_motivation'].lower()}.",
+        "",
+        "**Symptoms:**",
+        *[f"- {s.replace('_', ' ').capitalize()}" for s in record["symptoms"]],
+        "",
+        "**Vital Signs:**",
+        f"- Heart Rate: {record['vital_signs']['heart_rate']['value']} bpm",
+    ])
+
+_data_dir = tempfile.mkdtemp(prefix="extraction-tests-")
+_records = [make_record(i) for i in range(13)]
+pd.DataFrame({"ID": range(len(_records)), "Note": [make_note(r) for r in _records],
+              "json": [repr(r) for r in _records]}).to_csv(os.path.join(_data_dir, "train.csv"), index=False)
+pd.DataFrame({"ID": range(len(_records)), "Note": [make_note(r) for r in _records]}).to_csv(
+    os.path.join(_data_dir, "test.csv"), index=False)
+# Set before any module does `from config import ...`.
+config.TRAIN_CSV = os.path.join(_data_dir, "train.csv")
+config.TEST_CSV = os.path.join(_data_dir, "test.csv")
+config.VOCAB_CACHE = os.path.join(_data_dir, "schema_vocab.json")
+
+@pytest.fixture
+def records():
+    return [make_record(i) for i in range(len(_records))]
+
+@pytest.fixture(scope="session")
+def tiny_tokenizer():
+    """
+    Small byte-level BPE tokenizer trained on the schema strings and the synthetic notes.
+    """
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast
+    from model_chain import schema_snippets
+
+    text = "\n".join(schema_snippets() + [make_note(r) for r in _records])
+    bpe = Tokenizer(models.BPE())
+    bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    bpe.train_from_iterator([text], trainers.BpeTrainer(
+        vocab_size=500, special_tokens=["<|endoftext|>"], initial_alphabet=pre_tokenizers.ByteLevel.alphabet()))
+    return PreTrainedTokenizerFast(tokenizer_object=bpe, eos_token="<|endoftext|>", pad_token="<|endoftext|>")
@@ -0,0 +1,18 @@
+import pytest
+
+import backends
+
+def test_backends_implement_the_interface():
+    for cls in backends.BACKENDS.values():
+        assert not cls.__abstractmethods__, cls
+        assert isinstance(cls(), backends.Backend)
+
+def test_incomplete_backend_cannot_be_instantiated():
+    class NoTokenCount(backends.Backend):
+        def llm(self, batch_size: int = 1, strict: bool = False, max_new_tokens: int = None):
+            return None
+
+    with pytest.raises(TypeError, match="count_tokens"):
+        NoTokenCount()
+    with pytest.raises(TypeError):
+        backends.Backend()
@@ -0,0 +1,30 @@
+import pytest
+
+from compact_format import encode, expand
+
+def test_round_trip(records):
+    for record in records:
+        assert expand(encode(record)) == record
+
+def test_round_trip_keeps_non_default_units_and_floats():
+    record = {
+        "patient_info": {"age": 70, "gender": "Female"},
+        "visit_motivation": "Asthma",
+        "symptoms": ["cough"],
+        "vital_signs": {
+            "blood_pressure": {"systolic": {"value": 120, "unit": "kPa"}, "diastolic": {"value": 80, "unit": "kPa"}},
+            "temperature": {"value": 37.0, "unit": "°F"},
+            "oxygen_saturation": {"value": 96.5, "unit": "%"},
+        },
+    }
+    assert expand(encode(record)) == record
+
+@pytest.mark.parametrize("line", ["bp=120/80", "bp=120 / 80", "bp=120/ 80 mmHg", "bp= 120 /80  mmHg", "bp=120 /80mmHg"])
+def test_blood_pressure_spacing(line):
+    bp = expand(line + "\nEND")["vital_signs"]["blood_pressure"]
+    assert bp == {"systolic": {"value": 120, "unit": "mmHg"}, "diastolic": {"value": 80, "unit": "mmHg"}}
+
+def test_blood_pressure_with_one_reading():
+    assert expand("bp=120 mmHg")["vital_signs"]["blood_pressure"] == {"systolic": {"value": 120, "unit": "mmHg"}}
+    assert expand("bp=/80")["vital_signs"]["blood_pressure"] == {"diastolic": {"value": 80, "unit": "mmHg"}}
+    assert "blood_pressure" not in expand("bp=unknown")["vital_signs"]
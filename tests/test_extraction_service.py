@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+import backends
+import run_local_inference as runner
+from extraction_service import ExtractionService, MicroBatcher
+from work_queue import model_invoke_batch
+
+async def request(port: int, method: str, path: str, payload: dict = None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                 + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body)
+
+def test_concurrent_requests_are_micro_batched(records, monkeypatch, tmp_path):
+    # Free-text notes the rule-based fast path cannot resolve, so each one is answered by the stub backend.
+    notes = [f"Patient {i} was seen in clinic today; see the attached letter." for i in range(8)]
+    monkeypatch.setitem(backends._backends, "stub", backends.StubBackend(dict(zip(notes, records))))
+    monkeypatch.chdir(tmp_path)
+    calls, model_batch = [], {}
+
+    def invoke_batch(batch):
+        # Built on the batcher's worker thread, as the service does (the cache's SQLite connection is thread-bound).
+        if "invoke" not in model_batch:
+            model_batch["invoke"] = model_invoke_batch(4, backend="stub")
+        calls.append(list(batch))
+        return model_batch["invoke"](batch)
+
+    async def scenario():
+        batcher = MicroBatcher(invoke_batch, max_batch_size=4, max_wait_ms=500)
+        batcher.start()
+        server = await asyncio.start_server(ExtractionService(batcher).on_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            before = await request(port, "GET", "/metrics")
+            responses = await asyncio.gather(*[request(port, "POST", "/extract", {"note": note}) for note in notes])
+            after = await request(port, "GET", "/metrics")
+            bad = await request(port, "POST", "/extract", {"text": notes[0]})
+        batcher.task.cancel()
+        return before, responses, after, bad
+
+    try:
+        before, responses, after, bad = asyncio.run(scenario())
+    finally:
+        runner.use_backend(runner.BACKEND)
+
+    # Eight concurrent requests with a batch size of 4: two full batches, every note generated once.
+    assert [len(batch) for batch in calls] == [4, 4]
+    assert sorted(note for batch in calls for note in batch) == sorted(notes)
+    # Each response carries its own note's answer, whichever batch position it had.
+    for (status, payload), note, record in zip(responses, notes, records):
+        assert status == 200
+        assert json.loads(payload["json"]) == record
+        assert note in payload["full_response"]
+    assert before[1]["requests"] == 0 and before[1]["batches"] == 0
+    assert after[1]["requests"] == 8 and after[1]["batches"] == 2
+    assert after[1]["batch_sizes"] == {"4": 2} and after[1]["mean_batch_size"] == 4.0
+    assert after[1]["latency_ms"]["p50"] > 0
+    assert bad[0] == 400
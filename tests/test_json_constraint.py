@@ -0,0 +1,122 @@
+import json
+import os
+import subprocess
+import sys
+from typing import List, Literal, Optional
+
+import pytest
+import torch
+from pydantic import BaseModel, Field
+
+from json_constraint import TokenAutomaton, json_logits_processor, load_automaton, schema_grammar
+
+class Vital(BaseModel):
+    value: int
+    unit: str = Field(default="bpm")
+
+class Small(BaseModel):
+    symptoms: List[Literal["cough", "fever"]]
+    heart_rate: Optional[Vital] = None
+
+# Hand-made vocabulary: single characters plus a few multi-character pieces spanning grammar parts.
+PIECES = ['{', '}', '[', ']', '"', ':', ',', ' ', ', ', '"symptoms": ', '"heart_rate": ', '"value": ', '"unit": ',
+          'cough', 'fever', 'sneeze', '"cough"', 'bpm', '"bpm"', '7', '0', '01', 'x']
+TEXTS = dict(enumerate(PIECES))
+ID = {text: i for i, text in TEXTS.items()}
+
+@pytest.fixture(scope="module")
+def automaton():
+    return TokenAutomaton.compile(schema_grammar(Small), TEXTS)
+
+def walk(automaton, pieces):
+    state = automaton.start
+    for piece in pieces:
+        state = automaton.next_state(state, ID[piece])
+        if state is None:
+            return None
+    return state
+
+def allowed(automaton, state):
+    return {TEXTS[i] for i in automaton.allowed[state].tolist()}
+
+def test_allowed_token_masks(automaton):
+    assert allowed(automaton, automaton.start) == {"{", " "}
+    # Only the required key may follow, as one token or character by character.
+    assert allowed(automaton, walk(automaton, ["{"])) == {'"symptoms": ', '"'}
+    assert allowed(automaton, walk(automaton, ["{", '"symptoms": '])) == {"["}
+    # Integers have no leading zero: after "0" the member can only end (the unit is still required).
+    state = walk(automaton, ["{", '"symptoms": ', "[", "]", ", ", '"heart_rate": ', "{", '"value": '])
+    assert allowed(automaton, state) == {"0", "7"}
+    assert allowed(automaton, walk(automaton, ["{", '"symptoms": ', "[", "]", ", ", '"heart_rate": ', "{",
+                                               '"value": ', "0"])) == {",", ", "}
+    # A unit with a default is fixed to it.
+    assert walk(automaton, ["{", '"symptoms": ', "[", "]", ", ", '"heart_rate": ', "{", '"value": ', "7", "0",
+                            ", ", '"unit": ', '"bpm"', "}", "}"]) in automaton.accepting
+
+def test_literal_vocabulary_is_enforced(automaton):
+    after_quote = walk(automaton, ["{", '"symptoms": ', "[", '"'])
+    assert allowed(automaton, after_quote) == {"cough", "fever"}
+    assert walk(automaton, ["{", '"symptoms": ', "[", '"', "sneeze"]) is None
+    assert walk(automaton, ["{", '"symptoms": ', "[", '"cough"', ", ", '"', "fever", '"', "]", "}"]) is not None
+
+def test_object_end_is_accepted_only_when_complete(automaton):
+    assert walk(automaton, ["{", '"symptoms": ', "[", "]"]) not in automaton.accepting
+    done = walk(automaton, ["{", '"symptoms": ', "[", "]", "}"])
+    assert done in automaton.accepting
+    # Nothing may follow the closed object.
+    assert allowed(automaton, done) == set()
+
+def test_processor_follows_a_valid_answer(tiny_tokenizer, records):
+    from schema_and_prompt import JsonOutput
+
+    processor = json_logits_processor(tiny_tokenizer)
+    eos = tiny_tokenizer.eos_token_id
+    input_ids = tiny_tokenizer("Answer:", return_tensors="pt").input_ids
+    answer = tiny_tokenizer(json.dumps(records[0]), add_special_tokens=False).input_ids
+    for token_id in answer:
+        scores = processor(input_ids, torch.zeros(1, len(tiny_tokenizer)))
+        assert torch.isfinite(scores[0, token_id])
+        assert not torch.isfinite(scores[0, eos])
+        input_ids = torch.cat([input_ids, torch.tensor([[token_id]])], dim=-1)
+    scores = processor(input_ids, torch.zeros(1, len(tiny_tokenizer)))
+    # Once the object is closed, only EOS is left.
+    assert torch.isfinite(scores[0]).nonzero().flatten().tolist() == [eos]
+    JsonOutput.model_validate_json(tiny_tokenizer.decode(answer))
+
+def test_processor_masks_labels_outside_the_vocabulary(tiny_tokenizer, records):
+    processor = json_logits_processor(tiny_tokenizer)
+    text = json.dumps({**records[0], "symptoms": ["sore_throat"]})
+    input_ids = tiny_tokenizer("Answer:", return_tensors="pt").input_ids
+    for token_id in tiny_tokenizer(text, add_special_tokens=False).input_ids:
+        if not torch.isfinite(processor(input_ids, torch.zeros(1, len(tiny_tokenizer)))[0, token_id]):
+            break
+        input_ids = torch.cat([input_ids, torch.tensor([[token_id]])], dim=-1)
+    else:
+        pytest.fail("an unknown symptom was allowed")
+    # Rejected inside the label, once no symptom in the vocabulary starts with the text so far.
+    prefix = tiny_tokenizer.decode(input_ids[0]).rsplit('"symptoms": ["', 1)[1]
+    assert "sore_throat".startswith(prefix) and prefix != "sore_throat"
+
+def test_automaton_is_cached_on_disk(tiny_tokenizer, tmp_path):
+    first = load_automaton(tiny_tokenizer, Small, str(tmp_path))
+    [path] = os.listdir(tmp_path)
+    second = load_automaton(tiny_tokenizer, Small, str(tmp_path))
+    assert os.listdir(tmp_path) == [path]
+    assert second.lookup == first.lookup and second.accepting == first.accepting
+
+def test_cache_key_is_stable_across_processes(tiny_tokenizer, tmp_path):
+    # Character sets are frozensets, whose repr order changes with the per-process string hash seed.
+    tiny_tokenizer.save_pretrained(tmp_path)
+    script = (
+        "from transformers import AutoTokenizer\n"
+        "from json_constraint import STRING, _cache_key\n"
+        f"print(_cache_key(AutoTokenizer.from_pretrained({str(tmp_path)!r}), STRING))\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    keys = set()
+    for seed in ("1", "2"):
+        run = subprocess.run([sys.executable, "-c", script], cwd=root, capture_output=True, text=True,
+                             env={**os.environ, "PYTHONHASHSEED": seed})
+        assert run.returncode == 0, run.stderr
+        keys.add(run.stdout.split()[-1])
+    assert len(keys) == 1
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from json_repair import close_truncated, repair, repair_result
+
+@pytest.mark.parametrize("text,expected", [
+    ('{"symptoms": ["cough", "fever"', {"symptoms": ["cough", "fever"]}),
+    ('{"symptoms": ["cough", "fev', {"symptoms": ["cough", "fev"]}),
+    ('{"patient_info": {"gender": "Male"}, "visit_motivation"', {"patient_info": {"gender": "Male"}}),
+    ('{"patient_info": {"gender": "Male"}, "visit_motivation": ', {"patient_info": {"gender": "Male"}}),
+    ('{"patient_info": {"gender": "Male"}, "visit_mot', {"patient_info": {"gender": "Male"}}),
+    ('{"patient_info": {"gender": "Male", "age": 40}, ', {"patient_info": {"gender": "Male", "age": 40}}),
+    ('{"a": {"b": [1, 2]}, "c": true', {"a": {"b": [1, 2]}, "c": True}),
+])
+def test_close_truncated(text, expected):
+    assert json.loads(close_truncated(text)) == expected
+
+@pytest.mark.parametrize("text", ['{"patient_info": {"age": 3', '{"vital_signs": {"temperature": {"value": 37.', '{"x": -'])
+def test_number_cut_off_at_the_end_is_unrepairable(text):
+    assert close_truncated(text) is None
+    assert repair(text) == (None, "failed")
+
+def test_repairs():
+    assert repair('```json\n{"a": 1}\n```') == ({"a": 1}, "fence")
+    assert repair('{"a": 1,}') == ({"a": 1}, "trailing_comma")
+    assert repair('{"a": 1} {"a": 2}') == ({"a": 2}, "last_object")
+    assert repair("{'a': None}") == ({"a": None}, "python_literal")
+
+def test_missing_values_are_kept(records):
+    record = records[0]
+    del record["patient_info"]["age"], record["symptoms"]
+    text = json.dumps(record)
+    assert repair_result(["", text]) == (["", text], "missing_fields")
+
+def test_truncated_and_invalid_answers_are_regenerated(records):
+    text = json.dumps(records[0])
+    assert repair_result(["", text[:-2]]) == (None, "truncated")
+    assert repair_result(["", text.replace('"Female"', '"Unknown"')]) == (None, "invalid")
+    assert repair_result(["", "no json here"]) == (None, "unparseable")
+    assert repair_result(["", text]) == (["", text], "ok")
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from normalizer import LabelNormalizer, normalize_json, normalize_labels
+
+def test_symptoms_are_mapped_and_deduplicated():
+    data = normalize_labels({"symptoms": ["cough", "Cough", "fever"], "visit_motivation": "asthma"})
+    assert data["symptoms"] == ["cough", "fever"]
+    assert data["visit_motivation"] == "Asthma"
+
+def test_unhashable_symptoms_are_left_as_they_are():
+    text = json.dumps({"symptoms": [{"name": "cough"}, ["fever"]], "visit_motivation": "asthma"})
+    data = json.loads(normalize_json(text))
+    assert data["symptoms"] == [{"name": "cough"}, ["fever"]]
+    assert data["visit_motivation"] == "Asthma"
+
+def test_text_that_is_not_an_object_is_unchanged():
+    assert normalize_json("{oops") == "{oops"
+    assert normalize_json("[1, 2]") == "[1, 2]"
+
+VISIT_MOTIVATIONS = ["Hypertension (High Blood Pressure)", "Diabetes (Type 2)", "Pneumonia", "Influenza (Flu)",
+                     "Anemia"]
+SYMPTOMS = ["frequent_urination", "loss_of_taste_smell", "cough", "shortness_of_breath"]
+
+@pytest.mark.parametrize("value", ["Hypotension", "Diabetes (Type 1)", "Type 1 Diabetes", "Pneumonitis"])
+def test_different_conditions_are_not_merged(value):
+    assert LabelNormalizer(VISIT_MOTIVATIONS).normalize(value)[0] is None
+
+@pytest.mark.parametrize("value", ["decreased_urination", "loss_of_smell"])
+def test_different_symptoms_are_not_merged(value):
+    assert LabelNormalizer(SYMPTOMS).normalize(value)[0] is None
+
+@pytest.mark.parametrize("value,label", [
+    ("hypertension", "Hypertension (High Blood Pressure)"),
+    ("High Blood Pressure", "Hypertension (High Blood Pressure)"),
+    ("Diabetes", "Diabetes (Type 2)"),
+    ("Type 2 Diabetes", "Diabetes (Type 2)"),
+    ("Flu", "Influenza (Flu)"),
+    ("Anaemia", "Anemia"),
+    ("Pnuemonia", "Pneumonia"),
+])
+def test_variants_and_misspellings_still_match(value, label):
+    assert LabelNormalizer(VISIT_MOTIVATIONS).normalize(value)[0] == label
+
+def test_symptom_misspellings_still_match():
+    normalizer = LabelNormalizer(SYMPTOMS)
+    assert normalizer("shortness-of-breath") == "shortness_of_breath"
+    assert normalizer("frequent urinaton") == "frequent_urination"
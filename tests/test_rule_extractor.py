@@ -0,0 +1,28 @@
+import pytest
+
+from conftest import make_note
+from rule_extractor import extract_rules, split_sections, extract_visit_motivation
+
+def test_headed_note_is_fully_resolved(records):
+    for record in records:
+        assert extract_rules(make_note(record)) == record
+
+@pytest.mark.parametrize("line", [
+    "**Chief Complaint:** Rule out anemia.",
+    "Chief Complaint: history of asthma, presents for follow-up.",
+    "Reason for visit: no signs of influenza",
+    "Chief Complaint: possible sinusitis?",
+])
+def test_hedged_complaint_is_left_to_the_model(line):
+    note = "**Clinical Notes:**\n" + line
+    assert extract_visit_motivation(note, split_sections(note)) is None
+
+def test_plain_complaint_line_is_resolved():
+    note = "**Clinical Notes:**\nChief Complaint: worsening asthma over two days."
+    assert extract_visit_motivation(note, split_sections(note)) == "Asthma"
+
+def test_symptom_mentioned_outside_the_list_leaves_symptoms_to_the_model(records):
+    note = make_note(records[0]) + "\n\n**Assessment:**\nPatient also reports dizziness since yesterday."
+    assert "symptoms" not in extract_rules(note)
+    repeated = make_note(records[0]) + "\n\n**Assessment:**\nThe " + records[0]["symptoms"][0].replace("_", " ") + " persists."
+    assert extract_rules(repeated)["symptoms"] == records[0]["symptoms"]
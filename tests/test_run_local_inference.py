@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+import backends
+import run_local_inference as runner
+from conftest import make_note
+from extraction_cache import ExtractionCache, cache_key
+from json_repair import RepairStats
+
+@pytest.fixture
+def stub(records, monkeypatch):
+    notes = [make_note(r) for r in records[:2]]
+    # The second note always gets an answer no repair or regeneration can fix.
+    answers = {notes[0]: records[0], notes[1]: {"symptoms": [{"name": "cough"}]}}
+    monkeypatch.setitem(backends._backends, "stub", backends.StubBackend(answers))
+    runner.use_backend("stub")
+    yield notes
+    runner.use_backend(runner.BACKEND)
+
+def keys_of(notes):
+    keys = []
+    for note in notes:
+        static_prompt, settings = runner.cache_context(note)
+        keys.append(cache_key(note, static_prompt, runner.MODEL_ID, settings))
+    return keys
+
+@pytest.mark.parametrize("repair", [True, False])
+def test_broken_answers_are_not_cached(stub, tmp_path, repair):
+    cache = ExtractionCache(str(tmp_path / "cache.sqlite"))
+    repair_stats = RepairStats() if repair else None
+    results = dict(runner.cached_generate_results(stub, 1, cache=cache, repair_stats=repair_stats))
+    assert json.loads(results[1][1]) == {"symptoms": [{"name": "cough"}]}
+    good, broken = keys_of(stub)
+    assert cache.get(good) is not None
+    assert cache.get(broken) is None
+    if repair:
+        assert repair_stats.gave_up == 1
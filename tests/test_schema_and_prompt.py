@@ -0,0 +1,23 @@
+import os
+import subprocess
+import sys
+
+import config
+import schema_and_prompt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_artifact_is_used_without_train_csv(tmp_path):
+    assert os.path.exists(config.VOCAB_CACHE)
+    # Fresh interpreter: the vocabularies are loaded at import time.
+    script = (
+        "import config\n"
+        f"config.TRAIN_CSV = {str(tmp_path / 'missing.csv')!r}\n"
+        f"config.VOCAB_CACHE = {config.VOCAB_CACHE!r}\n"
+        "import schema_and_prompt\n"
+        "print(sorted(schema_and_prompt.symptoms))\n"
+    )
+    run = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True)
+    assert run.returncode == 0, run.stderr
+    assert "not found" in run.stdout
+    assert str(sorted(schema_and_prompt.symptoms)) in run.stdout
@@ -0,0 +1,61 @@
+import pytest
+import torch
+from transformers import Qwen2Config, Qwen2ForCausalLM, StoppingCriteriaList
+
+from conftest import make_note
+from model_chain import JsonObjectStoppingCriteria, PromptLookupDecoder, compare_with_greedy
+
+@pytest.fixture(scope="module")
+def tiny_lm(tiny_tokenizer):
+    """
+    Randomly initialized 2-layer causal LM (seeded) over the tiny BPE tokenizer, CPU only.
+    """
+    torch.manual_seed(0)
+    config = Qwen2Config(vocab_size=len(tiny_tokenizer), hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                         num_attention_heads=4, num_key_value_heads=2, eos_token_id=tiny_tokenizer.eos_token_id,
+                         pad_token_id=tiny_tokenizer.pad_token_id)
+    return Qwen2ForCausalLM(config).eval(), tiny_tokenizer
+
+@pytest.fixture
+def prompts(records):
+    return [f"Extract the JSON for this note.\n{make_note(r)}\nAnswer: " for r in records[:4]]
+
+@pytest.mark.parametrize("max_ngram,num_draft", [(1, 4), (3, 10)])
+def test_output_is_identical_to_greedy(tiny_lm, prompts, max_ngram, num_draft):
+    model, tokenizer = tiny_lm
+    decoder = PromptLookupDecoder(model, tokenizer, max_new_tokens=48, max_ngram=max_ngram, num_draft=num_draft)
+    report = compare_with_greedy(decoder, prompts)
+    assert report["identical"], report
+    # Both accepted and rejected drafts (cache crop) have to occur for the comparison to mean anything.
+    assert 0 < report["accepted"] < report["drafted"]
+
+def test_output_is_identical_to_greedy_with_json_stop(tiny_lm, prompts):
+    model, tokenizer = tiny_lm
+    stop = StoppingCriteriaList([JsonObjectStoppingCriteria(tokenizer, 48)])
+    decoder = PromptLookupDecoder(model, tokenizer, max_new_tokens=48, stopping_criteria=stop)
+    assert compare_with_greedy(decoder, [p + '{"patient_info": {"age": 4' for p in prompts])["identical"]
+
+def test_token_ids_match_generate(tiny_lm, prompts):
+    model, tokenizer = tiny_lm
+    decoder = PromptLookupDecoder(model, tokenizer, max_new_tokens=32)
+    input_ids = tokenizer(prompts[0], return_tensors="pt").input_ids
+    with torch.no_grad():
+        reference = model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), do_sample=False,
+                                   max_new_tokens=32, pad_token_id=tokenizer.pad_token_id)
+    assert decoder.generate(input_ids) == reference[0, input_ids.shape[-1]:].tolist()
+
+def test_json_stop_savings_use_the_call_budget(tiny_lm):
+    _, tokenizer = tiny_lm
+    stop = JsonObjectStoppingCriteria(tokenizer, 1000)
+    input_ids = tokenizer("Answer: ", return_tensors="pt").input_ids
+    answer = tokenizer('{"a": "}"} trailing text', return_tensors="pt").input_ids
+    closed = None
+    for step in range(answer.shape[-1]):
+        input_ids = torch.cat([input_ids, answer[:, step:step + 1]], dim=-1)
+        if stop(input_ids, None)[0]:
+            closed = step + 1
+            break
+    assert closed is not None and closed < answer.shape[-1]
+    stats = stop.pop_stats(64)
+    assert stats == [{"generated_tokens": closed, "closed": True, "tokens_saved": 64 - closed}]
+    assert stop.pop_stats(64) == []
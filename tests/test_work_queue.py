@@ -0,0 +1,102 @@
+import functools
+import json
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import config
+from stub_llm import stub_invoke_batch
+from work_queue import WorkQueue, run_worker
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    queue = WorkQueue(path)
+    assert queue.enqueue_csv(config.TEST_CSV) == 13
+    # Re-enqueueing the same IDs is a no-op.
+    assert queue.enqueue_csv(config.TEST_CSV) == 0
+    queue.close()
+    return path
+
+def test_two_workers_share_the_queue(db):
+    processed = {}
+
+    def worker(name):
+        queue = WorkQueue(db)
+        processed[name] = run_worker(queue, functools.partial(stub_invoke_batch, delay=0.01), name, 2, 0.05)
+        queue.close()
+
+    threads = [threading.Thread(target=worker, args=(name,)) for name in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue = WorkQueue(db)
+    assert queue.counts() == {"done": 13}
+    assert sum(processed.values()) == 13 and all(processed.values())
+    results = queue.results_frame()
+    # Exported in TEST_CSV order, whichever worker finished each note.
+    assert results["ID"].tolist() == [str(i) for i in pd.read_csv(config.TEST_CSV)["ID"]]
+    assert all(isinstance(json.loads(text), dict) for text in results["json"])
+
+def test_expired_lease_is_reclaimed(db):
+    crashed = WorkQueue(db, lease_seconds=0.1)
+    assert len(crashed.claim("crashed", 5)) == 5
+    queue = WorkQueue(db)
+    # While the lease holds, the other worker only gets the rest.
+    assert len(queue.claim("b", 20)) == 8
+    time.sleep(0.2)
+    reclaimed = queue.claim("b", 20)
+    assert [task_id for task_id, _ in reclaimed] == ["0", "1", "2", "3", "4"]
+
+def test_attempt_cap_on_expiry_and_release(db):
+    queue = WorkQueue(db, lease_seconds=0.05, max_attempts=2)
+    for _ in range(2):
+        assert len(queue.claim("a", 13)) == 13
+        time.sleep(0.1)
+    # Third claim: the expired leases used up their attempts.
+    assert queue.claim("a", 13) == []
+    assert queue.counts() == {"failed": 13}
+
+def test_failing_batch_is_not_retried_forever(db):
+    def broken(notes):
+        raise RuntimeError("out of memory")
+
+    queue = WorkQueue(db, max_attempts=2)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            run_worker(queue, broken, "a", 13, 0.01)
+    assert queue.counts() == {"failed": 13}
+    assert run_worker(queue, broken, "a", 13, 0.01) == 0
+
+def test_model_workers_use_the_runner_pipeline(records, monkeypatch, tmp_path):
+    import backends
+    import run_local_inference as runner
+    from json_repair import RepairStats
+    from rule_extractor import RuleStats
+    from validation import ValidationStats
+    from work_queue import model_invoke_batch
+
+    # Free-text notes the rule-based fast path cannot resolve, so every one reaches the model.
+    notes = [f"Patient {i} was seen in clinic today; see the attached letter." for i in range(4)]
+    # Labels the normalizer has to map, and one answer that stays invalid after regeneration.
+    answers = {notes[0]: {**records[0], "visit_motivation": records[0]["visit_motivation"].upper()},
+               notes[1]: {**records[1], "symptoms": [s.replace("_", " ") for s in records[1]["symptoms"]]},
+               notes[2]: {"symptoms": [{"name": "cough"}]}, notes[3]: records[3]}
+    monkeypatch.setitem(backends._backends, "stub", backends.StubBackend(answers))
+    monkeypatch.chdir(tmp_path)
+    try:
+        invoke_batch = model_invoke_batch(2, backend="stub")
+        from_worker = [out[1] for out in invoke_batch(notes)]
+        results = runner.fast_path_results(notes, 2, rule_stats=RuleStats(), repair_stats=RepairStats())
+        from_runner = {i: json_text for i, json_text, _ in runner.checked_results(results, True, 2, ValidationStats())}
+    finally:
+        runner.use_backend(runner.BACKEND)
+    assert from_worker == [from_runner[i] for i in range(len(notes))]
+    assert json.loads(from_worker[0])["visit_motivation"] == records[0]["visit_motivation"]
+    assert json.loads(from_worker[1])["symptoms"] == records[1]["symptoms"]
+    report = invoke_batch.report()
+    assert report["repair"]["gave_up"] == 1
+    assert report["validation"]["invalid"] == 1
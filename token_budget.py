@@ -0,0 +1,100 @@
+# token_budget.py
+# Per-note max_new_tokens: a cheap pre-pass counts the symptoms and vital-sign measurements a note
+# mentions and sizes the answer budget from them, with a safety margin; cut-off answers are retried larger.
+
+import argparse
+import ast
+import json
+import re
+from collections import Counter
+
+from config import (
+    TRAIN_CSV, BUDGET_BASE_TOKENS, BUDGET_SYMPTOM_TOKENS, BUDGET_VITAL_TOKENS, BUDGET_MARGIN, BUDGET_MIN_TOKENS,
+)
+from rule_extractor import SYMPTOM_MENTION, UNIT_MENTION, split_sections
+BLOOD_PRESSURE = re.compile(r"\d\s*/\s*\d")
+
+def note_features(note: str) -> dict:
+    """
+    Symptom and vital-sign counts that drive the answer length. Symptoms are the items of the symptom
+    sections (bullets or comma lists), or vocabulary mentions when there is no such section; vitals are
+    unit-bearing measurements anywhere in the note, blood pressure counting twice (systolic + diastolic).
+    """
+    sections = split_sections(note)
+    symptom_lines = [line for name, lines in sections.items() if "symptom" in name for line in lines]
+    if symptom_lines:
+        symptom_count = sum(line.count(",") + 1 for line in symptom_lines)
+    else:
+        symptom_count = len({m.lower() for m in SYMPTOM_MENTION.findall(note)})
+    measurements = UNIT_MENTION.findall(note)
+    vital_count = len(measurements) + sum(1 for m in measurements if BLOOD_PRESSURE.search(m))
+    return {"symptoms": symptom_count, "vitals": vital_count}
+
+def estimate_budget(note: str, max_tokens: int) -> int:
+    """
+    max_new_tokens for one note: skeleton + per-symptom + per-vital tokens, times BUDGET_MARGIN,
+    rounded up to a multiple of 32 (fewer distinct batch settings) and clamped to [BUDGET_MIN_TOKENS, max_tokens].
+    """
+    if not isinstance(note, str):
+        return max_tokens
+    features = note_features(note)
+    tokens = BUDGET_BASE_TOKENS + BUDGET_SYMPTOM_TOKENS * features["symptoms"] + BUDGET_VITAL_TOKENS * features["vitals"]
+    tokens = -(-int(tokens * BUDGET_MARGIN) // 32) * 32
+    return max(BUDGET_MIN_TOKENS, min(tokens, max_tokens))
+
+def json_closed(text: str) -> bool:
+    """
+    Whether the first top-level JSON object in `text` is complete (braces inside strings are ignored).
+    """
+    from backends import JsonCloseTracker
+
+    return JsonCloseTracker().feed(text)
+
+class BudgetStats:
+    """
+    Budgets handed out and retries of answers cut off at their budget.
+    """
+
+    def __init__(self, max_tokens: int = 1000):
+        self.max_tokens = max_tokens
+        self.rows = 0
+        self.budget_tokens = 0
+        self.retried = Counter()
+
+    def add(self, budgets):
+        self.rows += len(budgets)
+        self.budget_tokens += sum(budgets)
+
+    def report(self) -> dict:
+        return {
+            "rows": self.rows,
+            "mean_budget": self.budget_tokens / self.rows if self.rows else 0.0,
+            "budget_vs_fixed": self.budget_tokens / (self.rows * self.max_tokens) if self.rows else 0.0,
+            "retried": dict(self.retried),
+        }
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Check budget coverage against train.csv answers.")
+    arg_parser.add_argument("--train", default=TRAIN_CSV)
+    arg_parser.add_argument("--tokenizer", default=None, help="Tokenizer to count answer tokens (default: MODEL_ID).")
+    arg_parser.add_argument("--max-tokens", type=int, default=1000)
+    args = arg_parser.parse_args()
+
+    import pandas as pd
+    from transformers import AutoTokenizer
+    from config import MODEL_ID
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer or MODEL_ID)
+    train = pd.read_csv(args.train, usecols=["Note", "json"])
+    answers = [json.dumps(ast.literal_eval(js), ensure_ascii=False) for js in train["json"]]
+    needed = [len(ids) for ids in tokenizer(answers)["input_ids"]]
+    budgets = [estimate_budget(note, args.max_tokens) for note in train["Note"]]
+    print(json.dumps({
+        "notes": len(budgets),
+        # Fraction of notes whose reference answer fits its budget (the rest would be retried).
+        "coverage": sum(b >= n for b, n in zip(budgets, needed)) / max(len(budgets), 1),
+        "mean_answer_tokens": sum(needed) / max(len(needed), 1),
+        "max_answer_tokens": max(needed, default=0),
+        "mean_budget": sum(budgets) / max(len(budgets), 1),
+        "budget_vs_fixed": sum(budgets) / max(len(budgets) * args.max_tokens, 1),
+    }, indent=2))
@@ -0,0 +1,266 @@
+# tracing.py
+# Per-note profiling of the extraction chain: LangChain callbacks time every chain stage, light hooks on the
+# HF pipeline split the model call into tokenization / prefill / decode / detokenization, and every note is
+# written to a JSONL trace plus an aggregated Prometheus text snapshot.
+
+import json
+import os
+import resource
+import threading
+import time
+from collections import defaultdict
+
+import torch
+from langchain_core.callbacks import BaseCallbackHandler
+
+from config import TRACE_LOG, METRICS_SNAPSHOT, SNAPSHOT_EVERY
+
+def peak_memory_bytes() -> int:
+    """
+    Peak GPU memory allocated by torch if CUDA is in use, otherwise the process's peak RSS.
+    """
+    if torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated()
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class ChainTracer(BaseCallbackHandler):
+    """
+    Callback handler for `prompt | llm | parallel_chain | RunnableLambda(combine_both)`.
+    Each top-level chain run is one note; its record holds wall time per stage (by runnable name),
+    the model call breakdown, token counts and peak memory.
+    """
+
+    def __init__(self, trace_path: str = TRACE_LOG, snapshot_path: str = METRICS_SNAPSHOT,
+                 snapshot_every: int = SNAPSHOT_EVERY):
+        for path in (trace_path, snapshot_path):
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self.trace = open(trace_path, "a", encoding="utf-8")
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every
+        self.lock = threading.Lock()
+        self.parents = {}
+        self.starts = {}
+        self.names = {}
+        self.notes = {}
+        # Open model call: LLM run ids in prompt order, and per-item pipeline stats in the same order.
+        self.llm_runs, self.llm_done, self.items, self.forwards = [], 0, [], []
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.peak_memory = 0
+        self.written = 0
+
+    # ----------------------------
+    # LangChain callbacks
+    # ----------------------------
+    def _root(self, run_id):
+        while self.parents.get(run_id) is not None:
+            run_id = self.parents[run_id]
+        return run_id
+
+    def _start(self, run_id, parent_run_id):
+        self.parents[run_id] = parent_run_id
+        self.starts[run_id] = time.perf_counter()
+        if parent_run_id is None:
+            self.notes[run_id] = {"run_id": str(run_id), "start": time.time(), "stages": defaultdict(float)}
+
+    def _end(self, run_id, name: str, error=None):
+        elapsed = time.perf_counter() - self.starts.pop(run_id, time.perf_counter())
+        root = self._root(run_id)
+        parent = self.parents.pop(run_id, None)
+        note = self.notes.get(root)
+        if note is None:
+            return
+        if error is not None:
+            note["error"] = f"{type(error).__name__}: {error}"
+        if parent is None:
+            note["total_sec"] = elapsed
+            self._finish(self.notes.pop(root))
+        elif name:
+            note["stages"][name] += elapsed
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        with self.lock:
+            self._start(run_id, parent_run_id)
+            self.names[run_id] = kwargs.get("name") or (serialized or {}).get("name", "chain")
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        with self.lock:
+            self._end(run_id, self.names.pop(run_id, None))
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        with self.lock:
+            self._end(run_id, self.names.pop(run_id, None), error)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        with self.lock:
+            self._start(run_id, parent_run_id)
+            self.names[run_id] = "llm"
+            if self.llm_done == len(self.llm_runs):
+                # First prompt of a new model call.
+                self.llm_runs, self.llm_done, self.items, self.forwards = [], 0, [], []
+                if torch.cuda.is_available():
+                    torch.cuda.reset_peak_memory_stats()
+            self.llm_runs.append(run_id)
+
+    def _llm_end(self, run_id, error=None):
+        root = self._root(run_id)
+        note = self.notes.get(root)
+        if note is not None and run_id in self.llm_runs:
+            index = self.llm_runs.index(run_id)
+            if index < len(self.items):
+                note.update(self.items[index])
+            note["peak_memory_bytes"] = peak_memory_bytes()
+        self.llm_done += 1
+        self._end(run_id, self.names.pop(run_id, None), error)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self.lock:
+            self._llm_end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self.lock:
+            self._llm_end(run_id, error)
+
+    # ----------------------------
+    # HF pipeline hooks
+    # ----------------------------
+    def instrument(self, hf_pipeline):
+        """
+        Wrap preprocess (tokenization), _forward (prefill + decode, split at the first model forward)
+        and postprocess (detokenization) on a transformers text-generation pipeline instance.
+        """
+        if getattr(hf_pipeline, "_traced_by", None) is self:
+            return hf_pipeline
+        preprocess, forward, postprocess = hf_pipeline.preprocess, hf_pipeline._forward, hf_pipeline.postprocess
+        model = hf_pipeline.model
+        model_forward = model.forward
+        steps = {"active": False, "count": 0, "first": None}
+        pad_token_id = hf_pipeline.tokenizer.pad_token_id
+
+        def timed_model_forward(*args, **kwargs):
+            out = model_forward(*args, **kwargs)
+            if steps["active"]:
+                steps["count"] += 1
+                if steps["first"] is None:
+                    steps["first"] = time.perf_counter()
+            return out
+
+        def timed_preprocess(*args, **kwargs):
+            start = time.perf_counter()
+            out = preprocess(*args, **kwargs)
+            with self.lock:
+                self.items.append({"tokenize_sec": time.perf_counter() - start,
+                                   "input_tokens": int(out["input_ids"].shape[-1])})
+            return out
+
+        def timed_forward(model_inputs, *args, **kwargs):
+            steps.update(active=True, count=0, first=None)
+            start = time.perf_counter()
+            try:
+                out = forward(model_inputs, *args, **kwargs)
+            finally:
+                steps["active"] = False
+            end = time.perf_counter()
+            first = steps["first"] or end
+            batch = int(model_inputs["input_ids"].shape[0])
+            with self.lock:
+                assigned = sum(size for size, _ in self.forwards)
+                stats = {"prefill_sec": first - start, "decode_sec": end - first,
+                         "decode_steps": max(steps["count"] - 1, 0), "batch_size": batch}
+                self.forwards.append((batch, stats))
+                for item in self.items[assigned:assigned + batch]:
+                    item.update(stats)
+            return out
+
+        def timed_postprocess(model_outputs, *args, **kwargs):
+            start = time.perf_counter()
+            out = postprocess(model_outputs, *args, **kwargs)
+            elapsed = time.perf_counter() - start
+            generated = model_outputs["generated_sequence"][..., model_outputs["input_ids"].shape[-1]:]
+            if pad_token_id is not None:
+                generated_tokens = int((generated != pad_token_id).sum())
+            else:
+                generated_tokens = int(generated.shape[-1])
+            with self.lock:
+                done = sum(1 for item in self.items if "detokenize_sec" in item)
+                if done < len(self.items):
+                    self.items[done].update(detokenize_sec=elapsed, generated_tokens=generated_tokens)
+            return out
+
+        model.forward = timed_model_forward
+        hf_pipeline.preprocess = timed_preprocess
+        hf_pipeline._forward = timed_forward
+        hf_pipeline.postprocess = timed_postprocess
+        hf_pipeline._traced_by = self
+        return hf_pipeline
+
+    # ----------------------------
+    # Export
+    # ----------------------------
+    def _finish(self, note: dict):
+        note["stages"] = dict(note["stages"])
+        self.trace.write(json.dumps(note) + "\n")
+        self.trace.flush()
+        self.counts["notes"] += 1
+        self.counts["errors"] += "error" in note
+        for stage, seconds in note["stages"].items():
+            self.totals[("stage", stage)] += seconds
+            self.counts[("stage", stage)] += 1
+        for key in ("tokenize_sec", "prefill_sec", "decode_sec", "detokenize_sec"):
+            if key in note:
+                self.totals[("model", key[:-4])] += note[key]
+                self.counts[("model", key[:-4])] += 1
+        self.totals["total"] += note.get("total_sec", 0.0)
+        self.counts["input_tokens"] += note.get("input_tokens", 0)
+        self.counts["generated_tokens"] += note.get("generated_tokens", 0)
+        self.peak_memory = max(self.peak_memory, note.get("peak_memory_bytes", 0))
+        self.written += 1
+        if self.written % self.snapshot_every == 0:
+            self.write_snapshot()
+
+    def prometheus_text(self) -> str:
+        lines = [
+            "# HELP extraction_notes_total Notes traced.",
+            "# TYPE extraction_notes_total counter",
+            f"extraction_notes_total {self.counts['notes']}",
+            "# HELP extraction_errors_total Notes whose chain run raised.",
+            "# TYPE extraction_errors_total counter",
+            f"extraction_errors_total {self.counts['errors']}",
+            "# HELP extraction_note_seconds End-to-end chain time per note.",
+            "# TYPE extraction_note_seconds summary",
+            f"extraction_note_seconds_sum {self.totals['total']:.6f}",
+            f"extraction_note_seconds_count {self.counts['notes']}",
+            "# HELP extraction_stage_seconds Wall time per chain stage.",
+            "# TYPE extraction_stage_seconds summary",
+        ]
+        for kind, metric in (("stage", "extraction_stage_seconds"), ("model", "extraction_model_phase_seconds")):
+            if kind == "model":
+                lines += ["# HELP extraction_model_phase_seconds Model call split into tokenize/prefill/decode/detokenize.",
+                          "# TYPE extraction_model_phase_seconds summary"]
+            label = "stage" if kind == "stage" else "phase"
+            for key in sorted(k for k in self.counts if isinstance(k, tuple) and k[0] == kind):
+                lines.append(f'{metric}_sum{{{label}="{key[1]}"}} {self.totals[key]:.6f}')
+                lines.append(f'{metric}_count{{{label}="{key[1]}"}} {self.counts[key]}')
+        lines += [
+            "# HELP extraction_tokens_total Prompt and generated tokens.",
+            "# TYPE extraction_tokens_total counter",
+            f'extraction_tokens_total{{kind="input"}} {self.counts["input_tokens"]}',
+            f'extraction_tokens_total{{kind="generated"}} {self.counts["generated_tokens"]}',
+            "# HELP extraction_peak_memory_bytes Highest peak memory seen for a note.",
+            "# TYPE extraction_peak_memory_bytes gauge",
+            f"extraction_peak_memory_bytes {self.peak_memory}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self):
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, self.snapshot_path)
+
+    def close(self):
+        with self.lock:
+            self.write_snapshot()
+            self.trace.close()
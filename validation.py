@@ -0,0 +1,166 @@
+# validation.py
+# Batched validation and coercion against JsonOutput: the validator is compiled once, whole batches of parsed
+# extractions are checked in one call, values are coerced (numbers written as strings, default units, nulls
+# dropped) and every problem is reported per row and field.
+
+import json
+import re
+import time
+from collections import Counter
+from typing import List
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from schema_and_prompt import JsonOutput
+
+# Built once: pydantic compiles the whole schema (including the Literal vocabularies) into one validator.
+BATCH_VALIDATOR = TypeAdapter(List[JsonOutput])
+# A number, optionally followed by a unit the model copied from the note ("72 bpm", "37.2 °C", "98%").
+NUMBER_WITH_UNIT = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*(?:[a-zA-Z°%/][\w°%/ ]*)?$")
+
+# ----------------------------
+# Coercion before validation
+# ----------------------------
+def remove_nulls(d):
+    """
+    Recursively remove keys with None values from dicts and lists.
+    """
+    if isinstance(d, dict):
+        return {k: remove_nulls(v) for k, v in d.items() if v is not None}
+    if isinstance(d, list):
+        return [remove_nulls(v) for v in d if v is not None]
+    return d
+
+def _number(value):
+    if isinstance(value, str) and (match := NUMBER_WITH_UNIT.match(value)):
+        return float(match.group(1))
+    return value
+
+def prepare(data):
+    """
+    Copy of a parsed extraction with nulls removed (so missing units take their defaults) and numbers that
+    carry a unit ("72 bpm") made numeric; plain numeric strings are left to the validator's own coercion.
+    """
+    data = remove_nulls(data)
+    if not isinstance(data, dict):
+        return data
+    patient = data.get("patient_info")
+    if isinstance(patient, dict) and "age" in patient:
+        patient["age"] = _number(patient["age"])
+    vitals = data.get("vital_signs")
+    if isinstance(vitals, dict):
+        for vital in vitals.values():
+            for measurement in (vital.values() if isinstance(vital, dict) and "value" not in vital else [vital]):
+                if isinstance(measurement, dict) and "value" in measurement:
+                    measurement["value"] = _number(measurement["value"])
+    return data
+
+def dump(model: BaseModel) -> dict:
+    """
+    Validated model -> plain dict in schema order. Unset empty defaults and None are left out (like remove_nulls);
+    default units are kept; whole-number floats are written as ints, as the model writes them.
+    """
+    data = {}
+    for name in type(model).model_fields:
+        value = getattr(model, name)
+        if value is None or (name not in model.model_fields_set and value in ("", {})):
+            continue
+        if isinstance(value, BaseModel):
+            value = dump(value)
+        elif isinstance(value, float) and value.is_integer():
+            value = int(value)
+        data[name] = value
+    return data
+
+# ----------------------------
+# Batched validation
+# ----------------------------
+def _field(loc) -> str:
+    return ".".join(str(part) for part in loc)
+
+def _errors_by_row(exc: ValidationError) -> dict:
+    rows = {}
+    for err in exc.errors(include_url=False):
+        row, loc = err["loc"][0], err["loc"][1:]
+        report = {"field": _field(loc), "type": err["type"], "message": err["msg"]}
+        if not isinstance(err.get("input"), (dict, list)):
+            report["input"] = err.get("input")
+        rows.setdefault(row, []).append(report)
+    return rows
+
+def validate_records(records, stats=None):
+    """
+    Validate a batch of parsed extractions in one call. Returns [(coerced dict or None, errors), ...] in order;
+    errors are [{"field", "type", "message"[, "input"]}, ...], empty for valid rows.
+    """
+    start = time.perf_counter()
+    prepared = [prepare(record) for record in records]
+    results = [None] * len(prepared)
+    candidates = list(range(len(prepared)))
+    try:
+        models = BATCH_VALIDATOR.validate_python(prepared)
+    except ValidationError as exc:
+        # One call reports every row's errors; the rows without any are validated again as one batch.
+        for row, errors in _errors_by_row(exc).items():
+            results[row] = (None, errors)
+        candidates = [i for i in candidates if results[i] is None]
+        models = BATCH_VALIDATOR.validate_python([prepared[i] for i in candidates])
+    for i, model in zip(candidates, models):
+        results[i] = (dump(model), [])
+    if stats is not None:
+        stats.add(results, time.perf_counter() - start)
+    return results
+
+def validate_texts(texts, stats=None):
+    """
+    validate_records on JSON texts. Returns [(JSON text, errors), ...]: the coerced JSON for valid rows,
+    the text unchanged for invalid ones (unparseable text gets a single "json_invalid" error).
+    """
+    start = time.perf_counter()
+    parsed, outputs = [], [None] * len(texts)
+    for i, text in enumerate(texts):
+        try:
+            data = json.loads(text)
+        except (json.JSONDecodeError, TypeError):
+            data = None
+        if isinstance(data, dict):
+            parsed.append((i, data))
+        else:
+            outputs[i] = (text, [{"field": "", "type": "json_invalid", "message": "not a JSON object"}])
+    results = validate_records([data for _, data in parsed])
+    for (i, _), (data, errors) in zip(parsed, results):
+        outputs[i] = (texts[i] if errors else json.dumps(data, ensure_ascii=False), errors)
+    if stats is not None:
+        stats.add(outputs, time.perf_counter() - start)
+    return outputs
+
+class ValidationStats:
+    """
+    Valid and invalid rows, error counts per field (list positions collapsed: symptoms.3 -> symptoms.*)
+    and per error type, and the validation cost per row.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.invalid = 0
+        self.fields = Counter()
+        self.types = Counter()
+        self.seconds = 0.0
+
+    def add(self, results, seconds: float):
+        self.rows += len(results)
+        self.seconds += seconds
+        for _, errors in results:
+            self.invalid += bool(errors)
+            for err in errors:
+                self.fields[re.sub(r"\.\d+(?=\.|$)", ".*", err["field"])] += 1
+                self.types[err["type"]] += 1
+
+    def report(self) -> dict:
+        return {
+            "rows": self.rows,
+            "invalid": self.invalid,
+            "errors_by_field": dict(self.fields.most_common()),
+            "errors_by_type": dict(self.types.most_common()),
+            "us_per_row": 1e6 * self.seconds / self.rows if self.rows else 0.0,
+        }
@@ -0,0 +1,250 @@
+# work_queue.py
+# SQLite-backed work queue: any number of inference workers lease batches of notes,
+# expired leases are reclaimed after a crash, and results land in one shared table.
+
+import argparse
+import os
+import socket
+import sqlite3
+import time
+import pandas as pd
+
+from config import (
+    TEST_CSV, QUEUE_DB, OUTPUT_CSV, BATCH_SIZE, CHUNK_SIZE, LEASE_SECONDS, MAX_ATTEMPTS, COMPACT_LOG, BACKEND,
+    DYNAMIC_EXAMPLES,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    note TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    lease_owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, position);
+CREATE TABLE IF NOT EXISTS results (
+    id TEXT PRIMARY KEY,
+    json TEXT,
+    full_response TEXT,
+    worker TEXT,
+    finished REAL
+);
+"""
+
+class WorkQueue:
+    """
+    Lease-based queue over a local SQLite file. Task status moves
+    pending -> leased -> done, or back to pending when a lease expires or is released;
+    a task leased more than `max_attempts` times is marked failed.
+    """
+
+    def __init__(self, path: str = QUEUE_DB, lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def enqueue_csv(self, csv_path: str = TEST_CSV, chunksize: int = CHUNK_SIZE) -> int:
+        """
+        Add every note of `csv_path`; IDs already queued are left untouched.
+        """
+        added = 0
+        position = self.conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM tasks").fetchone()[0]
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+            rows = [(str(i), position + k, note) for k, (i, note) in enumerate(zip(chunk["ID"], chunk["Note"]))]
+            position += len(rows)
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO tasks (id, position, note) VALUES (?, ?, ?)", rows)
+            added += self.conn.total_changes - before
+        return added
+
+    def claim(self, worker: str, n: int):
+        """
+        Lease up to `n` pending notes to `worker`; returns [(id, note), ...].
+        Expired leases are reclaimed first, so a crashed worker's notes go back into circulation.
+        """
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "lease_owner = NULL, lease_expires = NULL WHERE status = 'leased' AND lease_expires < ?",
+                (self.max_attempts, now),
+            )
+            rows = self.conn.execute(
+                "SELECT id, note FROM tasks WHERE status = 'pending' ORDER BY position LIMIT ?", (n,)
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                [(worker, now + self.lease_seconds, task_id) for task_id, _ in rows],
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def complete(self, worker: str, results):
+        """
+        Store [(id, json, full_response), ...] and mark the tasks done.
+        A late result from a worker whose lease expired is still accepted (the work is identical).
+        """
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results (id, json, full_response, worker, finished) VALUES (?, ?, ?, ?, ?)",
+                [(task_id, json_text, full_response, worker, now) for task_id, json_text, full_response in results],
+            )
+            self.conn.executemany(
+                "UPDATE tasks SET status = 'done', lease_owner = NULL, lease_expires = NULL WHERE id = ?",
+                [(task_id,) for task_id, _, _ in results],
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def release(self, worker: str, ids):
+        """
+        Hand leased notes back immediately (e.g. after a failed generate call); notes that already used
+        `max_attempts` leases are marked failed instead, so a batch that always fails is not retried forever.
+        """
+        self.conn.executemany(
+            "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "lease_owner = NULL, lease_expires = NULL WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            [(self.max_attempts, task_id, worker) for task_id in ids],
+        )
+
+    def counts(self) -> dict:
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+
+    def results_frame(self) -> pd.DataFrame:
+        """
+        Merged ID/json/full_response results of all workers, in the original TEST_CSV order.
+        """
+        return pd.read_sql_query(
+            "SELECT t.id AS ID, r.json AS json, r.full_response AS full_response "
+            "FROM tasks t JOIN results r ON r.id = t.id ORDER BY t.position",
+            self.conn,
+        )
+
+    def iter_results(self, chunksize: int = CHUNK_SIZE):
+        """
+        Same rows as results_frame, streamed in chunks of `chunksize`.
+        """
+        return pd.read_sql_query(
+            "SELECT t.id AS ID, r.json AS json, r.full_response AS full_response "
+            "FROM tasks t JOIN results r ON r.id = t.id ORDER BY t.position",
+            self.conn,
+            chunksize=chunksize,
+        )
+
+    def close(self):
+        self.conn.close()
+
+def model_invoke_batch(batch_size: int = BATCH_SIZE, compact: bool = False, backend: str = BACKEND,
+                       normalize: bool = True):
+    """
+    notes -> [[full_response, json], ...] through the same result pipeline as run_local_inference.main with
+    its defaults: rule-based fast path, extraction cache, the length-bucketed chain on `backend` (loads the
+    model) with inline repair and regeneration, label normalization and batch schema validation. With
+    `compact`, full_response is the continuation + prompt-hash form of prompt_registry.py; without `normalize`,
+    symptom / visit-motivation labels are returned as generated.
+    The returned function's `report()` gives the worker's repair / validation / fast-path stats.
+    """
+    from extraction_cache import ExtractionCache
+    from json_repair import RepairStats
+    from prompt_registry import PromptRegistry
+    from rule_extractor import RuleStats
+    from validation import ValidationStats
+    from run_local_inference import (checked_results, compact_response, fast_path_results, use_backend,
+                                     use_example_store)
+
+    cache = ExtractionCache()
+    rule_stats = RuleStats()
+    repair_stats = RepairStats()
+    validation_stats = ValidationStats()
+    registry = PromptRegistry() if compact else None
+    use_backend(backend)
+    if DYNAMIC_EXAMPLES:
+        from example_store import load_store
+        use_example_store(load_store())
+
+    def invoke_batch(notes):
+        results = [None] * len(notes)
+        generated = fast_path_results(notes, batch_size, cache=cache, rule_stats=rule_stats,
+                                      repair_stats=repair_stats)
+        checked = checked_results(generated, normalize, max(batch_size, 1), validation_stats)
+        for i, json_text, full_response in checked:
+            if registry is not None:
+                full_response = compact_response(registry, full_response, notes[i])
+            results[i] = [full_response, json_text]
+        return results
+
+    def report():
+        return {"rules": rule_stats.report(), "repair": repair_stats.report(), "validation": validation_stats.report()}
+
+    invoke_batch.report = report
+    return invoke_batch
+
+def run_worker(queue: WorkQueue, invoke_batch, worker: str, batch_size: int = BATCH_SIZE, poll_seconds: float = 5.0):
+    """
+    Claim batches until no work is pending or leased. While other workers still hold leases,
+    keep polling so their notes are picked up if they crash and the leases expire.
+    """
+    processed = 0
+    while True:
+        tasks = queue.claim(worker, batch_size)
+        if not tasks:
+            if queue.counts().get("leased", 0) == 0:
+                break
+            time.sleep(poll_seconds)
+            continue
+        ids = [task_id for task_id, _ in tasks]
+        try:
+            outputs = invoke_batch([note for _, note in tasks])
+        except Exception:
+            queue.release(worker, ids)
+            raise
+        queue.complete(worker, [(task_id, out[1], out[0]) for task_id, out in zip(ids, outputs)])
+        processed += len(tasks)
+        print(f"Worker {worker}: {processed} notes completed.")
+    return processed
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Shared work queue for parallel inference workers.")
+    arg_parser.add_argument("command", choices=["init", "worker", "status", "export"])
+    arg_parser.add_argument("--db", default=QUEUE_DB)
+    arg_parser.add_argument("--csv", default=TEST_CSV, help="Notes to enqueue (init).")
+    arg_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    arg_parser.add_argument("--stub", action="store_true", help="Use the stub model instead of the LLM (worker).")
+    arg_parser.add_argument("--backend", choices=["hf", "cpu", "stub"], default=BACKEND,
+                            help="Inference backend of this worker, e.g. cpu on nodes without a GPU.")
+    arg_parser.add_argument("--output", default=OUTPUT_CSV, help="Merged CSV to write (export).")
+    args = arg_parser.parse_args()
+
+    queue = WorkQueue(args.db)
+    if args.command == "init":
+        print(f"Enqueued {queue.enqueue_csv(args.csv)} notes.")
+    elif args.command == "worker":
+        if args.stub:
+            from stub_llm import stub_invoke_batch as invoke_batch
+        else:
+            invoke_batch = model_invoke_batch(args.batch_size, COMPACT_LOG, args.backend)
+        run_worker(queue, invoke_batch, f"{socket.gethostname()}-{os.getpid()}", args.batch_size)
+        if not args.stub:
+            from backends import get_backend, record_throughput
+            print(f"Worker stats: {invoke_batch.report()}")
+            record_throughput(get_backend(args.backend).report())
+    elif args.command == "status":
+        print(queue.counts())
+    elif args.command == "export":
+        queue.results_frame().to_csv(args.output, index=False)
+    queue.close()